@@ -4,10 +4,53 @@ ftrace 日志分析脚本
 用于分析 sched_switch 事件并统计各种指标
 """
 
+import argparse
+import os
 import re
 import sys
+from array import array
 from collections import Counter, defaultdict
-from typing import Dict, List, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+# 共享的 mmap 日志读取与解析缓存模块位于 ftrace-analyzer skill 的 scripts 目录
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'skills', 'ftrace-analyzer', 'scripts')
+sys.path.insert(0, SCRIPTS_DIR)
+
+from ftrace_cache import default_cache
+from ftrace_reader import TraceReader, split_file_ranges
+from trace_codec import compression
+
+
+class SchedSwitch(NamedTuple):
+    """sched_switch 事件的紧凑记录（基于 tuple，避免每行分配 dict）"""
+    cpu: Optional[str]
+    timestamp: Optional[float]
+    prev_comm: Optional[str]
+    prev_pid: Optional[str]
+    prev_prio: Optional[str]
+    prev_state: Optional[str]
+    next_comm: Optional[str]
+    next_pid: Optional[str]
+    next_prio: Optional[str]
+
+
+# 预编译的单遍扫描正则：一次匹配即可取出 CPU、时间戳及全部 prev_/next_ 字段
+SCHED_SWITCH_PATTERN = re.compile(
+    r'\[(\d+)\].*?\s(\d+\.\d+):\s.*?'
+    r'prev_comm=(\S+) prev_pid=(\d+) prev_prio=(\S+) prev_state=([A-Z])?\S* '
+    r'==> next_comm=(\S+) next_pid=(\d+) next_prio=(\S+)'
+)
+
+# 扫描结果中的计数器名称（并行模式下按名称合并）
+COUNTER_NAMES = ('next_comm', 'prev_comm', 'cpu', 'prev_state', 'd_state', 'virtualization')
+
+VIRTUALIZATION_KEYWORDS = ['kvm', 'qemu', 'vhost']
+
+# 列式表的列（均为 names 中的字符串编码）及其在解析缓存中的类别名
+TABLE_COLUMNS = ('cpu', 'prev_comm', 'prev_state', 'next_comm')
+CACHE_KIND = 'sched_switch'
 
 def parse_sched_switch(line: str) -> Dict[str, str]:
     """解析 sched_switch 事件行"""
@@ -50,70 +93,188 @@ def parse_sched_switch(line: str) -> Dict[str, str]:
     
     return result
 
-def analyze_ftrace_log(file_path: str):
+def parse_sched_switch_record(line: str) -> Optional[SchedSwitch]:
+    """单遍解析 sched_switch 事件行，返回 SchedSwitch 记录
+
+    标准格式的行只执行一次正则匹配；字段不完整或格式特殊的行
+    回退到 parse_sched_switch，保证统计结果与逐字段解析完全一致。
+    """
+    match = SCHED_SWITCH_PATTERN.search(line)
+    if match:
+        cpu, timestamp, prev_comm, prev_pid, prev_prio, prev_state, \
+            next_comm, next_pid, next_prio = match.groups()
+        return SchedSwitch(cpu, float(timestamp), prev_comm, prev_pid, prev_prio,
+                           prev_state, next_comm, next_pid, next_prio)
+
+    result = parse_sched_switch(line)
+    if not result:
+        return None
+    return SchedSwitch(result.get('cpu'), result.get('timestamp'),
+                       result.get('prev_comm'), result.get('prev_pid'), None,
+                       result.get('prev_state'), result.get('next_comm'),
+                       result.get('next_pid'), None)
+
+def new_scan_stats() -> Dict:
+    """创建空的扫描统计结果"""
+    stats = {'total_events': 0}
+    for name in COUNTER_NAMES:
+        stats[name] = Counter()
+    return stats
+
+def new_switch_table() -> Dict:
+    """创建空的 sched_switch 列式表
+
+    每个 sched_switch 事件占一行，TABLE_COLUMNS 中的每列保存字符串编码
+    （names 中的下标，0 表示字段缺失）；total_events 为包含 sched_switch:
+    的行数（含无法解析的行）。该表即 analyze_ftrace 在解析缓存中的内容。
+    """
+    return {'names': [None], 'codes': {None: 0}, 'total_events': 0,
+            'columns': {name: array('I') for name in TABLE_COLUMNS}}
+
+def scan_switch_table(file_path: str, start: int = 0, end: Optional[int] = None,
+                      show_progress: bool = False) -> Dict:
+    """扫描文件中 [start, end) 字节范围内的 sched_switch 事件，生成列式表
+
+    start/end 必须位于行边界（见 split_file_ranges）；串行模式与并行
+    worker 共用本函数，保证两条路径的结果一致。
+    """
+    table = new_switch_table()
+    names, codes = table['names'], table['codes']
+    appends = [table['columns'][name].append for name in TABLE_COLUMNS]
+    total_events = 0
+
+    with TraceReader(file_path) as reader:
+        # 在原始字节上预过滤，只有包含 sched_switch: 的行才会被解码
+        for line in reader.iter_lines(b'sched_switch:', start, end):
+            total_events += 1
+            
+            # 解析事件
+            event = parse_sched_switch_record(line)
+            
+            if event is None:
+                continue
+            
+            for append, value in zip(appends, (event.cpu, event.prev_comm,
+                                               event.prev_state, event.next_comm)):
+                code = codes.get(value)
+                if code is None:
+                    code = codes[value] = len(names)
+                    names.append(value)
+                append(code)
+            
+            # 显示进度
+            if show_progress and total_events % 10000 == 0:
+                print(f"已处理 {total_events} 个调度事件...")
+    
+    table['total_events'] = total_events
+    return table
+
+def merge_switch_tables(tables: List[Dict]) -> Dict:
+    """按文件顺序拼接各范围的列式表（字符串编码重新映射到合并后的 names）"""
+    merged = new_switch_table()
+    names, codes = merged['names'], merged['codes']
+    for table in tables:
+        merged['total_events'] += table['total_events']
+        remap = []
+        for value in table['names']:
+            code = codes.get(value)
+            if code is None:
+                code = codes[value] = len(names)
+                names.append(value)
+            remap.append(code)
+        for name in TABLE_COLUMNS:
+            merged['columns'][name].extend(map(remap.__getitem__, table['columns'][name]))
+    return merged
+
+def stats_from_table(table: Dict) -> Dict:
+    """由列式表计算统计结果
+
+    编码按首次出现顺序分配，按编码计数后再映射回字符串，Counter 的插入
+    顺序（决定 most_common 中并列项的顺序）与逐行统计完全一致。
+    """
+    stats = new_scan_stats()
+    stats['total_events'] = table['total_events']
+    names, columns = table['names'], table['columns']
+    prev_codes, state_codes = columns['prev_comm'], columns['prev_state']
+
+    for name in ('next_comm', 'prev_comm', 'cpu', 'prev_state'):
+        stats[name].update({names[code]: count
+                            for code, count in Counter(columns[name]).items() if code})
+
+    # 检查 D 状态（不可中断睡眠）
+    if 'D' in names:
+        d_code = names.index('D')
+        d_state = Counter(p for p, s in zip(prev_codes, state_codes) if s == d_code and p)
+        stats['d_state'].update({names[code]: count for code, count in d_state.items()})
+
+    # 检查虚拟化相关进程：每命中一个关键字计一次，prev_comm 先于 next_comm
+    weights = [0 if value is None else
+               sum(1 for keyword in VIRTUALIZATION_KEYWORDS if keyword in value.lower())
+               for value in names]
+    if any(weights):
+        virtualization = stats['virtualization']
+        for prev, nxt in zip(prev_codes, columns['next_comm']):
+            if weights[prev]:
+                virtualization[names[prev]] += weights[prev]
+            if weights[nxt]:
+                virtualization[names[nxt]] += weights[nxt]
+    return stats
+
+def scan_sched_switch(file_path: str, start: int = 0, end: Optional[int] = None,
+                      show_progress: bool = False) -> Dict:
+    """扫描文件中 [start, end) 字节范围内的 sched_switch 事件并统计"""
+    return stats_from_table(scan_switch_table(file_path, start, end, show_progress))
+
+def _scan_range_worker(args: Tuple[str, int, int]) -> Dict:
+    file_path, start, end = args
+    table = scan_switch_table(file_path, start, end)
+    del table['codes']
+    return table
+
+def load_switch_table(file_path: str, jobs: int = 1, cache=None) -> Dict:
+    """获取 sched_switch 列式表：优先读取解析缓存，未命中时扫描并写入缓存
+
+    jobs > 1 时按字节范围多进程并行扫描；cache=False 时不使用缓存。
+    压缩的日志 (.gz/.zst) 在后台线程中流式解压，只能顺序扫描。
+    """
+    if cache is None:
+        cache = default_cache()
+    if cache:
+        entry = cache.load(file_path, CACHE_KIND)
+        if entry is not None:
+            columns, meta = entry
+            print("命中解析缓存，跳过日志扫描")
+            return {'names': meta['names'], 'total_events': meta['total_events'], 'columns': columns}
+
+    if jobs > 1 and compression(file_path):
+        print("压缩的日志按顺序流式解压扫描，忽略 --jobs")
+        jobs = 1
+    if jobs <= 1:
+        table = scan_switch_table(file_path, show_progress=True)
+    else:
+        ranges = split_file_ranges(file_path, jobs)
+        print(f"使用 {len(ranges)} 个进程并行扫描...")
+        with ProcessPoolExecutor(max_workers=len(ranges)) as executor:
+            table = merge_switch_tables(list(executor.map(
+                _scan_range_worker, [(file_path, start, end) for start, end in ranges])))
+
+    if cache:
+        cache.store(file_path, CACHE_KIND, table['columns'],
+                    {'names': table['names'], 'total_events': table['total_events']})
+    return table
+
+def scan_ftrace_log(file_path: str, jobs: int = 1, cache=None) -> Dict:
+    """扫描整个日志文件并统计；jobs > 1 时按字节范围多进程并行扫描"""
+    return stats_from_table(load_switch_table(file_path, jobs, cache))
+
+def analyze_ftrace_log(file_path: str, jobs: int = 1, cache=None):
     """分析 ftrace 日志文件"""
     
     print(f"正在分析 ftrace 日志文件: {file_path}")
     print("=" * 80)
     
-    # 初始化计数器
-    next_comm_counter = Counter()
-    prev_comm_counter = Counter()
-    cpu_counter = Counter()
-    prev_state_counter = Counter()
-    d_state_processes = Counter()
-    virtualization_processes = Counter()
-    
-    total_events = 0
-    virtualization_keywords = ['kvm', 'qemu', 'vhost']
-    
     try:
-        with open(file_path, 'r') as f:
-            for line_num, line in enumerate(f, 1):
-                if 'sched_switch:' in line:
-                    total_events += 1
-                    
-                    # 解析事件
-                    event = parse_sched_switch(line)
-                    
-                    if not event:
-                        continue
-                    
-                    # 统计 next_comm
-                    if 'next_comm' in event:
-                        next_comm_counter[event['next_comm']] += 1
-                    
-                    # 统计 prev_comm
-                    if 'prev_comm' in event:
-                        prev_comm_counter[event['prev_comm']] += 1
-                    
-                    # 统计 CPU
-                    if 'cpu' in event:
-                        cpu_counter[event['cpu']] += 1
-                    
-                    # 统计 prev_state
-                    if 'prev_state' in event:
-                        prev_state_counter[event['prev_state']] += 1
-                        
-                        # 检查 D 状态（不可中断睡眠）
-                        if event['prev_state'] == 'D' and 'prev_comm' in event:
-                            d_state_processes[event['prev_comm']] += 1
-                    
-                    # 检查虚拟化相关进程
-                    if 'prev_comm' in event:
-                        for keyword in virtualization_keywords:
-                            if keyword in event['prev_comm'].lower():
-                                virtualization_processes[event['prev_comm']] += 1
-                    
-                    if 'next_comm' in event:
-                        for keyword in virtualization_keywords:
-                            if keyword in event['next_comm'].lower():
-                                virtualization_processes[event['next_comm']] += 1
-                    
-                    # 显示进度
-                    if total_events % 10000 == 0:
-                        print(f"已处理 {total_events} 个调度事件...")
-    
+        stats = scan_ftrace_log(file_path, jobs, cache)
     except FileNotFoundError:
         print(f"错误: 文件 {file_path} 不存在")
         return
@@ -121,6 +282,18 @@ def analyze_ftrace_log(file_path: str):
         print(f"读取文件时出错: {e}")
         return
     
+    print_report(stats)
+
+def print_report(stats: Dict):
+    """根据扫描统计结果输出分析报告"""
+    total_events = stats['total_events']
+    next_comm_counter = stats['next_comm']
+    prev_comm_counter = stats['prev_comm']
+    cpu_counter = stats['cpu']
+    prev_state_counter = stats['prev_state']
+    d_state_processes = stats['d_state']
+    virtualization_processes = stats['virtualization']
+    
     print(f"\n分析完成！总共处理了 {total_events} 个 sched_switch 事件")
     print("=" * 80)
     
@@ -258,8 +431,12 @@ def analyze_ftrace_log(file_path: str):
         print("未发现进程处于 D 状态")
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("用法: python analyze_ftrace.py <ftrace_log_file>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="分析 ftrace 日志中的 sched_switch 事件")
+    parser.add_argument("file", help="ftrace 日志文件路径 (可以是 .gz/.zst 压缩文件)")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="并行扫描的进程数 (默认 1，即串行)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="不读写解析缓存 (缓存目录见 FTRACE_CACHE_DIR)")
+    args = parser.parse_args()
     
-    analyze_ftrace_log(sys.argv[1])
\ No newline at end of file
+    analyze_ftrace_log(args.file, args.jobs, False if args.no_cache else None)
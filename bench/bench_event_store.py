@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+列式事件存储基准测试
+对比「每个事件一个 Python 对象」与 EventStore（并行类型数组）的内存占用，
+以及间隔检测 / 时间直方图 / QoS 周期检测的耗时。
+
+默认构造 1 亿个合成事件的列式存储；对象列表基线只构造 --baseline-events 个事件，
+内存与耗时按事件数线性外推（1 亿个对象本身就需要 20GB 以上内存）。
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), 'skills', 'ftrace-analyzer', 'scripts'))
+
+from ftrace_analyzer import Analyzer
+from ftrace_columns import EventStore, bin_counts, np
+from ftrace_event import Event
+
+COMMS = ['swapper/0', 'kube-apiserver', 'containerd', 'kworker/u16:0', 'qemu-kvm',
+         'ksoftirqd/1', 'rcu_sched', 'java', 'nginx', 'etcd']
+PIDS = [0, 3711, 2634, 7828, 4120, 16, 11, 9001, 1502, 2210]
+EVENT_TYPES = ['sched_switch', 'sched_wakeup', 'irq_handler_entry', 'softirq_entry']
+BATCH = 1 << 20
+
+
+def synthetic_columns(count: int, cpus: int, seed: int):
+    """按批生成合成事件的各列 (ts, cpu, task, event, next_task)"""
+    if np is not None:
+        rng = np.random.default_rng(seed)
+        base = 7541.0
+        for start in range(0, count, BATCH):
+            n = min(BATCH, count - start)
+            ts = base + np.cumsum(rng.integers(1, 20, n)) / 1e6
+            base = float(ts[-1])
+            yield (ts, rng.integers(0, cpus, n), rng.integers(0, len(PIDS), n),
+                   rng.integers(0, len(EVENT_TYPES), n), rng.integers(0, len(PIDS), n))
+        return
+    rng = random.Random(seed)
+    t = 7541.0
+    for start in range(0, count, BATCH):
+        n = min(BATCH, count - start)
+        ts = []
+        for _ in range(n):
+            t += rng.randrange(1, 20) / 1e6
+            ts.append(t)
+        yield (ts, [rng.randrange(cpus) for _ in range(n)], [rng.randrange(len(PIDS)) for _ in range(n)],
+               [rng.randrange(len(EVENT_TYPES)) for _ in range(n)],
+               [rng.randrange(len(PIDS)) for _ in range(n)])
+
+
+def build_store(count: int, cpus: int, seed: int) -> EventStore:
+    store = EventStore()
+    store.comms.extend(COMMS)
+    store.event_types.extend(EVENT_TYPES)
+    store._event_codes.update({name.encode(): code for code, name in enumerate(EVENT_TYPES)})
+    cols = store.arrays
+    pid_of = PIDS
+    pid_lut = np.asarray(PIDS, dtype=np.int32) if np is not None else None
+    for ts, cpu, task, event, next_task in synthetic_columns(count, cpus, seed):
+        if np is not None:
+            switch = event == 0
+            batch = {
+                'ts': ts, 'cpu': cpu, 'pid': pid_lut[task], 'comm': task, 'event': event,
+                'state': np.where(switch, 1, 0), 'next_pid': np.where(switch, pid_lut[next_task], -1),
+                'next_comm': np.where(switch, next_task, 0), 'offset': np.zeros(len(ts)),
+            }
+            for name, col in cols.items():
+                col.frombytes(batch[name].astype(col.typecode).tobytes())
+        else:
+            cols['ts'].extend(ts)
+            cols['cpu'].extend(cpu)
+            cols['pid'].extend(pid_of[k] for k in task)
+            cols['comm'].extend(task)
+            cols['event'].extend(event)
+            cols['state'].extend(1 if e == 0 else 0 for e in event)
+            cols['next_pid'].extend(pid_of[k] if e == 0 else -1 for k, e in zip(next_task, event))
+            cols['next_comm'].extend(k if e == 0 else 0 for k, e in zip(next_task, event))
+            cols['offset'].extend([0] * len(ts))
+    store.states.append('S')
+    return store
+
+
+def build_objects(count: int, cpus: int, seed: int) -> list:
+    events = []
+    for ts, cpu, task, event, next_task in synthetic_columns(count, cpus, seed):
+        for t, c, k, e, nk in zip(ts, cpu, task, event, next_task):
+            details = (f"prev_comm={COMMS[k]} prev_pid={PIDS[k]} prev_prio=120 prev_state=S ==> "
+                       f"next_comm={COMMS[nk]} next_pid={PIDS[nk]} next_prio=120") if e == 0 else ''
+            events.append(Event(float(t), int(c), PIDS[k], COMMS[k], EVENT_TYPES[e], details))
+    return events
+
+
+# ==================== 对象列表基线 ====================
+
+def object_gaps(events, threshold):
+    ordered = sorted(events, key=lambda e: e.timestamp)
+    return [(a, b) for a, b in zip(ordered, ordered[1:]) if b.timestamp - a.timestamp > threshold]
+
+
+def object_histogram(events, bin_size):
+    start = min(e.timestamp for e in events)
+    counts = {}
+    for e in events:
+        k = int((e.timestamp - start) // bin_size)
+        counts[k] = counts.get(k, 0) + 1
+    return counts
+
+
+def object_qos(events, min_gap, max_gap):
+    per_cpu = {}
+    for e in sorted(events, key=lambda e: (e.cpu, e.timestamp)):
+        per_cpu.setdefault(e.cpu, []).append(e)
+    gaps = {}
+    for cpu, cpu_events in per_cpu.items():
+        gaps[cpu] = [b.timestamp - a.timestamp for a, b in zip(cpu_events, cpu_events[1:])
+                     if min_gap < b.timestamp - a.timestamp <= max_gap]
+    return gaps
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="列式事件存储内存与分析耗时基准测试")
+    parser.add_argument("--events", type=int, default=100_000_000, help="列式存储的事件数")
+    parser.add_argument("--baseline-events", type=int, default=1_000_000,
+                        help="对象列表基线的事件数（结果线性外推到 --events）")
+    parser.add_argument("--cpus", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    scale = args.events / args.baseline_events
+
+    print(f"NumPy: {'可用（向量化内核）' if np is not None else '不可用（数组循环回退）'}")
+    print(f"构造对象列表基线: {args.baseline_events} 个事件 ...")
+    tracemalloc.start()
+    objects = build_objects(args.baseline_events, args.cpus, args.seed)
+    object_bytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    object_times = {
+        'gaps': timed(object_gaps, objects, 10e-6),
+        'histogram': timed(object_histogram, objects, 0.001),
+        'qos': timed(object_qos, objects, 0.004, 0.020),
+    }
+    del objects
+
+    print(f"构造列式存储: {args.events} 个事件 ...")
+    start = time.perf_counter()
+    store = build_store(args.events, args.cpus, args.seed)
+    build_time = time.perf_counter() - start
+    analyzer = Analyzer(None, store=store)
+    # 排序和时间范围在第一次分析时计算并缓存，单独计时
+    order_time = timed(store.order) + timed(store.order, 'cpu') + timed(store.time_range)
+    first, last = store.time_range()
+    column_times = {
+        'gaps': timed(analyzer.detect_time_anomalies, 10),
+        'histogram': timed(lambda: bin_counts(store.column('ts'), first, 0.001,
+                                              int((last - first) // 0.001) + 1)),
+        'qos': timed(analyzer.detect_qos_patterns),
+    }
+
+    print("-" * 78)
+    print(f"{'项目':<24} {'对象列表(外推)':>18} {'列式存储':>14} {'倍数':>10}")
+    print("-" * 78)
+    print(f"{'内存 (MB)':<24} {object_bytes * scale / 2**20:>18.0f} {store.nbytes / 2**20:>14.0f} "
+          f"{object_bytes * scale / max(store.nbytes, 1):>10.1f}")
+    print(f"{'每事件字节':<24} {object_bytes / args.baseline_events:>18.0f} "
+          f"{store.nbytes / max(len(store), 1):>14.0f}")
+    for name, label in (('gaps', '间隔检测 (秒)'), ('histogram', '时间直方图 (秒)'), ('qos', 'QoS 周期检测 (秒)')):
+        projected = object_times[name] * scale
+        print(f"{label:<24} {projected:>18.2f} {column_times[name]:>14.2f} "
+              f"{projected / max(column_times[name], 1e-9):>10.1f}")
+    print("-" * 78)
+    print(f"列式存储构造 {build_time:.2f} 秒，排序索引和时间范围 {order_time:.2f} 秒（首次分析时一次性计算并缓存）")
+
+
+if __name__ == "__main__":
+    main()
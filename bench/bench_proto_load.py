@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+trace_processor 冷加载基准测试：ftrace 文本 vs 二进制 perfetto proto
+生成合成日志（默认 5 GB），用 ftrace_proto.py 转换一次，再分别在全新的
+trace_processor 进程中加载两种格式并执行一次查询，对比加载耗时
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS_DIR = os.path.join(os.path.dirname(BENCH_DIR), 'skills', 'ftrace-analyzer', 'scripts')
+sys.path.insert(0, SCRIPTS_DIR)
+
+from ftrace_proto import convert, proto_path
+from synthetic_trace import generate_trace
+
+try:
+    from perfetto.trace_processor import TraceProcessor
+except ImportError:
+    TraceProcessor = None
+
+
+def drop_page_cache():
+    """丢弃页缓存（需要 root），让每次加载都从磁盘读取"""
+    os.sync()
+    with open('/proc/sys/vm/drop_caches', 'w') as f:
+        f.write('3\n')
+
+
+def cold_load(path: str) -> tuple:
+    """启动新的 trace_processor 加载 path，返回 (加载秒数, sched 行数)"""
+    start = time.perf_counter()
+    tp = TraceProcessor(file_path=path)
+    try:
+        loaded = time.perf_counter() - start
+        rows = next(iter(tp.query("SELECT count(*) AS n FROM sched"))).n
+    finally:
+        tp.close()
+    return loaded, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="文本 ftrace 与二进制 proto 的冷加载耗时对比")
+    parser.add_argument("--trace", help="已有的 ftrace 文本日志（不指定则生成合成日志）")
+    parser.add_argument("--size-mb", type=float, default=5120, help="合成日志大小 (MB)")
+    parser.add_argument("--repeat", type=int, default=3, help="每种格式的加载次数")
+    parser.add_argument("--tp_bin", default=os.path.join(SCRIPTS_DIR, 'trace_processor'),
+                        help="trace_processor 可执行文件路径")
+    parser.add_argument("--drop-caches", action="store_true", help="每次加载前丢弃页缓存（需要 root）")
+    args = parser.parse_args()
+
+    if TraceProcessor is None:
+        print("需要 perfetto python 模块: pip install perfetto", file=sys.stderr)
+        return 1
+    os.environ["PERFETTO_BINARY_PATH"] = args.tp_bin
+
+    file_path = args.trace
+    tmp_path = None
+    if not file_path:
+        fd, tmp_path = tempfile.mkstemp(suffix='.log')
+        os.close(fd)
+        print(f"生成 {args.size_mb:.0f} MB 合成日志: {tmp_path}")
+        generate_trace(tmp_path, args.size_mb)
+        file_path = tmp_path
+
+    try:
+        start = time.perf_counter()
+        meta = convert(file_path)
+        convert_seconds = time.perf_counter() - start
+        print(f"文本 {meta['source_size'] / 1e6:.1f} MB -> proto {meta['proto_size'] / 1e6:.1f} MB, "
+              f"{meta['events']} 事件, 转换 {convert_seconds:.1f}s, 无损: {meta['lossless']}")
+        print("-" * 72)
+        print(f"{'格式':<10} {'次数':>4} {'最短加载(s)':>12} {'平均加载(s)':>12} {'sched 行数':>14}")
+        print("-" * 72)
+        best = {}
+        for name, path in (('text', file_path), ('proto', proto_path(file_path))):
+            times = []
+            rows = None
+            for _ in range(args.repeat):
+                if args.drop_caches:
+                    drop_page_cache()
+                seconds, rows = cold_load(path)
+                times.append(seconds)
+            best[name] = min(times)
+            print(f"{name:<10} {len(times):>4} {min(times):>12.2f} {sum(times) / len(times):>12.2f} {rows:>14}")
+        print("-" * 72)
+        print(f"proto 加载提速: {best['text'] / best['proto']:.1f}x，"
+              f"转换成本在 {convert_seconds / max(best['text'] - best['proto'], 1e-9):.1f} 次加载后收回")
+    finally:
+        if tmp_path:
+            for path in (tmp_path, proto_path(tmp_path), proto_path(tmp_path) + '.json'):
+                if os.path.exists(path):
+                    os.remove(path)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
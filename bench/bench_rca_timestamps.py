@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+ftrace_to_rca 时间戳格式化微基准
+对比逐行 base_dt + timedelta + strftime 与按整秒缓存（SecondFormatter）
+两种方式的每行耗时；时间戳按 ftrace 的典型密度递增（默认 1000 万行）
+"""
+
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), 'transform'))
+
+from ftrace_to_rca import TIMESTAMP_FORMAT, SecondFormatter
+
+
+def timestamps(lines: int, events_per_second: int, start: float = 7541.0):
+    """递增的 ftrace 时间戳（秒），每秒 events_per_second 个事件"""
+    step = 1.0 / events_per_second
+    return (start + i * step for i in range(lines))
+
+
+def per_line(stamps, base_dt: datetime) -> int:
+    """改造前：每行都构造 datetime 并 strftime"""
+    n = 0
+    for timestamp_s in stamps:
+        ts_str = (base_dt + timedelta(seconds=timestamp_s)).strftime(TIMESTAMP_FORMAT)
+        n += 1
+    return n
+
+
+def memoized(stamps, base_dt: datetime) -> int:
+    """改造后：与 convert_range 相同的整秒缓存，每行只有一次浮点比较"""
+    format_second = SecondFormatter(base_dt).format
+    ts_str, lo, hi = '', 1.0, 0.0
+    n = 0
+    for timestamp_s in stamps:
+        if not lo <= timestamp_s < hi:
+            ts_str, lo, hi = format_second(timestamp_s)
+        n += 1
+    return n
+
+
+def baseline(stamps, base_dt: datetime) -> int:
+    """只迭代时间戳，用于扣除生成时间戳和循环本身的开销"""
+    n = 0
+    for timestamp_s in stamps:
+        n += 1
+    return n
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ftrace_to_rca 时间戳格式化每行耗时对比")
+    parser.add_argument("--lines", type=int, default=10_000_000, help="时间戳行数")
+    parser.add_argument("--events-per-second", type=int, default=200_000,
+                        help="每秒事件数（决定同一秒内复用缓存的行数）")
+    parser.add_argument("--base_time", default="2026-01-09T10:38:15Z", help="基准 ISO 时间戳")
+    args = parser.parse_args()
+
+    base_dt = datetime.fromisoformat(args.base_time.replace('Z', '+00:00'))
+    print(f"{args.lines} 行，每秒 {args.events_per_second} 个事件")
+    print("-" * 60)
+    print(f"{'方式':<12} {'总耗时(s)':>12} {'每行(ns)':>12} {'扣除循环(ns)':>14}")
+    print("-" * 60)
+    loop_ns = None
+    results = {}
+    for name, func in (('loop', baseline), ('per-line', per_line), ('memoized', memoized)):
+        start = time.perf_counter()
+        n = func(timestamps(args.lines, args.events_per_second), base_dt)
+        seconds = time.perf_counter() - start
+        ns = seconds * 1e9 / n
+        if loop_ns is None:
+            loop_ns = ns
+        results[name] = ns - loop_ns
+        print(f"{name:<12} {seconds:>12.2f} {ns:>12.1f} {ns - loop_ns:>14.1f}")
+    print("-" * 60)
+    if results['memoized'] > 0:
+        print(f"时间戳格式化提速: {results['per-line'] / results['memoized']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+ftrace 日志读取基准测试
+对比文本模式逐行读取与 TraceReader（mmap + 字节级预过滤）的吞吐、
+解码行数（每行一次 str 分配）以及 tracemalloc 统计的内存分配峰值
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), 'skills', 'ftrace-analyzer', 'scripts'))
+
+from ftrace_reader import TraceReader
+from synthetic_trace import generate_trace
+
+
+def text_filter(file_path: str, needle: str) -> tuple:
+    """文本模式：每一行都解码并分配 str，再做子串过滤"""
+    matched = decoded = 0
+    with open(file_path, 'r', encoding='utf-8', buffering=8 * 1024 * 1024) as f:
+        for line in f:
+            decoded += 1
+            if needle in line:
+                matched += 1
+    return matched, decoded
+
+
+def text_data_lines(file_path: str) -> tuple:
+    matched = decoded = 0
+    with open(file_path, 'r', encoding='utf-8', buffering=8 * 1024 * 1024) as f:
+        for line in f:
+            decoded += 1
+            if not line or line[0] == '#' or line[0] == '\n' or 'buffer started' in line:
+                continue
+            matched += 1
+    return matched, decoded
+
+
+def mmap_filter(file_path: str, needle: str) -> tuple:
+    matched = 0
+    with TraceReader(file_path) as reader:
+        for _ in reader.iter_lines(needle.encode()):
+            matched += 1
+        return matched, reader.stats.lines_decoded
+
+
+def mmap_data_lines(file_path: str) -> tuple:
+    matched = 0
+    with TraceReader(file_path) as reader:
+        for _ in reader.iter_data_lines():
+            matched += 1
+        return matched, reader.stats.lines_decoded
+
+
+def measure(func, *args) -> tuple:
+    tracemalloc.start()
+    start = time.perf_counter()
+    matched, decoded = func(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return matched, decoded, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ftrace 日志读取吞吐与分配基准测试")
+    parser.add_argument("--trace", help="已有的 ftrace 日志（不指定则生成合成日志）")
+    parser.add_argument("--size-mb", type=float, default=2048, help="合成日志大小 (MB)")
+    args = parser.parse_args()
+
+    file_path = args.trace
+    tmp_path = None
+    if not file_path:
+        fd, tmp_path = tempfile.mkstemp(suffix='.log')
+        os.close(fd)
+        print(f"生成 {args.size_mb:.0f} MB 合成日志: {tmp_path}")
+        generate_trace(tmp_path, args.size_mb)
+        file_path = tmp_path
+
+    cases = [
+        ('sched_switch: 文本模式', text_filter, 'sched_switch:'),
+        ('sched_switch: mmap', mmap_filter, 'sched_switch:'),
+        ('softirq_entry: 文本模式', text_filter, 'softirq_entry:'),
+        ('softirq_entry: mmap', mmap_filter, 'softirq_entry:'),
+        ('全部数据行 文本模式', text_data_lines, None),
+        ('全部数据行 mmap', mmap_data_lines, None),
+    ]
+
+    try:
+        size_mb = os.path.getsize(file_path) / 1024 / 1024
+        print(f"日志大小: {size_mb:.2f} MB  (tracemalloc 开启，绝对耗时偏高，仅供相对比较)")
+        print("-" * 96)
+        print(f"{'场景':<26} {'匹配行':>12} {'解码行(str分配)':>16} {'MB/秒':>10} {'分配峰值(KB)':>14}")
+        print("-" * 96)
+        for name, func, needle in cases:
+            call_args = (file_path,) if needle is None else (file_path, needle)
+            matched, decoded, elapsed, peak = measure(func, *call_args)
+            print(f"{name:<26} {matched:>12} {decoded:>16} {size_mb / elapsed:>10.2f} {peak / 1024:>14.0f}")
+        print("-" * 96)
+    finally:
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+if __name__ == "__main__":
+    main()
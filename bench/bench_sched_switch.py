@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+sched_switch 解析基准测试
+对比 parse_sched_switch（逐字段 re.search）与 parse_sched_switch_record（单遍预编译正则）
+在合成日志上的吞吐（行/秒）
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from analyze_ftrace import parse_sched_switch, parse_sched_switch_record
+from synthetic_trace import generate_trace
+
+
+def run(file_path: str, parse) -> tuple:
+    """扫描整个文件，返回 (sched_switch 行数, 耗时秒)"""
+    count = 0
+    start = time.perf_counter()
+    with open(file_path, 'r') as f:
+        for line in f:
+            if 'sched_switch:' in line:
+                parse(line)
+                count += 1
+    return count, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="sched_switch 解析吞吐基准测试")
+    parser.add_argument("--trace", help="已有的 ftrace 日志（不指定则生成合成日志）")
+    parser.add_argument("--size-mb", type=float, default=2048, help="合成日志大小 (MB)")
+    args = parser.parse_args()
+
+    file_path = args.trace
+    tmp_path = None
+    if not file_path:
+        fd, tmp_path = tempfile.mkstemp(suffix='.log')
+        os.close(fd)
+        print(f"生成 {args.size_mb:.0f} MB 合成日志: {tmp_path}")
+        generate_trace(tmp_path, args.size_mb)
+        file_path = tmp_path
+
+    try:
+        size_mb = os.path.getsize(file_path) / 1024 / 1024
+        print(f"日志大小: {size_mb:.2f} MB")
+        print("-" * 60)
+        print(f"{'解析器':<30} {'行/秒':>12} {'MB/秒':>10} {'耗时(s)':>10}")
+        print("-" * 60)
+        results = {}
+        for name, parse in (('parse_sched_switch', parse_sched_switch),
+                            ('parse_sched_switch_record', parse_sched_switch_record)):
+            count, elapsed = run(file_path, parse)
+            results[name] = elapsed
+            print(f"{name:<30} {count / elapsed:>12.0f} {size_mb / elapsed:>10.2f} {elapsed:>10.2f}")
+        print("-" * 60)
+        print(f"加速比: {results['parse_sched_switch'] / results['parse_sched_switch_record']:.2f}x")
+    finally:
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+
+# ftrace-analyzer 的库模块（ftrace_file / ftrace_query / ftrace_analyzer ...）
+# 以脚本目录为导入根，测试中直接按模块名导入
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'skills', 'ftrace-analyzer', 'scripts'))
+
+# 测试中的解析缓存写入临时目录，不污染 ~/.cache
+os.environ.setdefault('FTRACE_CACHE_DIR', tempfile.mkdtemp(prefix='ftrace-cache-'))
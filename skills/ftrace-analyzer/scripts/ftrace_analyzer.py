@@ -0,0 +1,449 @@
+#!/usr/bin/env python3
+"""
+Analyzer: high-level analysis layer of the ftrace parser
+(see doc/ftrace_parser_analysis_driven_design.md, section 6).
+
+All analyses run over a columnar ``EventStore`` built with one scan of the
+trace: gap, histogram and QoS-period detection are array kernels over the
+timestamp / CPU / PID columns, and full ``Event`` objects are only rebuilt
+(from the recorded line offsets) for the handful of rows that end up in a
+result.
+"""
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+try:
+    from .ftrace_columns import (EventStore, IDLE_TYPE, bin_counts, cumulative_level,
+                                 interp, largest, np, percentile, take, to_list)
+    from .ftrace_event import PROCESS_TYPES
+except ImportError:
+    from ftrace_columns import (EventStore, IDLE_TYPE, bin_counts, cumulative_level,
+                                interp, largest, np, percentile, take, to_list)
+    from ftrace_event import PROCESS_TYPES
+
+# PROCESS_TYPES 在结果中的名字
+CONTEXT_NAMES = ('user_process', 'kernel_thread', 'idle', 'irq', 'softirq')
+
+# detect_time_anomalies / detect_time_gaps 默认只展开最大的若干个间隔
+DEFAULT_GAP_LIMIT = 100
+
+
+class Analyzer:
+    """
+    高层次分析接口
+
+    对应分析流程的各个层次：
+    - 第一层：时间尺度和卡顿级别
+    - 第二层：执行上下文分区
+    - 第三层：业务运行状态
+    - 第四层：调度视角
+    """
+
+    def __init__(self, trace, store: Optional[EventStore] = None):
+        """
+        Args:
+            trace: TraceFile 对象
+            store: 已构建的列式事件存储（默认首次分析时从解析缓存加载，未命中则扫描 trace 构建并写入缓存）
+        """
+        self.trace = trace
+        self._store = store
+
+    @property
+    def store(self) -> EventStore:
+        if self._store is None:
+            self._store = EventStore.load(self.trace.filepath)
+        return self._store
+
+    def _gap_records(self, prev_rows, next_rows, durations, limit: int) -> List[Tuple]:
+        """最大的 limit 个间隔，按开始时间排序：(prev_row, next_row, duration)"""
+        picked = to_list(largest(durations, limit))
+        prev_rows, next_rows = to_list(take(prev_rows, picked)), to_list(take(next_rows, picked))
+        durations = to_list(take(durations, picked))
+        ts = self.store.arrays['ts']
+        return sorted(zip(prev_rows, next_rows, durations), key=lambda r: ts[r[0]])
+
+    # ==================== 第一层：时间尺度识别 ====================
+
+    def detect_time_anomalies(self, threshold_us: float = 100,
+                              limit: int = DEFAULT_GAP_LIMIT) -> Dict:
+        """
+        检测时间异常（相邻事件间隔超过阈值）
+
+        Args:
+            threshold_us: 异常阈值（微秒）
+            limit: 展开为明细的最大间隔数（summary 统计全部间隔）
+
+        Returns:
+            {'gaps': [{'start', 'end', 'duration_us', 'prev_event', 'next_event'}, ...],
+             'summary': {'total_gaps', 'max_gap_us', 'p95_gap_us'}}
+        """
+        store = self.store
+        prev_rows, next_rows, durations = store.gaps(threshold_us / 1e6)
+        records = self._gap_records(prev_rows, next_rows, durations, limit)
+        events = store.events([row for r in records for row in r[:2]])
+        ts = store.arrays['ts']
+
+        gaps = []
+        for k, (prev_row, next_row, duration) in enumerate(records):
+            gaps.append({
+                'start': ts[prev_row],
+                'end': ts[next_row],
+                'duration_us': duration * 1e6,
+                'prev_event': events[2 * k],
+                'next_event': events[2 * k + 1],
+            })
+        return {
+            'gaps': gaps,
+            'summary': {
+                'total_gaps': len(durations),
+                'max_gap_us': max(durations) * 1e6 if len(durations) else 0.0,
+                'p95_gap_us': percentile(durations, 95) * 1e6,
+            },
+        }
+
+    def _busy_integral(self):
+        """所有 CPU 上非 idle 运行时间的累计积分曲线 (points, integral)"""
+        segments = self.store.run_segments()
+        types = self.store.process_types(segments['pid'], segments['comm'])
+        if np is not None:
+            busy = types != IDLE_TYPE
+            points = np.concatenate((segments['start'][busy], segments['end'][busy]))
+            deltas = np.concatenate((np.ones(busy.sum()), -np.ones(busy.sum())))
+        else:
+            busy = [k for k, t in enumerate(types) if t != IDLE_TYPE]
+            points = [segments['start'][k] for k in busy] + [segments['end'][k] for k in busy]
+            deltas = [1.0] * len(busy) + [-1.0] * len(busy)
+        return cumulative_level(points, deltas)
+
+    def get_time_distribution(self, bin_size: float = 0.001,
+                              hotspot_util: float = 0.8) -> Dict:
+        """
+        获取时间分布（用于识别热点时段）
+
+        Args:
+            bin_size: 时间桶大小（秒）
+            hotspot_util: 利用率不低于该值的连续桶合并为热点时段
+
+        Returns:
+            {'bins': [...], 'event_counts': [...], 'cpu_util': [...],
+             'hotspots': [{'start', 'end', 'util'}, ...]}
+        """
+        store = self.store
+        if not len(store):
+            return {'bins': [], 'event_counts': [], 'cpu_util': [], 'hotspots': []}
+        start = store.start_time
+        nbins = int((store.end_time - start) // bin_size) + 1
+        bins = [start + k * bin_size for k in range(nbins)]
+        counts = bin_counts(store.column('ts'), start, bin_size, nbins)
+
+        points, integral = self._busy_integral()
+        busy = interp(bins + [start + nbins * bin_size], points, integral)
+        capacity = bin_size * max(len(store.cpus), 1)
+        util = [round((busy[k + 1] - busy[k]) / capacity, 4) for k in range(nbins)]
+
+        hotspots = []
+        for k, u in enumerate(util):
+            if u < hotspot_util:
+                continue
+            if hotspots and hotspots[-1]['_last'] == k - 1:
+                spot = hotspots[-1]
+                spot['end'] = bins[k] + bin_size
+                spot['_sum'] += u
+                spot['_last'] = k
+            else:
+                hotspots.append({'start': bins[k], 'end': bins[k] + bin_size,
+                                 '_sum': u, '_first': k, '_last': k})
+        for spot in hotspots:
+            spot['util'] = round(spot.pop('_sum') / (spot.pop('_last') - spot.pop('_first') + 1), 4)
+
+        return {'bins': bins, 'event_counts': counts, 'cpu_util': util, 'hotspots': hotspots}
+
+    # ==================== 第二层：执行上下文分区 ====================
+
+    def classify_contexts(self) -> Dict:
+        """
+        将事件按执行上下文分类
+
+        Returns:
+            {
+                'user_process': {'count', 'processes': [pid, ...], 'time_percent'},
+                'kernel_thread': {'count', 'threads': [comm, ...], 'time_percent'},
+                'idle': {'count', 'time_percent'},
+                'irq': {...},
+                'softirq': {...}
+            }
+        """
+        store = self.store
+        pids, comms = store.column('pid'), store.column('comm')
+        types = store.process_types(pids, comms)
+
+        segments = store.run_segments()
+        seg_types = store.process_types(segments['pid'], segments['comm'])
+        if np is not None:
+            counts = np.bincount(types, minlength=len(PROCESS_TYPES)).tolist()
+            run_time = np.bincount(seg_types, weights=segments['end'] - segments['start'],
+                                   minlength=len(PROCESS_TYPES)).tolist()
+            user_pids = np.unique(pids[types == PROCESS_TYPES.index('user')]).tolist()
+            comm_codes = {t: np.unique(comms[types == t]).tolist() for t in range(len(PROCESS_TYPES))}
+        else:
+            counts = [0] * len(PROCESS_TYPES)
+            run_time = [0.0] * len(PROCESS_TYPES)
+            user_type = PROCESS_TYPES.index('user')
+            user_pids, comm_codes = set(), {t: set() for t in range(len(PROCESS_TYPES))}
+            for pid, comm, t in zip(pids, comms, types):
+                counts[t] += 1
+                comm_codes[t].add(comm)
+                if t == user_type:
+                    user_pids.add(pid)
+            for t, start, end in zip(seg_types, segments['start'], segments['end']):
+                run_time[t] += end - start
+            user_pids = sorted(user_pids)
+        total_time = sum(run_time)
+
+        contexts = {}
+        for t, name in enumerate(CONTEXT_NAMES):
+            entry = {
+                'count': counts[t],
+                'time_percent': round(run_time[t] / total_time * 100, 2) if total_time else 0.0,
+            }
+            if name == 'user_process':
+                entry['processes'] = user_pids
+            elif name != 'idle':
+                entry['threads'] = sorted({store.comms[c] for c in comm_codes[t]})
+            contexts[name] = entry
+        return contexts
+
+    def get_context_timeline(self, cpu: int) -> List[Dict]:
+        """
+        获取某个 CPU 的上下文切换时间线
+
+        Returns:
+            [{'start', 'end', 'context', 'pid', 'comm'}, ...]
+        """
+        store = self.store
+        segments = store.run_segments()
+        if np is not None:
+            rows = np.flatnonzero(segments['cpu'] == cpu)
+        else:
+            rows = [k for k, c in enumerate(segments['cpu']) if c == cpu]
+        pids = to_list(take(segments['pid'], rows))
+        comms = to_list(take(segments['comm'], rows))
+        types = store.process_types(pids, comms)
+        starts, ends = to_list(take(segments['start'], rows)), to_list(take(segments['end'], rows))
+        return [{'start': start, 'end': end, 'context': CONTEXT_NAMES[t],
+                 'pid': pid, 'comm': store.comms[comm]}
+                for start, end, t, pid, comm in zip(starts, ends, to_list(types), pids, comms)]
+
+    # ==================== 第三层：业务运行状态 ====================
+
+    def _run_intervals(self, pid: int, time_range: Optional[Tuple[float, float]]) -> List[Tuple]:
+        """pid 的运行区间（按开始时间排序，裁剪到 time_range）"""
+        segments = self.store.run_segments()
+        if np is not None:
+            rows = np.flatnonzero(segments['pid'] == pid)
+        else:
+            rows = [k for k, p in enumerate(segments['pid']) if p == pid]
+        intervals = sorted(zip(to_list(take(segments['start'], rows)),
+                               to_list(take(segments['end'], rows))))
+        if time_range:
+            lo, hi = time_range
+            intervals = [(max(s, lo), min(e, hi)) for s, e in intervals if e > lo and s < hi]
+        return intervals
+
+    def check_process_running(self, pid: int,
+                              time_range: Tuple[float, float] = None,
+                              min_gap: float = 1.0) -> Dict:
+        """
+        检查进程是否在运行
+
+        Args:
+            pid: 进程 ID
+            time_range: 时间范围
+            min_gap: 报告为 gaps 的最短未运行时长（秒）
+
+        Returns:
+            {'is_running', 'run_time', 'run_percent', 'sched_count',
+             'avg_timeslice_ms', 'gaps': [{'start', 'end', 'duration'}, ...]}
+        """
+        store = self.store
+        lo, hi = time_range or (store.start_time, store.end_time)
+        intervals = self._run_intervals(pid, (lo, hi))
+        run_time = sum(e - s for s, e in intervals)
+        window = hi - lo
+
+        gaps = []
+        cursor = lo
+        for start, end in intervals + [(hi, hi)]:
+            if start - cursor >= min_gap:
+                gaps.append({'start': cursor, 'end': start, 'duration': start - cursor})
+            cursor = max(cursor, end)
+
+        if intervals:
+            is_running = True
+        elif np is not None:
+            ts = store.column('ts')
+            is_running = bool(np.any((store.column('pid') == pid) & (ts >= lo) & (ts <= hi)))
+        else:
+            is_running = any(p == pid and lo <= t <= hi
+                             for p, t in zip(store.arrays['pid'], store.arrays['ts']))
+
+        return {
+            'is_running': is_running,
+            'run_time': round(run_time, 6),
+            'run_percent': round(run_time / window * 100, 2) if window > 0 else 0.0,
+            'sched_count': len(intervals),
+            'avg_timeslice_ms': round(run_time / len(intervals) * 1000, 3) if intervals else 0.0,
+            'gaps': gaps,
+        }
+
+    def compare_cpu_time(self, *pids: int) -> Dict:
+        """
+        比较多个进程的 CPU 时间占用
+
+        Returns:
+            {3711: {'time': 45.67, 'percent': 45.67}, ...}
+        """
+        duration = self.store.end_time - self.store.start_time
+        result = {}
+        for pid in pids:
+            run_time = sum(e - s for s, e in self._run_intervals(pid, None))
+            result[pid] = {
+                'time': round(run_time, 6),
+                'percent': round(run_time / duration * 100, 2) if duration > 0 else 0.0,
+            }
+        return result
+
+    # ==================== 第四层：调度视角 ====================
+
+    def _cpu_activity(self, cpu: int, start: float, end: float) -> Dict:
+        """gap 期间某 CPU 上在做什么"""
+        store = self.store
+        rows = store.cpu_rows(cpu, start, end)
+        if not rows:
+            return {'dominant_context': None, 'processes': []}
+        pids = to_list(take(store.column('pid'), rows))
+        comms = to_list(take(store.column('comm'), rows))
+        types = Counter(to_list(store.process_types(pids, comms)))
+        top = Counter(comms).most_common(5)
+        return {
+            'dominant_context': CONTEXT_NAMES[types.most_common(1)[0][0]],
+            'processes': [store.comms[c] for c, _ in top],
+        }
+
+    def detect_time_gaps(self, pid: int = None,
+                         threshold_ms: float = 1.0,
+                         limit: int = DEFAULT_GAP_LIMIT) -> List[Dict]:
+        """
+        检测时间断层（用于发现"进程去哪了"）
+
+        Args:
+            pid: 进程 ID（None=所有非 idle 进程）
+            threshold_ms: 间隔阈值（毫秒）
+            limit: 返回的最大断层数（取持续时间最长的）
+
+        Returns:
+            [{'pid', 'comm', 'gap_start', 'gap_end', 'duration_ms',
+              'last_seen', 'next_seen', 'cpu_activity'}, ...]
+        """
+        store = self.store
+        prev_rows, next_rows, durations = store.gaps(threshold_ms / 1000.0, by='pid')
+        pid_col = store.column('pid')
+        if np is not None:
+            keep = pid_col[prev_rows] == pid if pid is not None else pid_col[prev_rows] != 0
+            prev_rows, next_rows, durations = prev_rows[keep], next_rows[keep], durations[keep]
+        else:
+            keep = [k for k, row in enumerate(prev_rows)
+                    if (pid_col[row] == pid if pid is not None else pid_col[row] != 0)]
+            prev_rows, next_rows = take(prev_rows, keep), take(next_rows, keep)
+            durations = take(durations, keep)
+
+        records = self._gap_records(prev_rows, next_rows, durations, limit)
+        events = store.events([row for r in records for row in r[:2]])
+        ts, cpus = store.arrays['ts'], store.arrays['cpu']
+        gaps = []
+        for k, (prev_row, next_row, duration) in enumerate(records):
+            gaps.append({
+                'pid': pid_col[prev_row].item() if np is not None else pid_col[prev_row],
+                'comm': store.comm_of(prev_row),
+                'gap_start': ts[prev_row],
+                'gap_end': ts[next_row],
+                'duration_ms': round(duration * 1000, 3),
+                'last_seen': events[2 * k],
+                'next_seen': events[2 * k + 1],
+                'cpu_activity': self._cpu_activity(cpus[prev_row], ts[prev_row], ts[next_row]),
+            })
+        return gaps
+
+    def detect_qos_patterns(self, min_gap_ms: float = 4.0, max_gap_ms: float = 20.0,
+                            min_occurrences: int = 3) -> Dict:
+        """
+        检测 QoS / CPU 带宽限流模式：某个 CPU 上周期性出现的、时长相近的空档
+
+        Args:
+            min_gap_ms / max_gap_ms: 视为限流空档的间隔范围（毫秒）
+            min_occurrences: 至少出现的次数
+
+        Returns:
+            {
+                'suspected_qos': True,
+                'details': {
+                    'cpu_0': {'gap_count', 'avg_duration_ms', 'max_duration_ms',
+                              'avg_period_ms', 'period_cv', 'duration_cv', 'confidence'},
+                    ...
+                }
+            }
+        """
+        store = self.store
+        prev_rows, _, durations = store.gaps(min_gap_ms / 1000.0, by='cpu')
+        if np is not None:
+            keep = durations <= max_gap_ms / 1000.0
+            prev_rows, durations = prev_rows[keep], durations[keep]
+        else:
+            keep = [k for k, d in enumerate(durations) if d <= max_gap_ms / 1000.0]
+            prev_rows, durations = take(prev_rows, keep), take(durations, keep)
+
+        # 行按 (cpu, ts) 排序，同一 CPU 的间隔连续出现
+        per_cpu: Dict[int, Tuple[List[float], List[float]]] = {}
+        cpus, ts = store.arrays['cpu'], store.arrays['ts']
+        for row, duration in zip(to_list(prev_rows), to_list(durations)):
+            starts, lengths = per_cpu.setdefault(cpus[row], ([], []))
+            starts.append(ts[row])
+            lengths.append(duration)
+
+        details = {}
+        for cpu, (starts, lengths) in sorted(per_cpu.items()):
+            if len(lengths) < min_occurrences:
+                continue
+            periods = [b - a for a, b in zip(starts, starts[1:])]
+            avg_duration, duration_cv = _mean_cv(lengths)
+            avg_period, period_cv = _mean_cv(periods)
+            if len(lengths) >= 5 and period_cv < 0.2 and duration_cv < 0.2:
+                confidence = 'high'
+            elif period_cv < 0.5 and duration_cv < 0.5:
+                confidence = 'medium'
+            else:
+                confidence = 'low'
+            details[f'cpu_{cpu}'] = {
+                'gap_count': len(lengths),
+                'avg_duration_ms': round(avg_duration * 1000, 3),
+                'max_duration_ms': round(max(lengths) * 1000, 3),
+                'avg_period_ms': round(avg_period * 1000, 3),
+                'period_cv': round(period_cv, 4),
+                'duration_cv': round(duration_cv, 4),
+                'confidence': confidence,
+            }
+        return {
+            'suspected_qos': any(d['confidence'] != 'low' for d in details.values()),
+            'details': details,
+        }
+
+
+def _mean_cv(values: List[float]) -> Tuple[float, float]:
+    """均值与变异系数"""
+    if not values:
+        return 0.0, 0.0
+    mean = sum(values) / len(values)
+    if mean <= 0:
+        return mean, 0.0
+    variance = sum((v - mean) ** 2 for v in values) / len(values)
+    return mean, variance ** 0.5 / mean
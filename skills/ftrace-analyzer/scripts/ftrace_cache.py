@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Persistent binary cache of parsed traces: parse once, analyze many times.
+
+Entries are content-addressed by a trace fingerprint (absolute path, size,
+mtime and a hash of the first and last 64 KiB), so a rewritten or appended
+trace never hits a stale entry. Each tool stores its parsed columnar form
+under its own *kind* (``events`` for the Analyzer's ``EventStore``,
+``sched_switch`` for ``analyze_ftrace.py``) next to the others of the same
+trace.
+
+An entry is an ``.npz`` archive: one ``.npy`` member per column plus a
+``meta.json`` member holding string tables and scalars. The ``.npy`` headers
+are written by hand, so NumPy is not needed to read or write the cache, yet
+``numpy.load`` opens the archives directly.
+
+The cache directory (``$FTRACE_CACHE_DIR``, default
+``~/.cache/ftrace-analyzer``) is kept under a disk budget
+(``$FTRACE_CACHE_MAX_MB``, default 2048) by evicting the least recently used
+entries; a hit refreshes the entry's mtime. ``FTRACE_CACHE=0`` disables it.
+"""
+import ast
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import zipfile
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+CACHE_VERSION = 1
+ENTRY_SUFFIX = '.npz'
+HASH_BYTES = 64 * 1024
+DEFAULT_MAX_MB = 2048
+
+# array typecode <-> little-endian .npy descr
+_DESCR = {'d': '<f8', 'f': '<f4', 'b': '|i1', 'B': '|u1', 'h': '<i2', 'H': '<u2',
+          'i': '<i4', 'I': '<u4', 'q': '<i8', 'Q': '<u8'}
+_TYPECODE = {descr: typecode for typecode, descr in _DESCR.items()}
+_NPY_MAGIC = b'\x93NUMPY\x01\x00'
+
+
+def trace_fingerprint(path: str) -> str:
+    """Hex digest of the trace's path, size, mtime and head/tail bytes."""
+    st = os.stat(path)
+    digest = hashlib.sha1()
+    digest.update(f"{CACHE_VERSION}\0{os.path.abspath(path)}\0{st.st_size}\0{st.st_mtime_ns}".encode())
+    with open(path, 'rb') as f:
+        digest.update(f.read(HASH_BYTES))
+        if st.st_size > HASH_BYTES:
+            f.seek(max(HASH_BYTES, st.st_size - HASH_BYTES))
+            digest.update(f.read(HASH_BYTES))
+    return digest.hexdigest()
+
+
+# ==================== .npy members ====================
+
+def _npy_bytes(col: array) -> bytes:
+    header = "{'descr': '%s', 'fortran_order': False, 'shape': (%d,), }" % (_DESCR[col.typecode], len(col))
+    # magic + version + uint16 length + header must be a multiple of 64 bytes
+    pad = 64 - (len(_NPY_MAGIC) + 2 + len(header) + 1) % 64
+    header = (header + ' ' * (pad % 64) + '\n').encode('latin1')
+    if sys.byteorder == 'big':
+        col = array(col.typecode, col)
+        col.byteswap()
+    return _NPY_MAGIC + len(header).to_bytes(2, 'little') + header + col.tobytes()
+
+
+def _npy_array(data: bytes) -> array:
+    if not data.startswith(b'\x93NUMPY'):
+        raise ValueError("not an .npy member")
+    header_len = int.from_bytes(data[8:10], 'little')
+    header = ast.literal_eval(data[10:10 + header_len].decode('latin1'))
+    col = array(_TYPECODE[header['descr']])
+    col.frombytes(data[10 + header_len:])
+    if sys.byteorder == 'big':
+        col.byteswap()
+    return col
+
+
+# ==================== Cache ====================
+
+def cache_dir() -> str:
+    """``$FTRACE_CACHE_DIR``, or ``~/.cache/ftrace-analyzer``."""
+    return os.environ.get('FTRACE_CACHE_DIR') or \
+        os.path.join(os.path.expanduser('~'), '.cache', 'ftrace-analyzer')
+
+
+class TraceCache:
+    """Directory of ``<fingerprint>-<kind>.npz`` entries with an LRU disk budget."""
+    suffix = ENTRY_SUFFIX
+
+    def __init__(self, directory: Optional[str] = None, max_bytes: Optional[int] = None):
+        self.directory = directory or cache_dir()
+        if max_bytes is None:
+            max_bytes = int(float(os.environ.get('FTRACE_CACHE_MAX_MB', DEFAULT_MAX_MB)) * 1024 * 1024)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def entry_path(self, trace_path: str, kind: str) -> str:
+        return os.path.join(self.directory, f"{trace_fingerprint(trace_path)}-{kind}{self.suffix}")
+
+    def load(self, trace_path: str, kind: str) -> Optional[Tuple[Dict[str, array], Dict]]:
+        """Returns ``(columns, meta)`` for the trace, or None on a miss."""
+        try:
+            entry = self.entry_path(trace_path, kind)
+            with zipfile.ZipFile(entry) as archive:
+                meta = json.loads(archive.read('meta.json'))
+                columns = {name[:-4]: _npy_array(archive.read(name))
+                           for name in archive.namelist() if name.endswith('.npy')}
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            self.misses += 1
+            return None
+        try:
+            os.utime(entry)
+        except OSError:
+            pass
+        self.hits += 1
+        return columns, meta
+
+    def store(self, trace_path: str, kind: str, columns: Dict[str, array], meta: Dict) -> Optional[str]:
+        """Writes an entry (atomically) and evicts old entries beyond the budget.
+
+        Returns the entry path, or None if the cache directory is not writable.
+        """
+        try:
+            entry = self.entry_path(trace_path, kind)
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        except OSError:
+            return None
+        try:
+            with os.fdopen(fd, 'wb') as f, zipfile.ZipFile(f, 'w', zipfile.ZIP_STORED) as archive:
+                for name, col in columns.items():
+                    archive.writestr(name + '.npy', _npy_bytes(col))
+                archive.writestr('meta.json', json.dumps(meta, ensure_ascii=False))
+            os.replace(tmp_path, entry)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return None
+        self.evict(keep=entry)
+        return entry
+
+    def entries(self) -> List[Tuple[float, int, str]]:
+        """``(mtime, size, path)`` of every entry, least recently used first."""
+        result = []
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return result
+        for name in names:
+            if not name.endswith(self.suffix):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            result.append((st.st_mtime, st.st_size, path))
+        return sorted(result)
+
+    def evict(self, keep: Optional[str] = None):
+        """Removes least recently used entries until the cache fits ``max_bytes``."""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+    def clear(self):
+        for _, _, path in self.entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def cache_enabled() -> bool:
+    """False when caching is disabled with ``FTRACE_CACHE=0``."""
+    return os.environ.get('FTRACE_CACHE', '1') not in ('0', 'off', 'false', 'no')
+
+
+def default_cache() -> Optional[TraceCache]:
+    """The shared cache, or None when disabled with ``FTRACE_CACHE=0``."""
+    if not cache_enabled():
+        return None
+    return TraceCache()
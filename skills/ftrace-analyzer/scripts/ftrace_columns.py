@@ -0,0 +1,476 @@
+#!/usr/bin/env python3
+"""
+Columnar event store for the Analyzer layer.
+
+Instead of one Python object per event (roughly 200 bytes each once the
+strings and the instance dict are counted), every event is stored as one
+slot in a set of parallel typed arrays:
+
+==========  =========  =====================================================
+column      type       meaning
+==========  =========  =====================================================
+ts          float64    timestamp in seconds
+cpu         uint16     CPU the line was recorded on
+pid         int32      task owning the line
+comm        uint32     code into ``comms`` (interned task names)
+event       uint16     code into ``event_types``
+state       uint8      sched_switch ``prev_state`` code into ``states``
+next_pid    int32      sched_switch ``next_pid`` (-1 for other events)
+next_comm   uint32     sched_switch ``next_comm`` code into ``comms``
+offset      int64      byte offset of the line, to rebuild a full ``Event``
+==========  =========  =====================================================
+
+That is 35 bytes per event. The columns are ``array.array`` buffers; when
+NumPy is installed they are exposed zero-copy as ndarrays and the kernels
+below (ordering, gap detection, binning, interpolation) run vectorized,
+otherwise the same kernels fall back to plain loops over the arrays.
+"""
+import heapq
+import math
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from .ftrace_cache import default_cache
+    from .ftrace_event import PROCESS_TYPES, classify_process, parse_event
+    from .ftrace_reader import TraceReader
+except ImportError:
+    from ftrace_cache import default_cache
+    from ftrace_event import PROCESS_TYPES, classify_process, parse_event
+    from ftrace_reader import TraceReader
+
+COLUMNS = (
+    ('ts', 'd'),
+    ('cpu', 'H'),
+    ('pid', 'i'),
+    ('comm', 'I'),
+    ('event', 'H'),
+    ('state', 'B'),
+    ('next_pid', 'i'),
+    ('next_comm', 'I'),
+    ('offset', 'q'),
+)
+
+# Bytes variant of ftrace_event.EVENT_PATTERN, matched over a whole chunk so
+# that ``match.start()`` is the line offset: comm, pid, cpu, timestamp, event.
+_LINE_PATTERN = re.compile(
+    rb'^[ \t]*(.*?)-(\d+)[ \t]+(?:\([ \t]*[\d-]+\)[ \t]+)?\[(\d+)\][ \t]+'
+    rb'(?:\S{4,5}[ \t]+)?(\d+\.\d+):[ \t]+(\w+):(.*)$',
+    re.M
+)
+_PREV_STATE_PATTERN = re.compile(rb'prev_state=(\S+)')
+_NEXT_TASK_PATTERN = re.compile(rb'next_comm=(\S+) next_pid=(\d+)')
+
+# Kind under which the store is kept in the shared trace cache (ftrace_cache).
+CACHE_KIND = 'events'
+
+SCHED_SWITCH = 'sched_switch'
+IDLE_TYPE = PROCESS_TYPES.index('idle')
+
+
+# ==================== Kernels ====================
+#
+# Each kernel takes columns as returned by EventStore.column() (ndarrays with
+# NumPy, arrays/lists without) and has a vectorized and a plain-loop branch.
+
+def to_list(values) -> list:
+    return values.tolist() if hasattr(values, 'tolist') else list(values)
+
+
+def argsort(keys, primary=None):
+    """Stable order of row indices by ``(primary, keys)``."""
+    if np is not None:
+        if primary is None:
+            return np.argsort(keys, kind='stable')
+        return np.lexsort((keys, primary))
+    if primary is None:
+        return sorted(range(len(keys)), key=keys.__getitem__)
+    return sorted(range(len(keys)), key=lambda i: (primary[i], keys[i]))
+
+
+def take(values, indices):
+    if np is not None:
+        return values[indices]
+    return [values[i] for i in indices]
+
+
+def consecutive_gaps(ts, threshold: float, groups=None):
+    """Positions ``k`` where ``ts[k + 1] - ts[k] > threshold``.
+
+    With ``groups``, only pairs whose group keys are equal count. Returns the
+    positions and the gap lengths.
+    """
+    if np is not None:
+        deltas = np.diff(ts)
+        mask = deltas > threshold
+        if groups is not None:
+            mask &= groups[1:] == groups[:-1]
+        positions = np.flatnonzero(mask)
+        return positions, deltas[positions]
+    positions, durations = [], []
+    prev_t = prev_g = None
+    for k, t in enumerate(ts):
+        g = groups[k] if groups is not None else None
+        if k and t - prev_t > threshold and g == prev_g:
+            positions.append(k - 1)
+            durations.append(t - prev_t)
+        prev_t, prev_g = t, g
+    return positions, durations
+
+
+def bin_counts(ts, start: float, bin_size: float, nbins: int) -> List[int]:
+    """Number of timestamps falling into each of ``nbins`` bins from ``start``."""
+    if nbins <= 0:
+        return []
+    if np is not None:
+        idx = ((np.asarray(ts) - start) // bin_size).astype(np.int64)
+        np.clip(idx, 0, nbins - 1, out=idx)
+        return np.bincount(idx, minlength=nbins).tolist()
+    counts = [0] * nbins
+    last = nbins - 1
+    for t in ts:
+        k = int((t - start) // bin_size)
+        counts[0 if k < 0 else last if k > last else k] += 1
+    return counts
+
+
+def interp(x, xp, fp) -> List[float]:
+    """Piecewise-linear interpolation of ``(xp, fp)`` at ``x``, clamped at the ends."""
+    if not len(xp):
+        return [0.0] * len(x)
+    if np is not None:
+        return np.interp(x, xp, fp).tolist()
+    out = []
+    n = len(xp)
+    for v in x:
+        k = bisect_right(xp, v)
+        if k == 0:
+            out.append(fp[0])
+        elif k == n:
+            out.append(fp[-1])
+        else:
+            x0, x1 = xp[k - 1], xp[k]
+            out.append(fp[k - 1] + (fp[k] - fp[k - 1]) * (v - x0) / (x1 - x0))
+    return out
+
+
+def cumulative_level(points, deltas):
+    """Integral of a step function that changes by ``deltas`` at ``points``.
+
+    Returns the sorted points and the running integral at each of them,
+    ready to be interpolated at arbitrary times with :func:`interp`.
+    """
+    if np is not None:
+        order = np.argsort(points, kind='stable')
+        points, deltas = points[order], deltas[order]
+        if not len(points):
+            return points, points
+        level = np.cumsum(deltas)
+        integral = np.concatenate(([0.0], np.cumsum(level[:-1] * np.diff(points))))
+        return points, integral
+    pairs = sorted(zip(points, deltas), key=lambda p: p[0])
+    xs, integral = [], []
+    level = total = 0.0
+    for x, delta in pairs:
+        if xs:
+            total += level * (x - xs[-1])
+        xs.append(x)
+        integral.append(total)
+        level += delta
+    return xs, integral
+
+
+def percentile(values, q: float) -> float:
+    """Nearest-rank percentile."""
+    n = len(values)
+    if not n:
+        return 0.0
+    k = max(0, math.ceil(q / 100.0 * n) - 1)
+    if np is not None:
+        return float(np.partition(np.asarray(values), k)[k])
+    return float(sorted(values)[k])
+
+
+def largest(values, k: int):
+    """Positions of the ``k`` largest values (unordered)."""
+    if np is not None:
+        values = np.asarray(values)
+        if len(values) <= k:
+            return np.arange(len(values))
+        return np.argpartition(-values, k)[:k]
+    return heapq.nlargest(k, range(len(values)), key=values.__getitem__)
+
+
+# ==================== Store ====================
+
+class EventStore:
+    """Parallel typed arrays holding every event of a trace."""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.arrays = {name: array(typecode) for name, typecode in COLUMNS}
+        self.comms: List[str] = []
+        self.event_types: List[str] = []
+        self.states: List[str] = ['']
+        self._comm_codes: Dict[bytes, int] = {}
+        self._event_codes: Dict[bytes, int] = {}
+        self._state_codes: Dict[bytes, int] = {b'': 0}
+        self._views: Dict[str, object] = {}
+        self._cache: Dict[str, object] = {}
+
+    # ==================== Build ====================
+
+    @classmethod
+    def from_file(cls, path: str) -> 'EventStore':
+        """Scans ``path`` once and fills the columns."""
+        store = cls(path)
+        with TraceReader(path) as reader:
+            base = 0
+            for chunk in reader.iter_chunks():
+                store._append_chunk(chunk, base)
+                base += len(chunk)
+        return store
+
+    @classmethod
+    def load(cls, path: str, cache=None) -> 'EventStore':
+        """Loads the store of ``path`` from the trace cache, parsing and caching
+        it on a miss. ``cache=False`` bypasses the cache."""
+        if cache is None:
+            cache = default_cache()
+        if cache:
+            entry = cache.load(path, CACHE_KIND)
+            if entry is not None:
+                return cls.from_columns(path, *entry)
+        store = cls.from_file(path)
+        if cache:
+            cache.store(path, CACHE_KIND, store.arrays,
+                        {'comms': store.comms, 'event_types': store.event_types, 'states': store.states})
+        return store
+
+    @classmethod
+    def from_columns(cls, path: Optional[str], columns: Dict[str, array], meta: Dict) -> 'EventStore':
+        store = cls(path)
+        if set(columns) != set(store.arrays):
+            raise ValueError("column set mismatch")
+        store.arrays = columns
+        store.comms, store.event_types, store.states = meta['comms'], meta['event_types'], meta['states']
+        for codes, names in ((store._comm_codes, store.comms), (store._event_codes, store.event_types),
+                             (store._state_codes, store.states)):
+            codes.clear()
+            codes.update((name.encode('utf-8'), code) for code, name in enumerate(names))
+        return store
+
+    def _code(self, codes: Dict[bytes, int], names: List[str], raw: bytes) -> int:
+        code = codes.get(raw)
+        if code is None:
+            code = codes[raw] = len(names)
+            names.append(raw.decode('utf-8', 'replace'))
+        return code
+
+    def _append_chunk(self, chunk: bytes, base: int):
+        cols = self.arrays
+        ts, cpu, pid, comm = cols['ts'].append, cols['cpu'].append, cols['pid'].append, cols['comm'].append
+        event, state, next_pid, next_comm = (cols['event'].append, cols['state'].append,
+                                             cols['next_pid'].append, cols['next_comm'].append)
+        offset = cols['offset'].append
+        comm_codes, event_codes, state_codes = self._comm_codes, self._event_codes, self._state_codes
+        switch = SCHED_SWITCH.encode()
+
+        for m in _LINE_PATTERN.finditer(chunk):
+            raw_comm, raw_pid, raw_cpu, raw_ts, raw_event, details = m.groups()
+            code = comm_codes.get(raw_comm)
+            if code is None:
+                code = self._code(comm_codes, self.comms, raw_comm)
+            event_code = event_codes.get(raw_event)
+            if event_code is None:
+                event_code = self._code(event_codes, self.event_types, raw_event)
+            ts(float(raw_ts))
+            cpu(int(raw_cpu))
+            pid(int(raw_pid))
+            comm(code)
+            event(event_code)
+            offset(base + m.start())
+            if raw_event == switch:
+                match = _PREV_STATE_PATTERN.search(details)
+                raw_state = match.group(1)[:1] if match else b''
+                state_code = state_codes.get(raw_state)
+                if state_code is None:
+                    state_code = self._code(state_codes, self.states, raw_state)
+                state(state_code)
+                match = _NEXT_TASK_PATTERN.search(details)
+                if match:
+                    next_comm(comm_codes.get(match.group(1))
+                              or self._code(comm_codes, self.comms, match.group(1)))
+                    next_pid(int(match.group(2)))
+                    continue
+            else:
+                state(0)
+            next_comm(0)
+            next_pid(-1)
+
+    # ==================== Columns ====================
+
+    def __len__(self) -> int:
+        return len(self.arrays['ts'])
+
+    @property
+    def nbytes(self) -> int:
+        return sum(len(col) * col.itemsize for col in self.arrays.values())
+
+    def column(self, name: str):
+        """The column as an ndarray view (NumPy) or the underlying array."""
+        if np is None:
+            return self.arrays[name]
+        view = self._views.get(name)
+        if view is None:
+            col = self.arrays[name]
+            view = (np.frombuffer(col, dtype=col.typecode) if len(col)
+                    else np.zeros(0, dtype=col.typecode))
+            self._views[name] = view
+        return view
+
+    def event_code(self, event_type: str) -> int:
+        """Code of ``event_type``, or -1 if it never occurs."""
+        code = self._event_codes.get(event_type.encode())
+        return -1 if code is None else code
+
+    def time_range(self) -> Tuple[float, float]:
+        """``(first, last)`` timestamp, computed once; (0.0, 0.0) when empty."""
+        bounds = self._cache.get('time_range')
+        if bounds is None:
+            ts = self.column('ts')
+            if not len(ts):
+                bounds = (0.0, 0.0)
+            elif np is not None:
+                bounds = (float(ts.min()), float(ts.max()))
+            else:
+                bounds = (float(min(ts)), float(max(ts)))
+            self._cache['time_range'] = bounds
+        return bounds
+
+    @property
+    def start_time(self) -> float:
+        return self.time_range()[0]
+
+    @property
+    def end_time(self) -> float:
+        return self.time_range()[1]
+
+    @property
+    def cpus(self) -> List[int]:
+        if np is not None:
+            return np.unique(self.column('cpu')).tolist()
+        return sorted(set(self.arrays['cpu']))
+
+    # ==================== Orders and derived columns ====================
+
+    def order(self, by: Optional[str] = None):
+        """Row order by timestamp, or by ``(by, timestamp)`` for 'cpu' / 'pid'."""
+        key = by or 'ts'
+        order = self._cache.get('order_' + key)
+        if order is None:
+            ts = self.column('ts')
+            order = argsort(ts, self.column(by) if by else None)
+            self._cache['order_' + key] = order
+        return order
+
+    def gaps(self, threshold: float, by: Optional[str] = None):
+        """Pairs of consecutive events (in time, or per CPU/PID with ``by``)
+        further apart than ``threshold`` seconds.
+
+        Returns ``(prev_rows, next_rows, durations)``.
+        """
+        order = self.order(by)
+        ts = take(self.column('ts'), order)
+        groups = take(self.column(by), order) if by else None
+        positions, durations = consecutive_gaps(ts, threshold, groups)
+        if np is not None:
+            return order[positions], order[positions + 1], durations
+        return ([order[k] for k in positions], [order[k + 1] for k in positions], durations)
+
+    def process_types(self, pids, comms):
+        """PROCESS_TYPES index for each ``(pid, comm code)`` pair."""
+        lut = self._cache.get('type_lut')
+        if lut is None or len(lut) != len(self.comms):
+            lut = [PROCESS_TYPES.index(classify_process(1, comm)) for comm in self.comms]
+            self._cache['type_lut'] = lut
+        if np is not None:
+            types = np.asarray(lut, dtype=np.uint8)[comms] if len(lut) \
+                else np.zeros(len(comms), dtype=np.uint8)
+            types[np.asarray(pids) == 0] = IDLE_TYPE
+            return types
+        return [IDLE_TYPE if p == 0 else lut[c] for p, c in zip(pids, comms)]
+
+    def run_segments(self) -> Dict[str, Sequence]:
+        """Per-CPU run intervals derived from sched_switch.
+
+        Each switch starts a segment for ``next_pid`` that lasts until the next
+        switch on the same CPU (the last one until the end of the trace).
+        Columns: cpu, start, end, pid, comm; ordered by (cpu, start).
+        """
+        segments = self._cache.get('segments')
+        if segments is not None:
+            return segments
+        code = self.event_code(SCHED_SWITCH)
+        ts, cpu = self.column('ts'), self.column('cpu')
+        next_pid, next_comm = self.column('next_pid'), self.column('next_comm')
+        end_time = self.end_time
+        if np is not None:
+            rows = np.flatnonzero((self.column('event') == code) & (next_pid >= 0))
+            rows = rows[np.lexsort((ts[rows], cpu[rows]))]
+            start, seg_cpu = ts[rows], cpu[rows]
+            end = np.full(len(rows), end_time)
+            if len(rows) > 1:
+                same_cpu = seg_cpu[1:] == seg_cpu[:-1]
+                end[:-1] = np.where(same_cpu, start[1:], end_time)
+            segments = {'cpu': seg_cpu, 'start': start, 'end': end,
+                        'pid': next_pid[rows], 'comm': next_comm[rows]}
+        else:
+            event = self.arrays['event']
+            rows = [i for i in range(len(ts)) if event[i] == code and next_pid[i] >= 0]
+            rows.sort(key=lambda i: (cpu[i], ts[i]))
+            start = [ts[i] for i in rows]
+            seg_cpu = [cpu[i] for i in rows]
+            end = [start[k + 1] if k + 1 < len(rows) and seg_cpu[k + 1] == seg_cpu[k] else end_time
+                   for k in range(len(rows))]
+            segments = {'cpu': seg_cpu, 'start': start, 'end': end,
+                        'pid': [next_pid[i] for i in rows], 'comm': [next_comm[i] for i in rows]}
+        self._cache['segments'] = segments
+        return segments
+
+    def cpu_rows(self, cpu: int, start: float, end: float) -> List[int]:
+        """Rows on ``cpu`` with ``start < ts < end``."""
+        order = self.order('cpu')
+        cpus = self._cache.get('cpu_sorted')
+        if cpus is None:
+            cpus = self._cache['cpu_sorted'] = take(self.column('cpu'), order)
+            self._cache['cpu_ts_sorted'] = take(self.column('ts'), order)
+        ts = self._cache['cpu_ts_sorted']
+        lo, hi = bisect_left(cpus, cpu), bisect_right(cpus, cpu)
+        first = bisect_right(ts, start, lo, hi)
+        last = bisect_left(ts, end, first, hi)
+        return to_list(order[first:last])
+
+    # ==================== Rows ====================
+
+    def comm_of(self, row: int) -> str:
+        return self.comms[self.arrays['comm'][row]]
+
+    def events(self, rows: Sequence[int]) -> List:
+        """Re-parses the original lines of ``rows`` into full ``Event`` objects."""
+        if not self.path:
+            return [None] * len(rows)
+        offsets = self.arrays['offset']
+        result = []
+        with open(self.path, 'rb') as f:
+            for row in rows:
+                f.seek(offsets[row])
+                result.append(parse_event(f.readline().decode('utf-8', 'replace').rstrip('\r\n')))
+        return result
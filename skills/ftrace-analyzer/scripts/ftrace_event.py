@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Event model for ftrace text logs.
+
+An ftrace data line looks like::
+
+    kube-apiserver-3711  [000] d..2  7541.834000: sched_switch: prev_comm=... ==> next_comm=...
+
+``parse_event`` turns such a line into a slotted ``Event``; the ``key=value``
+details are only split into fields when an accessor needs them.
+"""
+import re
+from typing import Dict, Iterable, Optional, Set
+
+EVENT_PATTERN = re.compile(
+    r'^\s*(?P<comm>.*?)-(?P<pid>\d+)\s+(?:\(\s*[\d-]+\)\s+)?\[(?P<cpu>\d+)\]\s+'
+    r'(?:(?P<flags>\S{4,5})\s+)?(?P<timestamp>\d+\.\d+):\s+(?P<event>\w+):\s?(?P<details>.*)$'
+)
+
+FIELD_PATTERN = re.compile(r'(\w+)=(\S+)')
+
+# Events whose details name a second task besides the one owning the line.
+NEXT_TASK_PATTERN = re.compile(r'next_comm=(\S+) next_pid=(\d+)')
+TARGET_TASK_PATTERN = re.compile(r'\bcomm=(\S+) pid=(\d+)')
+
+PROCESS_TYPES = ('user', 'kernel_thread', 'idle', 'irq', 'softirq')
+
+KERNEL_THREAD_PREFIXES = (
+    'kworker', 'kthreadd', 'rcu_', 'rcuo', 'rcuop', 'migration/', 'watchdog',
+    'kswapd', 'kcompactd', 'khugepaged', 'jbd2/', 'cpuhp/', 'kauditd', 'kblockd',
+    'kdevtmpfs', 'khungtaskd', 'oom_reaper', 'writeback', 'kintegrityd',
+    'kthrotld', 'ksmd', 'xfsaild', 'xfs-', 'ext4-', 'scsi_', 'md/', 'idle_inject/',
+    'ipv6_addrconf',
+)
+
+
+def classify_process(pid: int, comm: str) -> str:
+    """Classifies a task as user / kernel_thread / idle / irq / softirq."""
+    if pid == 0 or comm.startswith('swapper'):
+        return 'idle'
+    if comm.startswith('ksoftirqd'):
+        return 'softirq'
+    if comm.startswith('irq/'):
+        return 'irq'
+    if comm.startswith(KERNEL_THREAD_PREFIXES):
+        return 'kernel_thread'
+    return 'user'
+
+
+class Event:
+    """A single ftrace event line."""
+    __slots__ = ('timestamp', 'cpu', 'pid', 'comm', 'event_type', 'flags',
+                 'details', '_fields')
+
+    def __init__(self, timestamp: float, cpu: int, pid: int, comm: str,
+                 event_type: str, details: str = '', flags: str = ''):
+        self.timestamp = timestamp
+        self.cpu = cpu
+        self.pid = pid
+        self.comm = comm
+        self.event_type = event_type
+        self.flags = flags
+        self.details = details
+        self._fields = None
+
+    @property
+    def fields(self) -> Dict[str, str]:
+        """``key=value`` pairs from the event details."""
+        if self._fields is None:
+            self._fields = dict(FIELD_PATTERN.findall(self.details))
+        return self._fields
+
+    def _int_field(self, name: str) -> Optional[int]:
+        value = self.fields.get(name)
+        return int(value) if value is not None and value.isdigit() else None
+
+    @property
+    def prev_comm(self) -> Optional[str]:
+        return self.fields.get('prev_comm')
+
+    @property
+    def prev_pid(self) -> Optional[int]:
+        return self._int_field('prev_pid')
+
+    @property
+    def prev_state(self) -> Optional[str]:
+        return self.fields.get('prev_state')
+
+    @property
+    def next_comm(self) -> Optional[str]:
+        return self.fields.get('next_comm')
+
+    @property
+    def next_pid(self) -> Optional[int]:
+        return self._int_field('next_pid')
+
+    @property
+    def related_pids(self) -> Set[int]:
+        """PIDs the event is about: the owning task plus the switched-in or woken task."""
+        pids = {self.pid}
+        for pattern in (NEXT_TASK_PATTERN, TARGET_TASK_PATTERN):
+            match = pattern.search(self.details)
+            if match:
+                pids.add(int(match.group(2)))
+        return pids
+
+    def to_dict(self) -> Dict:
+        return {
+            'timestamp': self.timestamp,
+            'cpu': self.cpu,
+            'pid': self.pid,
+            'comm': self.comm,
+            'event_type': self.event_type,
+            'details': self.details,
+        }
+
+    def __repr__(self):
+        return (f"Event({self.timestamp:.6f} cpu={self.cpu} {self.comm}-{self.pid} "
+                f"{self.event_type}: {self.details})")
+
+
+def parse_event(line: str) -> Optional[Event]:
+    """Parses one ftrace data line, or returns None for non-event lines."""
+    match = EVENT_PATTERN.match(line)
+    if not match:
+        return None
+    return Event(float(match.group('timestamp')), int(match.group('cpu')),
+                 int(match.group('pid')), match.group('comm'), match.group('event'),
+                 match.group('details'), match.group('flags') or '')
+
+
+def parse_events(lines: Iterable[str]):
+    """Yields an Event for every parsable line."""
+    for line in lines:
+        event = parse_event(line)
+        if event is not None:
+            yield event
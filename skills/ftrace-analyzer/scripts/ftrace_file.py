@@ -0,0 +1,419 @@
+#!/usr/bin/env python3
+"""
+TraceFile: file-level entry point of the ftrace parser
+(see doc/ftrace_parser_analysis_driven_design.md).
+
+The first call that needs metadata scans the log once and persists a sidecar
+index next to it (``<trace>.index``):
+
+- metadata: time range, line/event counts, event types, CPUs, processes;
+- sparse checkpoints: the file is cut into ~1 MiB line-aligned blocks, each
+  recording its byte offset, min/max timestamp and event count;
+- postings: for every CPU and PID, the blocks that contain its events,
+  stored as run-length ``[first, last]`` block ranges.
+
+The index is written as three JSON lines (metadata, blocks, postings) so that
+``info()``, ``get_time_range()``, ``get_cpus()`` and ``get_processes()`` only
+parse the small first line; blocks and postings are loaded on demand.
+"""
+import json
+import os
+import re
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+
+try:
+    from .ftrace_event import (NEXT_TASK_PATTERN, PROCESS_TYPES, TARGET_TASK_PATTERN,
+                               classify_process)
+    from .ftrace_query import QueryBuilder
+    from .ftrace_reader import TraceReader
+except ImportError:
+    from ftrace_event import (NEXT_TASK_PATTERN, PROCESS_TYPES, TARGET_TASK_PATTERN,
+                              classify_process)
+    from ftrace_query import QueryBuilder
+    from ftrace_reader import TraceReader
+
+INDEX_VERSION = 1
+INDEX_SUFFIX = '.index'
+
+# Target size of an index block (checkpoint interval).
+BLOCK_SIZE = 1024 * 1024
+
+# Multi-line variant of ftrace_event.EVENT_PATTERN used to index a whole block
+# with one findall call: comm, pid, cpu, timestamp, event name.
+_INDEX_PATTERN = re.compile(
+    r'^[ \t]*(.*?)-(\d+)[ \t]+(?:\([ \t]*[\d-]+\)[ \t]+)?\[(\d+)\][ \t]+'
+    r'(?:\S{4,5}[ \t]+)?(\d+\.\d+):[ \t]+(\w+):',
+    re.M
+)
+
+
+def encode_postings(block_ids: Iterable[int]) -> List[int]:
+    """Encodes sorted block ids as a flat list of inclusive [first, last] ranges."""
+    ranges = []
+    for block_id in block_ids:
+        if ranges and ranges[-1] == block_id - 1:
+            ranges[-1] = block_id
+        else:
+            ranges.extend((block_id, block_id))
+    return ranges
+
+
+def decode_postings(ranges: List[int]) -> List[int]:
+    """Expands a run-length postings list back into sorted block ids."""
+    block_ids = []
+    for i in range(0, len(ranges), 2):
+        block_ids.extend(range(ranges[i], ranges[i + 1] + 1))
+    return block_ids
+
+
+def _index_range(file_path: str, start: int, end: int, index_by: Tuple[str, ...]) -> Dict:
+    """Indexes the newline-aligned byte range [start, end) of the trace."""
+    index_cpu = 'cpu' in index_by
+    index_pid = 'pid' in index_by
+    blocks = []
+    cpu_blocks = defaultdict(list)
+    pid_blocks = defaultdict(list)
+    # comm of the task owning a line (last one wins) and comm named by
+    # next_comm=/comm= fields (first one wins, only used for tasks never owning a line)
+    owners = {}
+    hints = {}
+    event_types = Counter()
+    cpu_events = Counter()
+    line_count = 0
+
+    with TraceReader(file_path) as reader:
+        offset = start
+        for chunk in reader.iter_chunks(start, end, BLOCK_SIZE):
+            block_id = len(blocks)
+            text = chunk.decode('utf-8', 'replace')
+            line_count += chunk.count(b'\n') + (0 if chunk.endswith(b'\n') else 1)
+
+            cpus = set()
+            pids = set()
+            ts_min = ts_max = None
+            count = 0
+            for comm, pid, cpu, ts, event_type in _INDEX_PATTERN.findall(text):
+                ts = float(ts)
+                if ts_min is None:
+                    ts_min = ts_max = ts
+                elif ts < ts_min:
+                    ts_min = ts
+                elif ts > ts_max:
+                    ts_max = ts
+                count += 1
+                cpus.add(cpu)
+                pids.add(pid)
+                cpu_events[cpu] += 1
+                event_types[event_type] += 1
+                if comm != '<...>':
+                    owners[pid] = comm
+
+            # tasks switched in or woken up by an event owned by another task
+            for pattern in (NEXT_TASK_PATTERN, TARGET_TASK_PATTERN):
+                for comm, pid in pattern.findall(text):
+                    pids.add(pid)
+                    hints.setdefault(pid, comm)
+
+            if index_cpu:
+                for cpu in cpus:
+                    cpu_blocks[int(cpu)].append(block_id)
+            if index_pid:
+                for pid in pids:
+                    pid_blocks[int(pid)].append(block_id)
+            blocks.append([offset, ts_min, ts_max, count])
+            offset += len(chunk)
+
+    return {
+        'blocks': blocks,
+        'cpu_blocks': cpu_blocks,
+        'pid_blocks': pid_blocks,
+        'owners': owners,
+        'hints': hints,
+        'event_types': event_types,
+        'cpu_events': cpu_events,
+        'line_count': line_count,
+    }
+
+
+def _index_range_worker(args):
+    return _index_range(*args)
+
+
+def _format_size(size: int) -> str:
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f"{size:.1f} {unit}" if unit != 'B' else f"{size} B"
+        size /= 1024
+
+
+class TraceFile:
+    """
+    Ftrace 日志文件的总接口
+
+    职责：
+    1. 提供文件元信息（首次扫描后由索引直接回答）
+    2. 构建并持久化索引以支持快速查询
+    3. 按块流式读取，不把整个文件载入内存
+    """
+
+    def __init__(self, filepath: str,
+                 index_by: Iterable[str] = ('timestamp', 'cpu', 'pid'),
+                 lazy_load: bool = True):
+        """
+        Args:
+            filepath: ftrace 日志文件路径
+            index_by: 构建哪些索引（'cpu'/'pid' 决定是否生成对应的 postings）
+            lazy_load: True=首次需要时才建立/加载索引，False=立即建立
+        """
+        self.filepath = os.path.abspath(filepath)
+        if not os.path.isfile(self.filepath):
+            raise FileNotFoundError(f"Trace file not found: {self.filepath}")
+        self.index_path = self.filepath + INDEX_SUFFIX
+        self.index_by = tuple(index_by)
+        self._meta = None
+        self._blocks = None
+        self._postings = None
+        if not lazy_load:
+            self.build_index()
+
+    # ==================== 索引管理 ====================
+
+    def _file_stamp(self) -> Tuple[int, float]:
+        st = os.stat(self.filepath)
+        return st.st_size, st.st_mtime
+
+    def _read_index_line(self, line_no: int):
+        with open(self.index_path, 'r') as f:
+            for i, line in enumerate(f):
+                if i == line_no:
+                    return json.loads(line)
+        raise ValueError(f"Corrupted index file: {self.index_path}")
+
+    def _load_meta(self) -> Optional[Dict]:
+        """Loads the persisted metadata if the index exists and is up to date."""
+        try:
+            with open(self.index_path, 'r') as f:
+                meta = json.loads(f.readline())
+        except (OSError, ValueError):
+            return None
+        size, mtime = self._file_stamp()
+        if (meta.get('version') != INDEX_VERSION or meta.get('file_size') != size
+                or meta.get('mtime') != mtime
+                or not set(self.index_by) <= set(meta.get('index_by', ()))):
+            return None
+        return meta
+
+    def has_index(self) -> bool:
+        """是否已有（与文件内容一致的）索引"""
+        if self._meta is not None and \
+                (self._meta['file_size'], self._meta['mtime']) == self._file_stamp():
+            return True
+        return self._load_meta() is not None
+
+    def build_index(self, force: bool = False, jobs: int = 1):
+        """
+        构建索引（加速后续查询）
+
+        Args:
+            force: 是否强制重建索引
+            jobs: 并行扫描的进程数（按换行对齐的字节范围切分）
+
+        Note:
+            索引保存为 <trace>.index；首次调用会扫描文件，之后直接加载。
+            目录不可写时索引只保存在内存中。
+        """
+        if not force:
+            meta = self._load_meta()
+            if meta is not None:
+                self._meta, self._blocks, self._postings = meta, None, None
+                return
+
+        size, mtime = self._file_stamp()
+        with TraceReader(self.filepath) as reader:
+            ranges = reader.split_ranges(jobs)
+        tasks = [(self.filepath, start, end, self.index_by) for start, end in ranges]
+        if len(tasks) > 1:
+            with ProcessPoolExecutor(max_workers=len(tasks)) as executor:
+                parts = list(executor.map(_index_range_worker, tasks))
+        else:
+            parts = [_index_range(*task) for task in tasks]
+
+        # merge the per-range results in file order, renumbering the blocks
+        blocks = []
+        cpu_blocks = defaultdict(list)
+        pid_blocks = defaultdict(list)
+        owners = {}
+        hints = {}
+        event_types = Counter()
+        cpu_events = Counter()
+        line_count = 0
+        for part in parts:
+            base = len(blocks)
+            blocks.extend(part['blocks'])
+            for cpu, ids in part['cpu_blocks'].items():
+                cpu_blocks[cpu].extend(base + i for i in ids)
+            for pid, ids in part['pid_blocks'].items():
+                pid_blocks[pid].extend(base + i for i in ids)
+            owners.update(part['owners'])
+            for pid, comm in part['hints'].items():
+                hints.setdefault(pid, comm)
+            event_types.update(part['event_types'])
+            cpu_events.update(part['cpu_events'])
+            line_count += part['line_count']
+
+        processes = dict(hints, **owners)
+
+        starts = [b[1] for b in blocks if b[1] is not None]
+        ends = [b[2] for b in blocks if b[2] is not None]
+        meta = {
+            'version': INDEX_VERSION,
+            'filepath': self.filepath,
+            'file_size': size,
+            'mtime': mtime,
+            'index_by': list(self.index_by),
+            'block_size': BLOCK_SIZE,
+            'block_count': len(blocks),
+            'line_count': line_count,
+            'event_count': sum(b[3] for b in blocks),
+            'time_range': [min(starts), max(ends)] if starts else [0.0, 0.0],
+            'event_types': dict(event_types.most_common()),
+            'cpus': {str(cpu): n for cpu, n in sorted(cpu_events.items(), key=lambda x: int(x[0]))},
+            'processes': {str(pid): comm for pid, comm in
+                          sorted(processes.items(), key=lambda x: int(x[0]))},
+        }
+        postings = {
+            'cpu': {str(cpu): encode_postings(ids) for cpu, ids in sorted(cpu_blocks.items())},
+            'pid': {str(pid): encode_postings(ids) for pid, ids in sorted(pid_blocks.items())},
+        }
+
+        tmp_path = f"{self.index_path}.tmp{os.getpid()}"
+        try:
+            with open(tmp_path, 'w') as f:
+                f.write(json.dumps(meta, ensure_ascii=False) + '\n')
+                f.write(json.dumps(blocks) + '\n')
+                f.write(json.dumps(postings) + '\n')
+            os.replace(tmp_path, self.index_path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        self._meta, self._blocks, self._postings = meta, blocks, postings
+
+    def _ensure_index(self) -> Dict:
+        if self._meta is None:
+            self.build_index()
+        return self._meta
+
+    @property
+    def blocks(self) -> List[List]:
+        """Index checkpoints: [byte_offset, min_ts, max_ts, event_count] per block."""
+        self._ensure_index()
+        if self._blocks is None:
+            self._blocks = self._read_index_line(1)
+        return self._blocks
+
+    def block_range(self, block_id: int) -> Tuple[int, int]:
+        """Byte range [start, end) covered by a block."""
+        blocks = self.blocks
+        start = blocks[block_id][0]
+        end = blocks[block_id + 1][0] if block_id + 1 < len(blocks) else self._meta['file_size']
+        return start, end
+
+    def postings(self, kind: str, key: int) -> List[int]:
+        """Block ids containing events of the given CPU (kind='cpu') or PID (kind='pid')."""
+        self._ensure_index()
+        if kind not in self.index_by:
+            raise ValueError(f"Trace index was not built with '{kind}' postings")
+        if self._postings is None:
+            self._postings = self._read_index_line(2)
+        return decode_postings(self._postings[kind].get(str(key), []))
+
+    # ==================== 文件基础信息 ====================
+
+    def info(self) -> Dict:
+        """获取文件元信息（首次调用建立索引，之后直接读取索引）"""
+        meta = self._ensure_index()
+        start, end = meta['time_range']
+        return {
+            'filepath': self.filepath,
+            'file_size': _format_size(meta['file_size']),
+            'line_count': meta['line_count'],
+            'event_count': meta['event_count'],
+            'time_range': {
+                'start': start,
+                'end': end,
+                'duration': end - start,
+            },
+            'event_types': list(meta['event_types']),
+            'cpu_count': len(meta['cpus']),
+            'process_count': len(meta['processes']),
+            'indexed': self.has_index(),
+        }
+
+    def summary(self) -> str:
+        """返回友好的文本摘要"""
+        info = self.info()
+        cpus = self.get_cpus()
+        tr = info['time_range']
+        cpu_desc = f"{len(cpus)} (CPU {cpus[0]}-{cpus[-1]})" if cpus else "0"
+        lines = [
+            "Ftrace 日志摘要",
+            "===============",
+            f"文件: {os.path.basename(self.filepath)} ({info['file_size']})",
+            f"时间范围: {tr['start']:.3f} - {tr['end']:.3f} ({tr['duration']:.2f} 秒)",
+            f"事件数: {info['event_count']:,} ({info['line_count']:,} 行)",
+            f"CPU 数: {cpu_desc}",
+            f"进程数: {info['process_count']} 个",
+            f"事件类型: {', '.join(info['event_types']) or '无'}",
+            f"索引: {'✓' if info['indexed'] else '✗'} ({', '.join(self.index_by)})",
+        ]
+        return '\n'.join(lines)
+
+    # ==================== 快速统计 ====================
+
+    def get_time_range(self) -> Tuple[float, float]:
+        """获取时间范围 (start, end)"""
+        start, end = self._ensure_index()['time_range']
+        return start, end
+
+    def get_duration(self) -> float:
+        """获取总时长（秒）"""
+        start, end = self.get_time_range()
+        return end - start
+
+    def get_event_count(self) -> int:
+        """获取事件总数（精确值，来自索引）"""
+        return self._ensure_index()['event_count']
+
+    def get_event_types(self) -> Dict[str, int]:
+        """获取各事件类型的数量"""
+        return dict(self._ensure_index()['event_types'])
+
+    def get_cpus(self) -> List[int]:
+        """获取涉及的 CPU 列表"""
+        return [int(cpu) for cpu in self._ensure_index()['cpus']]
+
+    def get_processes(self) -> List[Dict]:
+        """获取所有进程信息 [{'pid', 'comm', 'type'}, ...]"""
+        return [{'pid': int(pid), 'comm': comm, 'type': classify_process(int(pid), comm)}
+                for pid, comm in self._ensure_index()['processes'].items()]
+
+    def get_process_types(self) -> Dict[str, List[Dict]]:
+        """按类型分组返回进程"""
+        groups = {ptype: [] for ptype in PROCESS_TYPES}
+        for proc in self.get_processes():
+            groups[proc['type']].append({'pid': proc['pid'], 'comm': proc['comm']})
+        return groups
+
+    # ==================== 查询接口 ====================
+
+    def query(self) -> QueryBuilder:
+        """
+        返回查询构造器（链式调用）
+
+        Example:
+            trace.query().time_range(7541.0, 7542.0).cpu(0, 1, 2).pid(3711).execute()
+        """
+        return QueryBuilder(self)
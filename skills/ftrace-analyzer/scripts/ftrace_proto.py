@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+"""
+One-time conversion of an ftrace text log to a binary perfetto trace.
+
+trace_processor parses textual ftrace line by line on every load, which is
+much slower than ingesting the protobuf ``Trace`` format. ``convert`` streams
+``trace.log`` once and writes ``trace.log.pftrace`` next to it. A sidecar
+``trace.log.pftrace.json`` records the source size and mtime and whether the
+conversion was lossless. ``preferred_trace`` returns the binary file when it
+is newer than the text, matches it and lost nothing; otherwise it returns the
+text itself, so the analysis scripts can call it unconditionally.
+
+The protobuf is encoded by hand (no ``protobuf`` dependency, no schema
+download). Only the messages below are written, with the field numbers of
+perfetto's ``trace.proto`` / ``ftrace_event.proto``:
+
+    Trace.packet = 1
+    TracePacket.ftrace_events = 1, process_tree = 2
+    ProcessTree.processes = 1 {pid = 1, cmdline = 3, cmdline_is_comm = 7},
+        threads = 2 {tid = 1, name = 2, tgid = 3}
+    FtraceEventBundle.cpu = 1, event = 2
+    FtraceEvent.timestamp = 1, pid = 2, print = 3, sched_switch = 4,
+        cpu_frequency = 11, cpu_idle = 13, sched_wakeup = 17,
+        sched_waking = 20, softirq_entry/exit/raise = 24/25/26,
+        irq_handler_entry/exit = 36/37
+
+Events of any other type, or whose fields do not parse, are counted in the
+sidecar's ``skipped`` map and make the conversion lossy. So are data lines
+that do not parse as an event at all (``CPU:N [LOST n EVENTS]``, stack trace
+continuations, ...), under ``<unparsed>``. The scripts then keep loading the
+text.
+
+    python ftrace_proto.py trace.log
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import tempfile
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional
+
+try:
+    from .ftrace_reader import TraceReader
+except ImportError:
+    from ftrace_reader import TraceReader
+
+PROTO_SUFFIX = '.pftrace'
+META_SUFFIX = '.json'
+CONVERTER_VERSION = 2
+# events per FtraceEventBundle
+BUNDLE_EVENTS = 2048
+CHUNK_SIZE = 4 * 1024 * 1024
+
+# comm, pid, tgid, cpu, timestamp, event, details; the tgid column is
+# present with the record-tgid option and reads "-----" when unknown
+_LINE_PATTERN = re.compile(
+    rb'^[ \t]*(.*?)-(\d+)[ \t]+(?:\([ \t]*([\d-]+)\)[ \t]+)?\[(\d+)\][ \t]+'
+    rb'(?:\S{4,5}[ \t]+)?(\d+)\.(\d+):[ \t]+(\w+):[ \t]?(.*?)\r?$',
+    re.M
+)
+_SCHED_SWITCH = re.compile(
+    rb'prev_comm=(.*?) prev_pid=(-?\d+) prev_prio=(-?\d+) prev_state=(\S+) ==> '
+    rb'next_comm=(.*?) next_pid=(-?\d+) next_prio=(-?\d+)$')
+_SCHED_WAKEUP = re.compile(
+    rb'comm=(.*?) pid=(-?\d+) prio=(-?\d+)(?: success=(\d+))? target_cpu=(\d+)$')
+_CPU_STATE = re.compile(rb'state=(\d+) cpu_id=(\d+)$')
+_SOFTIRQ = re.compile(rb'vec=(\d+)(?: \[action=\w+\])?$')
+_IRQ_ENTRY = re.compile(rb'irq=(-?\d+) name=(.*)$')
+_IRQ_EXIT = re.compile(rb'irq=(-?\d+) ret=(\w+)$')
+
+# Kernel (>= 4.14) TASK_REPORT bits behind the prev_state letters; '+' is
+# TASK_REPORT_MAX, set when the task was preempted while runnable.
+_TASK_STATES = {b'R': 0, b'S': 1, b'D': 2, b'T': 4, b't': 8, b'X': 16, b'Z': 32, b'P': 64, b'I': 128}
+_PREEMPTED = 256
+_IRQ_RET = {b'handled': 1, b'unhandled': 0}
+
+UNPARSED = '<unparsed>'
+
+
+# ==================== Protobuf wire format ====================
+
+def varint(value: int) -> bytes:
+    """Base-128 varint; negative values use the 10-byte two's complement form."""
+    if value < 0:
+        value += 1 << 64
+    out = bytearray()
+    while value > 0x7f:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def field_varint(number: int, value: int) -> bytes:
+    return varint(number << 3) + varint(value)
+
+
+def field_bytes(number: int, data: bytes) -> bytes:
+    return varint(number << 3 | 2) + varint(len(data)) + data
+
+
+def _prev_state(text: bytes) -> Optional[int]:
+    state = 0
+    if text.endswith(b'+'):
+        state, text = _PREEMPTED, text[:-1]
+    for letter in text.split(b'|'):
+        bits = _TASK_STATES.get(letter)
+        if bits is None:
+            return None
+        state |= bits
+    return state
+
+
+def _wakeup(m) -> bytes:
+    comm, pid, prio, success, target_cpu = m.groups()
+    return (field_bytes(1, comm) + field_varint(2, int(pid)) + field_varint(3, int(prio)) +
+            (field_varint(4, int(success)) if success is not None else b'') +
+            field_varint(5, int(target_cpu)))
+
+
+def encode_event(event: bytes, details: bytes) -> Optional[bytes]:
+    """``FtraceEvent`` payload field for one event line, or None if unsupported."""
+    if event == b'sched_switch':
+        m = _SCHED_SWITCH.match(details)
+        if not m:
+            return None
+        prev_state = _prev_state(m.group(4))
+        if prev_state is None:
+            return None
+        body = (field_bytes(1, m.group(1)) + field_varint(2, int(m.group(2))) +
+                field_varint(3, int(m.group(3))) + field_varint(4, prev_state) +
+                field_bytes(5, m.group(5)) + field_varint(6, int(m.group(6))) +
+                field_varint(7, int(m.group(7))))
+        return field_bytes(4, body)
+    if event == b'sched_wakeup' or event == b'sched_waking':
+        m = _SCHED_WAKEUP.match(details)
+        return field_bytes(17 if event == b'sched_wakeup' else 20, _wakeup(m)) if m else None
+    if event == b'cpu_frequency' or event == b'cpu_idle':
+        m = _CPU_STATE.match(details)
+        if not m:
+            return None
+        body = field_varint(1, int(m.group(1))) + field_varint(2, int(m.group(2)))
+        return field_bytes(11 if event == b'cpu_frequency' else 13, body)
+    if event in (b'softirq_entry', b'softirq_exit', b'softirq_raise'):
+        m = _SOFTIRQ.match(details)
+        number = {b'softirq_entry': 24, b'softirq_exit': 25, b'softirq_raise': 26}[event]
+        return field_bytes(number, field_varint(1, int(m.group(1)))) if m else None
+    if event == b'irq_handler_entry':
+        m = _IRQ_ENTRY.match(details)
+        return field_bytes(36, field_varint(1, int(m.group(1))) + field_bytes(2, m.group(2))) if m else None
+    if event == b'irq_handler_exit':
+        m = _IRQ_EXIT.match(details)
+        if not m or m.group(2) not in _IRQ_RET:
+            return None
+        return field_bytes(37, field_varint(1, int(m.group(1))) + field_varint(2, _IRQ_RET[m.group(2)]))
+    if event == b'tracing_mark_write' or event == b'print':
+        # PrintFtraceEvent.buf; the kernel's buffer ends with a newline
+        return field_bytes(3, field_bytes(2, details + b'\n'))
+    return None
+
+
+def _unparsed_lines(gap: bytes) -> int:
+    """Data lines in text between two parsed events; headers and blank lines do not count."""
+    return sum(1 for line in gap.split(b'\n') if line.strip() and not line.lstrip().startswith(b'#'))
+
+
+def _packet(payload_field: bytes) -> bytes:
+    return field_bytes(1, payload_field)
+
+
+def _bundle_packet(cpu: int, events: List[bytes]) -> bytes:
+    bundle = field_varint(1, cpu) + b''.join(field_bytes(2, e) for e in events)
+    return _packet(field_bytes(1, bundle))
+
+
+def _process_tree_packet(threads: Dict[int, bytes], tgids: Dict[int, int], timestamp: int) -> bytes:
+    """ProcessTree packet linking each thread to its process; TracePacket.timestamp = 8.
+
+    A process is named after its main thread (tid == tgid), or after any of
+    its threads when the main thread never appears in the trace.
+    """
+    names = {}
+    for tid, tgid in sorted(tgids.items()):
+        if tgid > 0 and tid in threads and (tid == tgid or tgid not in names):
+            names[tgid] = threads[tid]
+    processes = b''.join(field_bytes(1, field_varint(1, pid) + field_bytes(3, name) + field_varint(7, 1))
+                         for pid, name in sorted(names.items()))
+    tree = b''.join(field_bytes(2, field_varint(1, tid) + field_bytes(2, name) +
+                                (field_varint(3, tgids[tid]) if tgids.get(tid, 0) > 0 else b''))
+                    for tid, name in sorted(threads.items()) if tid > 0)
+    return _packet(field_bytes(2, processes + tree) + field_varint(8, timestamp))
+
+
+# ==================== Conversion ====================
+
+def proto_path(trace_path: str) -> str:
+    return trace_path + PROTO_SUFFIX
+
+
+def _meta_path(trace_path: str) -> str:
+    return proto_path(trace_path) + META_SUFFIX
+
+
+def load_meta(trace_path: str) -> Optional[Dict]:
+    try:
+        with open(_meta_path(trace_path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def convert(trace_path: str, out_path: Optional[str] = None) -> Dict:
+    """Writes the binary trace (atomically) plus its sidecar; returns the sidecar dict."""
+    out_path = out_path or proto_path(trace_path)
+    st = os.stat(trace_path)
+    skipped = Counter()
+    converted = 0
+    threads = {}
+    tgids = {}
+    last_ts = 0
+    fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(os.path.abspath(out_path)))
+    try:
+        with os.fdopen(fd, 'wb') as out, TraceReader(trace_path) as reader:
+            for chunk in reader.iter_chunks(0, None, CHUNK_SIZE):
+                pending = defaultdict(list)
+                pos = 0
+                for m in _LINE_PATTERN.finditer(chunk):
+                    # consecutive events are separated by a single newline
+                    if m.start() - pos > 1:
+                        unparsed = _unparsed_lines(chunk[pos:m.start()])
+                        if unparsed:
+                            skipped[UNPARSED] += unparsed
+                    pos = m.end()
+                    comm, pid, tgid, cpu, sec, frac, event, details = m.groups()
+                    payload = encode_event(event, details)
+                    if payload is None:
+                        skipped[event.decode('ascii', 'replace')] += 1
+                        continue
+                    # timestamps stay exact: no float round trip
+                    ts = int(sec) * 1_000_000_000 + int(frac.ljust(9, b'0')[:9])
+                    pid = int(pid)
+                    events = pending[int(cpu)]
+                    events.append(field_varint(1, ts) + field_varint(2, pid) + payload)
+                    if len(events) >= BUNDLE_EVENTS:
+                        out.write(_bundle_packet(int(cpu), events))
+                        events.clear()
+                    if comm != b'<...>':
+                        threads[pid] = comm.strip()
+                    if tgid and tgid.isdigit():
+                        tgids[pid] = int(tgid)
+                    last_ts = max(last_ts, ts)
+                    converted += 1
+                unparsed = _unparsed_lines(chunk[pos:])
+                if unparsed:
+                    skipped[UNPARSED] += unparsed
+                for cpu, events in sorted(pending.items()):
+                    if events:
+                        out.write(_bundle_packet(cpu, events))
+            if threads:
+                out.write(_process_tree_packet(threads, tgids, last_ts))
+        os.replace(tmp_path, out_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    meta = {
+        'version': CONVERTER_VERSION,
+        'source_size': st.st_size,
+        'source_mtime': st.st_mtime,
+        'events': converted,
+        'skipped': dict(skipped),
+        'lossless': not skipped,
+        'proto_size': os.path.getsize(out_path),
+    }
+    if out_path == proto_path(trace_path):
+        with open(_meta_path(trace_path), 'w') as f:
+            json.dump(meta, f, indent=1)
+    return meta
+
+
+def preferred_trace(trace_path: str) -> str:
+    """The binary conversion of ``trace_path`` if it is usable, else ``trace_path``.
+
+    Usable means: newer than the text, converted from exactly this file
+    (size and mtime), by this converter version, and lossless.
+    """
+    binary = proto_path(trace_path)
+    meta = load_meta(trace_path)
+    if meta is None or not meta.get('lossless') or meta.get('version') != CONVERTER_VERSION:
+        return trace_path
+    try:
+        st = os.stat(trace_path)
+        if os.path.getmtime(binary) < st.st_mtime:
+            return trace_path
+    except OSError:
+        return trace_path
+    if meta.get('source_size') != st.st_size or meta.get('source_mtime') != st.st_mtime:
+        return trace_path
+    return binary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert an ftrace text log to a binary perfetto trace")
+    parser.add_argument("trace_file", help="Path to the ftrace text log")
+    parser.add_argument("--force", action="store_true", help="Convert even if an up-to-date binary exists")
+    args = parser.parse_args()
+
+    trace_path = os.path.abspath(args.trace_file)
+    if not args.force and preferred_trace(trace_path) != trace_path:
+        print(f"Up to date: {proto_path(trace_path)}")
+        return 0
+    meta = convert(trace_path)
+    print(f"Wrote {proto_path(trace_path)}: {meta['events']} events, "
+          f"{meta['proto_size'] / 1e6:.1f} MB (text {meta['source_size'] / 1e6:.1f} MB)")
+    if not meta['lossless']:
+        skipped = ', '.join(f"{name}={count}" for name, count in
+                            sorted(meta['skipped'].items(), key=lambda kv: -kv[1]))
+        print(f"Not lossless, the analysis scripts keep loading the text. Skipped: {skipped}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
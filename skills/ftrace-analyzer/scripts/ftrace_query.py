@@ -0,0 +1,576 @@
+#!/usr/bin/env python3
+"""
+Query layer of the ftrace parser (see doc/ftrace_parser_analysis_driven_design.md).
+
+``QueryBuilder`` collects predicates and executes them lazily against the
+``TraceFile`` index:
+
+1. time bounds select the index blocks whose [min_ts, max_ts] overlap the
+   window, so reading starts at the right byte offset;
+2. CPU / PID (and comm / process type, resolved to PIDs through the index)
+   filters intersect the postings lists before any line is parsed;
+3. the surviving blocks are coalesced into byte ranges and streamed through
+   the mmap reader, using a raw-bytes prefilter when a single event type is
+   requested;
+4. ``limit(n)`` stops reading as soon as n matching events were produced.
+
+``QueryResult`` is a streaming view: it re-runs the scan whenever it is
+iterated and computes summaries, group-bys and exports incrementally, so a
+broad query never holds its events in memory unless ``materialize()`` is
+called.
+"""
+import copy
+import csv
+import heapq
+import io
+import json
+import re
+from collections import Counter, defaultdict, deque
+from itertools import islice
+from typing import Callable, Dict, Iterator, List, Optional, TextIO, Tuple
+
+try:
+    from .ftrace_event import Event, classify_process, parse_event
+    from .ftrace_reader import TraceReader
+except ImportError:
+    from ftrace_event import Event, classify_process, parse_event
+    from ftrace_reader import TraceReader
+
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+EVENT_FIELDS = ('timestamp', 'cpu', 'pid', 'comm', 'event_type', 'details')
+
+
+def _key_needles(field: str, key: int) -> Tuple[bytes, ...]:
+    """Raw bytes every line owned by that CPU ('[002]') or task ('comm-1234') contains."""
+    if field == 'cpu':
+        return tuple(sorted({b'[%03d]' % key, b'[%d]' % key}))
+    return (b'-%d' % key,)
+
+
+class QueryBuilder:
+    """
+    查询构造器（支持链式调用）
+
+    - 每个方法返回 self，条件逐步累加
+    - 最后调用 execute() / count() / first() 执行查询
+    """
+
+    def __init__(self, trace):
+        self.trace = trace
+        self._start = None
+        self._end = None
+        self._cpus = None
+        self._pids = None
+        self._comms = None
+        self._comm_pattern = None
+        self._process_types = None
+        self._states = None
+        self._event_types = None
+        self._group_by = ()
+        self._order_by = None
+        self._limit = None
+
+    # ==================== 时间维度 ====================
+
+    def time_range(self, start: float, end: float) -> 'QueryBuilder':
+        """限制时间范围 [start, end]"""
+        self._start, self._end = start, end
+        return self
+
+    def time_slice(self, duration: float, offset: float = 0) -> 'QueryBuilder':
+        """从文件开头（偏移 offset 秒）取 duration 秒的数据"""
+        start = self.trace.get_time_range()[0] + offset
+        return self.time_range(start, start + duration)
+
+    def around_time(self, timestamp: float, window: float = 0.1) -> 'QueryBuilder':
+        """查询某个时间点前后 window 秒内的事件"""
+        return self.time_range(timestamp - window, timestamp + window)
+
+    # ==================== 空间维度（CPU/进程） ====================
+
+    def cpu(self, *cpus: int) -> 'QueryBuilder':
+        self._cpus = set(int(c) for c in cpus)
+        return self
+
+    def pid(self, *pids: int) -> 'QueryBuilder':
+        """限制进程 ID（事件所属进程、被切换进来的进程或被唤醒的进程）"""
+        self._pids = set(int(p) for p in pids)
+        return self
+
+    def comm(self, *names: str, pattern: str = None) -> 'QueryBuilder':
+        """限制进程名（精确匹配 names，或正则 pattern）"""
+        self._comms = set(names) if names else None
+        self._comm_pattern = re.compile(pattern) if pattern else None
+        return self
+
+    def process_type(self, *types: str) -> 'QueryBuilder':
+        """限制进程类型：'user', 'kernel_thread', 'idle', 'irq', 'softirq'"""
+        self._process_types = set(types)
+        return self
+
+    # ==================== 事件属性 ====================
+
+    def prev_state(self, *states: str) -> 'QueryBuilder':
+        self._states = set(states)
+        return self
+
+    def event_type(self, *types: str) -> 'QueryBuilder':
+        self._event_types = set(types)
+        return self
+
+    # ==================== 聚合和排序 ====================
+
+    def group_by(self, *fields: str) -> 'QueryBuilder':
+        """分组字段：'cpu', 'pid', 'comm', 'prev_state', 'event_type'"""
+        self._group_by = fields
+        return self
+
+    def order_by(self, field: str, ascending: bool = True) -> 'QueryBuilder':
+        self._order_by = (field, ascending)
+        return self
+
+    def limit(self, n: int) -> 'QueryBuilder':
+        self._limit = n
+        return self
+
+    # ==================== 执行计划 ====================
+
+    def _has_event_filters(self) -> bool:
+        return any(f is not None for f in (
+            self._start, self._cpus, self._pids, self._comms, self._comm_pattern,
+            self._process_types, self._states, self._event_types))
+
+    def _comm_matches(self, comm: str) -> bool:
+        if self._comms is None and self._comm_pattern is None:
+            return True
+        return (self._comms is not None and comm in self._comms) or \
+            (self._comm_pattern is not None and self._comm_pattern.search(comm) is not None)
+
+    def _candidate_pids(self) -> Optional[set]:
+        """Resolves pid/comm/process_type filters to a PID set via the index."""
+        pids = set(self._pids) if self._pids is not None else None
+        if self._comms is not None or self._comm_pattern is not None or self._process_types:
+            matched = {proc['pid'] for proc in self.trace.get_processes()
+                       if self._comm_matches(proc['comm']) and
+                       (not self._process_types or proc['type'] in self._process_types)}
+            pids = matched if pids is None else pids & matched
+        return pids
+
+    def plan(self, narrow: Optional[Tuple[str, int]] = None) -> List[Tuple[int, int]]:
+        """Returns the byte ranges that have to be read, derived from the index.
+
+        ``narrow=('cpu' | 'pid', key)`` further restricts them to the blocks
+        in that key's postings list.
+        """
+        trace = self.trace
+        blocks = trace.blocks
+        candidates = None
+
+        if self._start is not None:
+            start, end = self._start, self._end
+            candidates = {i for i, (_, ts_min, ts_max, _) in enumerate(blocks)
+                          if ts_min is not None and ts_max >= start and ts_min <= end}
+
+        if self._cpus is not None and 'cpu' in trace.index_by:
+            ids = set()
+            for cpu in self._cpus:
+                ids.update(trace.postings('cpu', cpu))
+            candidates = ids if candidates is None else candidates & ids
+
+        pids = self._candidate_pids()
+        if pids is not None and 'pid' in trace.index_by:
+            ids = set()
+            for pid in pids:
+                ids.update(trace.postings('pid', pid))
+            candidates = ids if candidates is None else candidates & ids
+
+        if narrow is not None and narrow[0] in trace.index_by:
+            ids = set(trace.postings(*narrow))
+            candidates = ids if candidates is None else candidates & ids
+
+        if candidates is None:
+            candidates = range(len(blocks))
+
+        ranges = []
+        for block_id in sorted(candidates):
+            start, end = trace.block_range(block_id)
+            if ranges and ranges[-1][1] == start:
+                ranges[-1] = (ranges[-1][0], end)
+            else:
+                ranges.append((start, end))
+        return ranges
+
+    def _predicate(self) -> Callable[[Event], bool]:
+        start, end = self._start, self._end
+        cpus, pids, states, event_types = self._cpus, self._pids, self._states, self._event_types
+        process_types = self._process_types
+        filter_comm = self._comms is not None or self._comm_pattern is not None
+        comm_matches = self._comm_matches
+
+        def match(e: Event) -> bool:
+            if start is not None and not (start <= e.timestamp <= end):
+                return False
+            if cpus is not None and e.cpu not in cpus:
+                return False
+            if event_types is not None and e.event_type not in event_types:
+                return False
+            if pids is not None and e.pid not in pids and not (e.related_pids & pids):
+                return False
+            if filter_comm and not comm_matches(e.comm):
+                return False
+            if process_types is not None and classify_process(e.pid, e.comm) not in process_types:
+                return False
+            if states is not None:
+                state = e.prev_state
+                if state is None or (state not in states and state[:1] not in states):
+                    return False
+            return True
+
+        return match
+
+    def iter_events(self, narrow: Optional[Tuple[str, int]] = None) -> Iterator[Event]:
+        """Streams matching events in file order (ignores order_by/limit).
+
+        ``narrow=('cpu' | 'pid', key)`` keeps only the events whose cpu/pid is
+        ``key``; only the blocks in its postings are read and, unless an
+        event-type needle is in use, lines are prefiltered on the raw bytes.
+        """
+        ranges = self.plan(narrow)
+        if not ranges:
+            return
+        needle = None
+        if self._event_types is not None and len(self._event_types) == 1:
+            needle = f"{next(iter(self._event_types))}:".encode()
+        elif narrow is not None:
+            needle = _key_needles(*narrow)
+        match = self._predicate() if self._has_event_filters() else None
+        if narrow is not None:
+            field, key = narrow
+            base = match
+            match = lambda e: getattr(e, field) == key and (base is None or base(e))
+
+        with TraceReader(self.trace.filepath) as reader:
+            for start, end in ranges:
+                for line in reader.iter_lines(needle, start, end):
+                    event = parse_event(line)
+                    if event is None:
+                        continue
+                    if match is None or match(event):
+                        yield event
+
+    def _iter_limited(self) -> Iterator[Event]:
+        events = self.iter_events()
+        if self._order_by is not None:
+            field, ascending = self._order_by
+            key = lambda e: getattr(e, field)
+            if self._limit is not None:
+                pick = heapq.nsmallest if ascending else heapq.nlargest
+                events = iter(pick(self._limit, events, key=key))
+            else:
+                events = iter(sorted(events, key=key, reverse=not ascending))
+        remaining = self._limit
+        for event in events:
+            if remaining is not None:
+                if remaining <= 0:
+                    return
+                remaining -= 1
+            yield event
+
+    # ==================== 执行查询 ====================
+
+    def execute(self) -> 'QueryResult':
+        """执行查询，返回流式结果对象（遍历时才读取文件）"""
+        snapshot = copy.copy(self)
+        # CPU/PID groups of an unlimited, unordered result are re-queried through
+        # the index; a limit or order depends on the whole result, so those are partitioned
+        narrow = snapshot.iter_events if self._limit is None and self._order_by is None else None
+        return QueryResult(snapshot._iter_limited, group_by=self._group_by, narrow=narrow)
+
+    def count(self) -> int:
+        """只返回匹配的事件数量（无过滤条件时直接由索引回答）"""
+        if not self._has_event_filters():
+            total = self.trace.get_event_count()
+            return total if self._limit is None else min(total, self._limit)
+        n = 0
+        for _ in self._iter_limited():
+            n += 1
+        return n
+
+    def first(self, n: int = 1) -> List[Event]:
+        """返回前 N 个事件"""
+        saved = self._limit
+        self._limit = n if saved is None else min(n, saved)
+        try:
+            return list(self._iter_limited())
+        finally:
+            self._limit = saved
+
+    def to_dataframe(self):
+        """转换为 pandas DataFrame；未安装 pandas 时返回字典列表"""
+        records = [e.to_dict() for e in self._iter_limited()]
+        if pd is None:
+            return records
+        return pd.DataFrame.from_records(records, columns=EVENT_FIELDS)
+
+
+class QueryResult:
+    """
+    查询结果（流式）
+
+    结果不持有事件列表，而是持有一个可重复调用的事件生成器：
+    - summary()/len() 等统计在一次遍历中增量计算并缓存；
+    - by_cpu()/by_process() 的每组经索引 postings 只读取包含该 CPU/进程的块，
+      无法借助索引时（以及 by_state()）一次遍历把事件分到各组；filter() 返回惰性的子结果；
+    - timeline()/to_csv()/to_json()/to_text() 逐个事件处理，可直接写入文件；
+    - 只有显式调用 materialize()（或访问 events）时才会把全部事件载入内存。
+    """
+
+    def __init__(self, source, group_by: Tuple[str, ...] = (),
+                 narrow: Optional[Callable[[Tuple[str, int]], Iterator[Event]]] = None):
+        """
+        Args:
+            source: 返回事件迭代器的可调用对象（每次调用重新扫描），或事件列表
+            group_by: summary() 中额外统计的分组字段
+            narrow: narrow(('cpu' | 'pid', key)) 返回该组事件的迭代器（借助索引，只读相关块）
+        """
+        if isinstance(source, list):
+            self._events = source
+            self._source = lambda: iter(source)
+        else:
+            self._events = None
+            self._source = source
+        self._group_by = tuple(group_by)
+        self._narrow = narrow
+        self._stats = None
+
+    # ==================== 基础访问 ====================
+
+    def __iter__(self) -> Iterator[Event]:
+        if self._events is not None:
+            return iter(self._events)
+        return self._source()
+
+    def __len__(self) -> int:
+        return self._aggregate()['count']
+
+    def __getitem__(self, index):
+        if self._events is not None:
+            return self._events[index]
+        if isinstance(index, slice):
+            if (index.start or 0) < 0 or (index.stop is not None and index.stop < 0):
+                return self.materialize()[index]
+            return list(islice(iter(self), index.start, index.stop, index.step))
+        if index < 0:
+            tail = deque(iter(self), maxlen=-index)
+            if len(tail) < -index:
+                raise IndexError('QueryResult index out of range')
+            return tail[0]
+        for event in islice(iter(self), index, None):
+            return event
+        raise IndexError('QueryResult index out of range')
+
+    def materialize(self) -> List[Event]:
+        """显式把全部事件载入内存（之后的访问不再重新扫描）"""
+        if self._events is None:
+            self._events = list(self._source())
+        return self._events
+
+    @property
+    def events(self) -> List[Event]:
+        """返回所有事件（会触发完整物化）"""
+        return self.materialize()
+
+    # ==================== 统计信息 ====================
+
+    def _aggregate(self) -> Dict:
+        """Single pass over the events computing every summary statistic."""
+        if self._stats is not None:
+            return self._stats
+        count = 0
+        ts_min = ts_max = None
+        cpus = Counter()
+        pids = Counter()
+        states = Counter()
+        event_types = Counter()
+        groups = Counter()
+        group_by = self._group_by
+        for e in self:
+            count += 1
+            ts = e.timestamp
+            if ts_min is None or ts < ts_min:
+                ts_min = ts
+            if ts_max is None or ts > ts_max:
+                ts_max = ts
+            cpus[e.cpu] += 1
+            pids[e.pid] += 1
+            event_types[e.event_type] += 1
+            state = e.prev_state
+            if state is not None:
+                states[state] += 1
+            if group_by:
+                groups[tuple(getattr(e, f) for f in group_by)] += 1
+        self._stats = {
+            'count': count,
+            'time_range': (ts_min, ts_max) if count else None,
+            'cpus': cpus,
+            'pids': pids,
+            'states': states,
+            'event_types': event_types,
+            'groups': groups,
+        }
+        return self._stats
+
+    def summary(self) -> Dict:
+        stats = self._aggregate()
+        summary = {
+            'count': stats['count'],
+            'time_range': stats['time_range'],
+            'cpus': sorted(stats['cpus']),
+            'processes': sorted(stats['pids']),
+            'event_types': dict(stats['event_types'].most_common()),
+            'state_distribution': dict(stats['states'].most_common()),
+        }
+        if self._group_by:
+            summary['groups'] = {'|'.join(str(k) for k in key): n
+                                 for key, n in stats['groups'].most_common()}
+        return summary
+
+    def describe(self) -> str:
+        s = self.summary()
+        lines = ["查询结果摘要", "==========="]
+        lines.append(f"事件数: {s['count']:,}")
+        if s['time_range']:
+            start, end = s['time_range']
+            lines.append(f"时间范围: {start:.6f} - {end:.6f} ({end - start:.6f} 秒)")
+        lines.append(f"涉及 CPU: {', '.join(str(c) for c in s['cpus']) or '无'}")
+        lines.append(f"涉及进程: {len(s['processes'])} 个")
+        states = ', '.join(f"{k}({v})" for k, v in s['state_distribution'].items())
+        lines.append(f"状态分布: {states or '无'}")
+        return '\n'.join(lines)
+
+    # ==================== 分组视图 ====================
+
+    def _view(self, func: Callable[[Event], bool]) -> 'QueryResult':
+        source = self.__iter__
+        return QueryResult(lambda: (e for e in source() if func(e)), group_by=self._group_by)
+
+    def _partition(self, field: str) -> Dict:
+        """一次遍历把事件按 field 分到各组（各组持有自己的事件列表）"""
+        parts = defaultdict(list)
+        for e in self:
+            key = getattr(e, field)
+            if key is not None:
+                parts[key].append(e)
+        return {key: QueryResult(events, group_by=self._group_by) for key, events in parts.items()}
+
+    def _groups(self, field: str) -> Dict:
+        """按 'cpu'/'pid' 分组：可借助索引时每组是只读取相关块的流式子结果，否则一次遍历分组"""
+        if self._narrow is None or self._events is not None:
+            groups = self._partition(field)
+            return {key: groups[key] for key in sorted(groups)}
+        narrow = self._narrow
+        keys = self._aggregate()['cpus' if field == 'cpu' else 'pids']
+        return {key: QueryResult(lambda key=key: narrow((field, key)), group_by=self._group_by)
+                for key in sorted(keys)}
+
+    def by_cpu(self) -> Dict[int, 'QueryResult']:
+        """按 CPU 分组（组键来自一次聚合遍历，每组只读取索引中包含该 CPU 的块）"""
+        return self._groups('cpu')
+
+    def by_process(self) -> Dict[int, 'QueryResult']:
+        """按进程 ID 分组（每组只读取索引中包含该进程的块）"""
+        return self._groups('pid')
+
+    def by_state(self) -> Dict[str, 'QueryResult']:
+        """按 prev_state 分组（状态没有索引，一次遍历分组，只保留 sched_switch 事件）"""
+        return self._partition('prev_state')
+
+    def counts_by(self, field: str) -> Dict:
+        """单次遍历统计某个字段的取值分布"""
+        return dict(Counter(getattr(e, field) for e in self).most_common())
+
+    # ==================== 时间序列视图 ====================
+
+    def timeline(self, bin_size: float = 0.001, with_events: bool = False) -> Dict:
+        """
+        生成时间线视图（单次遍历，桶按 bin_size 的整数倍对齐）
+
+        Args:
+            bin_size: 时间桶大小（秒）
+            with_events: 是否同时返回每个桶内的事件（会物化这些事件）
+        """
+        counts = Counter()
+        per_bin = defaultdict(list) if with_events else None
+        for e in self:
+            key = int(e.timestamp // bin_size)
+            counts[key] += 1
+            if per_bin is not None:
+                per_bin[key].append(e)
+        if not counts:
+            return {'bins': [], 'counts': [], 'events_per_bin': [] if with_events else None}
+        keys = range(min(counts), max(counts) + 1)
+        return {
+            'bins': [k * bin_size for k in keys],
+            'counts': [counts.get(k, 0) for k in keys],
+            'events_per_bin': [per_bin.get(k, []) for k in keys] if with_events else None,
+        }
+
+    # ==================== 导出 ====================
+
+    def _export(self, write: Callable[[TextIO], None], filepath: Optional[str], fp: Optional[TextIO]) -> str:
+        if fp is not None:
+            write(fp)
+            return ''
+        if filepath:
+            with open(filepath, 'w', newline='') as f:
+                write(f)
+            return filepath
+        buf = io.StringIO()
+        write(buf)
+        return buf.getvalue()
+
+    def to_text(self, format: str = 'table', filepath: str = None, fp: TextIO = None) -> str:
+        """导出为文本（'table', 'list', 'raw'）；给定 filepath/fp 时逐行写出"""
+        def write(out):
+            if format == 'table':
+                out.write(f"{'timestamp':<18} {'cpu':<4} {'pid':<8} {'comm':<20} {'event':<18} details\n")
+            for e in self:
+                if format == 'raw':
+                    out.write(f"{e!r}\n")
+                elif format == 'list':
+                    out.write(f"{e.timestamp:.6f} [{e.cpu:03d}] {e.comm}-{e.pid} "
+                              f"{e.event_type}: {e.details}\n")
+                else:
+                    out.write(f"{e.timestamp:<18.6f} {e.cpu:<4} {e.pid:<8} {e.comm:<20} "
+                              f"{e.event_type:<18} {e.details}\n")
+        return self._export(write, filepath, fp)
+
+    def to_json(self, filepath: str = None, fp: TextIO = None) -> str:
+        """导出为 JSON 数组；给定 filepath/fp 时逐个事件写出"""
+        def write(out):
+            out.write('[')
+            for i, e in enumerate(self):
+                if i:
+                    out.write(', ')
+                out.write(json.dumps(e.to_dict(), ensure_ascii=False))
+            out.write(']')
+        return self._export(write, filepath, fp)
+
+    def to_csv(self, filepath: str = None, fp: TextIO = None) -> str:
+        """导出为 CSV；给定 filepath/fp 时逐行写出并返回路径"""
+        def write(out):
+            writer = csv.writer(out)
+            writer.writerow(EVENT_FIELDS)
+            for e in self:
+                writer.writerow([e.timestamp, e.cpu, e.pid, e.comm, e.event_type, e.details])
+        return self._export(write, filepath, fp)
+
+    # ==================== 进一步查询 ====================
+
+    def filter(self, func: Callable[[Event], bool]) -> 'QueryResult':
+        """基于自定义函数过滤（惰性）"""
+        return self._view(func)
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Memory-mapped reader for ftrace text logs.
+
+The trace is mapped once and scanned in line-aligned chunks of raw bytes.
+Lines are pre-filtered with ``bytes.find``/``in`` on the undecoded buffer and
+only the lines that survive are decoded to ``str``:
+
+- sparse needles (few matches per chunk) are located with ``bytes.find`` and
+  just the matching lines are decoded;
+- dense chunks are decoded in one call and split, which is cheaper than
+  slicing every line out of the buffer individually.
+
+Compressed traces (``.gz``/``.zst``, see ``trace_codec``) cannot be mapped:
+they are streamed through a background decompression thread instead and
+only support reading the whole file (no byte ranges).
+
+Shared by ``analyze_ftrace.py``, ``transform/ftrace_to_rca.py`` and the
+ftrace-analyzer scripts.
+"""
+import mmap
+import os
+import re
+from typing import Iterator, List, Optional, Sequence, Tuple, Union
+
+try:
+    from .trace_codec import compression, iter_decompressed
+except ImportError:
+    from trace_codec import compression, iter_decompressed
+
+# Size of the line-aligned chunks the mapped file is scanned in.
+CHUNK_SIZE = 256 * 1024
+
+# A chunk with fewer than one needle match per this many bytes is treated as
+# sparse and only the matching lines are sliced out and decoded.
+SPARSE_BYTES_PER_MATCH = 2048
+
+BUFFER_STARTED = b'buffer started'
+
+
+class ReaderStats:
+    """Counters describing how much of the mapped file had to be decoded."""
+    __slots__ = ('bytes_scanned', 'bytes_decoded', 'lines_decoded')
+
+    def __init__(self):
+        self.bytes_scanned = 0
+        self.bytes_decoded = 0
+        self.lines_decoded = 0
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class TraceReader:
+    """Read-only mmap view of an ftrace text log.
+
+    For a compressed log ``compression`` names the codec, ``size`` is None
+    and lines are streamed from the decompressor.
+    """
+
+    def __init__(self, path: str, encoding: str = 'utf-8', errors: str = 'replace'):
+        self.path = path
+        self.encoding = encoding
+        self.errors = errors
+        self.stats = ReaderStats()
+        self.compression = compression(path)
+        if self.compression:
+            self._file = None
+            self._buf = b''
+            self.size = None
+            return
+        self._file = open(path, 'rb')
+        self.size = os.fstat(self._file.fileno()).st_size
+        if self.size:
+            self._buf = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            # mmap refuses zero-length mappings
+            self._buf = b''
+
+    def close(self):
+        if isinstance(self._buf, mmap.mmap):
+            self._buf.close()
+        self._buf = b''
+        if self._file is not None:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # ==================== Ranges ====================
+
+    def line_boundary(self, pos: int) -> int:
+        """Returns the start of the first line beginning at or after ``pos``."""
+        if pos <= 0:
+            return 0
+        if pos >= self.size:
+            return self.size
+        nl = self._buf.find(b'\n', pos - 1)
+        return self.size if nl < 0 else nl + 1
+
+    def complete_end(self, start: int, end: Optional[int] = None) -> int:
+        """Returns the end of the last complete (newline-terminated) line in [start, end).
+
+        Equals ``start`` when no line in the range is complete yet, e.g. while
+        a writer is still appending to the file.
+        """
+        end = self.size if end is None else min(end, self.size)
+        if start >= end:
+            return start
+        nl = self._buf.rfind(b'\n', start, end)
+        return start if nl < 0 else nl + 1
+
+    def split_ranges(self, parts: int) -> List[Tuple[int, int]]:
+        """Splits the file into at most ``parts`` newline-aligned [start, end) ranges.
+
+        A compressed file is a single ``(0, None)`` range.
+        """
+        if parts <= 1 or not self.size:
+            return [(0, self.size)]
+        boundaries = [0]
+        for i in range(1, parts):
+            boundary = self.line_boundary(self.size * i // parts)
+            if boundaries[-1] < boundary < self.size:
+                boundaries.append(boundary)
+        boundaries.append(self.size)
+        return list(zip(boundaries[:-1], boundaries[1:]))
+
+    def iter_chunks(self, start: int = 0, end: Optional[int] = None,
+                    chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+        """Yields line-aligned raw chunks covering [start, end)."""
+        if self.compression:
+            if start or end is not None:
+                raise ValueError(f"byte ranges need an uncompressed trace: {self.path}")
+            yield from self._iter_stream_chunks(chunk_size)
+            return
+        buf = self._buf
+        end = self.size if end is None else min(end, self.size)
+        pos = start
+        while pos < end:
+            chunk_end = pos + chunk_size
+            if chunk_end < end:
+                nl = buf.rfind(b'\n', pos, chunk_end)
+                if nl < 0:
+                    nl = buf.find(b'\n', chunk_end, end)
+                chunk_end = end if nl < 0 else nl + 1
+            else:
+                chunk_end = end
+            self.stats.bytes_scanned += chunk_end - pos
+            yield buf[pos:chunk_end]
+            pos = chunk_end
+
+    def _iter_stream_chunks(self, chunk_size: int) -> Iterator[bytes]:
+        """Line-aligned chunks of the decompressed stream of a compressed file."""
+        pending = b''
+        for block in iter_decompressed(self.path, chunk_size):
+            if pending:
+                block = pending + block
+            nl = block.rfind(b'\n')
+            if nl < 0:
+                pending = block
+                continue
+            pending = block[nl + 1:]
+            self.stats.bytes_scanned += nl + 1
+            yield block[:nl + 1]
+        if pending:
+            self.stats.bytes_scanned += len(pending)
+            yield pending
+
+    # ==================== Lines ====================
+
+    def _decode_lines(self, chunk: bytes) -> List[str]:
+        text = chunk.decode(self.encoding, self.errors)
+        if '\r' in text:
+            text = text.replace('\r\n', '\n')
+        lines = text.split('\n')
+        if lines[-1] == '':
+            lines.pop()
+        self.stats.bytes_decoded += len(chunk)
+        self.stats.lines_decoded += len(lines)
+        return lines
+
+    def iter_lines(self, needle: Union[None, bytes, Sequence[bytes]] = None, start: int = 0,
+                   end: Optional[int] = None) -> Iterator[str]:
+        """Yields lines (without line terminator) in [start, end) containing ``needle``.
+
+        ``needle`` is matched on the raw bytes; lines that do not contain it
+        are never decoded. A sequence of needles yields the lines containing
+        any of them. With ``needle=None`` every line is yielded.
+        """
+        if needle is None:
+            for chunk in self.iter_chunks(start, end):
+                yield from self._decode_lines(chunk)
+            return
+
+        needles = (needle,) if isinstance(needle, bytes) else tuple(needle)
+        text_needles = tuple(n.decode(self.encoding) for n in needles)
+        # several needles are located with one alternation instead of a find each
+        search = re.compile(b'|'.join(map(re.escape, needles))).search if len(needles) > 1 else None
+        encoding, errors, stats = self.encoding, self.errors, self.stats
+        for chunk in self.iter_chunks(start, end):
+            matches = sum(chunk.count(n) for n in needles)
+            if not matches:
+                continue
+            if matches * SPARSE_BYTES_PER_MATCH < len(chunk):
+                find, rfind = chunk.find, chunk.rfind
+                pos = 0
+                while True:
+                    if search is None:
+                        hit = find(needles[0], pos)
+                    else:
+                        m = search(chunk, pos)
+                        hit = m.start() if m else -1
+                    if hit < 0:
+                        break
+                    line_start = rfind(b'\n', pos, hit) + 1 or pos
+                    line_end = find(b'\n', hit)
+                    if line_end < 0:
+                        line_end = len(chunk)
+                    raw = chunk[line_start:line_end]
+                    if raw.endswith(b'\r'):
+                        raw = raw[:-1]
+                    stats.bytes_decoded += len(raw)
+                    stats.lines_decoded += 1
+                    yield raw.decode(encoding, errors)
+                    pos = line_end + 1
+            elif search is None:
+                text_needle = text_needles[0]
+                for line in self._decode_lines(chunk):
+                    if text_needle in line:
+                        yield line
+            else:
+                for line in self._decode_lines(chunk):
+                    if any(n in line for n in text_needles):
+                        yield line
+
+    def iter_data_lines(self, start: int = 0, end: Optional[int] = None) -> Iterator[str]:
+        """Yields event lines, skipping blank lines, ``#`` headers and
+        "CPU N buffer started" markers."""
+        for chunk in self.iter_chunks(start, end):
+            # headers and markers are dropped on the raw bytes, before decoding
+            if BUFFER_STARTED in chunk or chunk[:1] == b'#' or b'\n#' in chunk:
+                chunk = b'\n'.join(raw for raw in chunk.split(b'\n')
+                                   if raw[:1] != b'#' and BUFFER_STARTED not in raw)
+            for line in self._decode_lines(chunk):
+                if line:
+                    yield line
+
+
+def split_file_ranges(file_path: str, parts: int) -> List[Tuple[int, int]]:
+    """Splits ``file_path`` into at most ``parts`` newline-aligned byte ranges."""
+    with TraceReader(file_path) as reader:
+        return reader.split_ranges(parts)
@@ -4,8 +4,10 @@ import sys
 import argparse
 import time
 import json
+import csv
 from concurrent.futures import ProcessPoolExecutor, as_completed
-from typing import List, Dict, Any
+from multiprocessing.util import Finalize
+from typing import List, Dict, Any, Optional, Tuple
 
 # Try to import perfetto, if not available, print error
 try:
@@ -14,10 +16,23 @@ except ImportError:
     print("Error: 'perfetto' python module is not installed. Please install it using 'pip install perfetto'.")
     sys.exit(1)
 
+from ftrace_cache import cache_enabled
+from ftrace_proto import preferred_trace
+from result_columns import ResultColumns
+from scenario_cache import ScenarioResultCache
+from scenario_planner import ScenarioPlan, materialize, plan_scenarios, window_scenarios
+from scenario_scheduler import ScenarioTimings
+from trace_codec import compression, load_decompressed
+from tp_server import TraceProcessorServer, format_ingest
+from tp_session import TraceProcessorSession, required_modules
+from trace_shards import ShardSpec, add_shard_arguments, is_text_trace, load_shard
+
 # Default paths
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DEFAULT_TP_BIN = os.path.join(BASE_DIR, 'trace_processor')
 DEFAULT_SQL_FILE = os.path.join(BASE_DIR, 'perfetto_analysis.sql')
+# Rows of each scenario result returned by the workers and shown in the report
+DEFAULT_SAMPLE_ROWS = 20
 
 def parse_sql_file(file_path: str) -> List[Dict[str, str]]:
     """Parses the SQL file into a list of scenarios."""
@@ -52,81 +67,204 @@ def parse_sql_file(file_path: str) -> List[Dict[str, str]]:
             
     return queries
 
-def execute_queries_worker(trace_path: str, tp_bin: str, queries: List[Dict[str, str]]) -> List[Dict[str, Any]]:
-    """Worker function to execute a batch of queries on a single TraceProcessor instance."""
-    results = []
-    
-    # Set environment variable for the binary path
-    os.environ["PERFETTO_BINARY_PATH"] = tp_bin
+def run_query(session: TraceProcessorSession, query: Dict[str, str]) -> Dict[str, Any]:
+    """Runs one scenario in a TraceProcessorSession and returns its result entry.
+
+    Only the first query['sample_rows'] rows (default DEFAULT_SAMPLE_ROWS) come
+    back, with the full row count; query['evidence'] names a CSV file that
+    receives every row of the result.
+    """
+    desc = query['desc']
+    sql = query['sql']
+    limit = query.get('sample_rows', DEFAULT_SAMPLE_ROWS)
+    evidence = query.get('evidence')
+    result_data = None
+    error_msg = None
+    started = time.perf_counter()
+    if evidence and os.path.exists(evidence):
+        os.remove(evidence) # left by an earlier run
     
     try:
-        tp = TraceProcessor(file_path=trace_path)
+        # Scenarios hold several statements (e.g., INCLUDE MODULE + SELECT); the
+        # session splits them and skips modules that are already included
+        for res_iter in session.results(sql):
+            # Collected column by column (no dict per row); numeric and string
+            # columns pickle back to the parent process as compact buffers.
+            # Rows past the sample are counted, and streamed to the evidence file
+            if evidence:
+                partial = evidence + '.part'
+                with open(partial, 'w', newline='') as out:
+                    current = ResultColumns.from_result(res_iter, limit, csv.writer(out))
+                if current:
+                    os.replace(partial, evidence)
+                else:
+                    os.remove(partial)
+            else:
+                current = ResultColumns.from_result(res_iter, limit)
+            if current:
+                result_data = current # Keep the last SELECT result
+        if result_data is None:
+            result_data = ResultColumns([], [])
+        
     except Exception as e:
-        return [{'desc': q['desc'], 'error': f"Failed to load trace: {str(e)}"} for q in queries]
-
-    for q in queries:
-        desc = q['desc']
-        sql = q['sql']
         result_data = None
-        error_msg = None
+        error_msg = str(e)
+        if evidence and os.path.exists(evidence + '.part'):
+            os.remove(evidence + '.part')
         
-        try:
-            # Handle multiple statements (e.g., INCLUDE MODULE)
-            stmts = [s.strip() for s in sql.split(';') if s.strip()]
-            query_rows = []
-            
-            for stmt in stmts:
-                if stmt.upper().startswith('INCLUDE'):
-                    tp.query(stmt)
-                else:
-                    # Execute query and fetch results
-                    res_iter = tp.query(stmt)
-                    # Convert iterator to list of dicts (if possible) or tuples
-                    # The python api returns an iterator of specialized row objects
-                    # We convert them to simple dicts or lists for serialization
-                    
-                    # Try to get column names if possible, but the API might just give values
-                    # We will store as list of lists for simplicity if dict not available
-                    current_rows = []
-                    for row in res_iter:
-                        # row is usually a confusing object, let's try to convert to dict
-                        try:
-                            row_dict = row.__dict__
-                            # Filter out internal fields if any
-                            clean_row = {k: v for k, v in row_dict.items() if not k.startswith('_')}
-                            current_rows.append(clean_row)
-                        except:
-                            current_rows.append(str(row))
-                            
-                    if current_rows:
-                        query_rows = current_rows # Keep the last SELECT result
+    result = {
+        'desc': desc,
+        'data': result_data,
+        'error': error_msg,
+        'elapsed': time.perf_counter() - started,
+    }
+    if result_data and evidence and os.path.exists(evidence):
+        result['evidence'] = evidence
+    return result
 
-            result_data = query_rows
-            
+def open_trace_processor(trace_path: str, tp_bin: str, tp_addr: Optional[str] = None):
+    """Attaches to the shared server at tp_addr, or loads the trace into a new instance."""
+    # Set environment variable for the binary path
+    os.environ["PERFETTO_BINARY_PATH"] = tp_bin
+    if tp_addr:
+        return TraceProcessor(addr=tp_addr)
+    return TraceProcessor(file_path=trace_path)
+
+# Per-process state of the scenario pool: each worker opens one TraceProcessor
+# session on its first scenario and reuses it for every scenario it pulls from the queue.
+_worker_config = None
+_worker_modules = ()
+_worker_loaded = ()
+_worker_prelude = ()
+_worker_session = None
+_worker_error = None
+
+def init_scenario_worker(trace_path: str, tp_bin: str, tp_addr: Optional[str] = None,
+                         modules=(), loaded=(), prelude=()):
+    """ProcessPoolExecutor initializer for execute_scenario_task.
+
+    modules are pre-warmed and the prelude statements (time window tables) run
+    when the session opens, before any scenario is timed; loaded are modules
+    the shared server already has.
+    """
+    global _worker_config, _worker_modules, _worker_loaded, _worker_prelude
+    _worker_config = (trace_path, tp_bin, tp_addr)
+    _worker_modules = modules
+    _worker_loaded = loaded
+    _worker_prelude = prelude
+
+def execute_scenario_task(query: Dict[str, str]) -> Dict[str, Any]:
+    """Runs a single scenario in this worker's TraceProcessor session."""
+    global _worker_session, _worker_error
+    if _worker_session is None and _worker_error is None:
+        try:
+            _worker_session = TraceProcessorSession(open_trace_processor(*_worker_config),
+                                                    loaded=_worker_loaded)
+            # pool workers leave through os._exit(), which skips atexit handlers
+            Finalize(None, _worker_session.close, exitpriority=10)
+            _worker_session.prewarm(_worker_modules)
+            for stmt in _worker_prelude:
+                try:
+                    _worker_session.query(stmt)
+                except Exception:
+                    # already created by another worker on the shared server;
+                    # otherwise the scenarios reading it report the error
+                    pass
         except Exception as e:
-            error_msg = str(e)
-            
-        results.append({
-            'desc': desc,
-            'data': result_data,
-            'error': error_msg
-        })
+            _worker_error = f"Failed to load trace: {str(e)}"
+    if _worker_error is not None:
+        return {'desc': query['desc'], 'error': _worker_error}
+    result = run_query(_worker_session, query)
+    if result['error'] and query.get('original_sql'):
+        # the rewrite onto shared tables failed: run the scenario as written
+        result = run_query(_worker_session, dict(query, sql=query['original_sql']))
+    result['estimate'] = query.get('estimate')
+    return result
+
+def _scenario_label(desc: str) -> str:
+    return desc.split(':')[0].lstrip('- ')
+
+def _label_users(stats: List[Dict[str, Any]], queries: List[Dict[str, str]]):
+    for step in stats:
+        step['users'] = [_scenario_label(queries[i]['desc']) for i in step['users']]
+    return stats
 
-    tp.close()
-    return results
+def materialize_shared(queries: List[Dict[str, str]], session: TraceProcessorSession):
+    """Materializes the relations shared by several scenarios in the server.
 
-def generate_report(results: List[Dict[str, Any]], output_stream, trace_file: str):
+    Returns the queries rewritten to read the shared tables (only those whose
+    tables were created) and the per-step stats for the report.
+    """
+    plan = plan_scenarios(queries)
+    if not plan.steps:
+        return queries, []
+    stats = _label_users(materialize(session, plan), queries)
+    available = {step['name'] for step in stats if not step['error']}
+    return plan.apply(queries, available), stats
+
+def evidence_wanted(desc: str, selected: List[str]) -> bool:
+    """Whether --evidence selects the scenario: 'all', its number or its label."""
+    label = _scenario_label(desc)
+    number = label.split()[-1] if label.startswith('Scenario') else label
+    return any(s == 'all' or s == number or s == label for s in selected)
+
+def evidence_name(desc: str) -> str:
+    """CSV file name of a scenario's full result ('Scenario 3' -> scenario_3.csv)."""
+    label = _scenario_label(desc).lower()
+    return ''.join(c if c.isalnum() else '_' for c in label) + '.csv'
+
+def generate_report(results: List[Dict[str, Any]], output_stream, trace_file: str,
+                    ingest: Optional[Dict[str, Any]] = None,
+                    wall_seconds: Optional[float] = None,
+                    shared: Optional[List[Dict[str, Any]]] = None,
+                    trim: Optional[Dict[str, Any]] = None):
     """Generates a Markdown report from the results."""
     f = output_stream
     f.write(f"# Ftrace Global Analysis Report\n\n")
     f.write(f"**Trace File:** `{trace_file}`\n")
-    f.write(f"**Date:** {time.strftime('%Y-%m-%d %H:%M:%S')}\n\n")
+    f.write(f"**Date:** {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
+    if trim and trim.get('start') is not None:
+        f.write(f"**Time Window:** {trim['start']:.6f} - {trim['end']:.6f} s\n")
+    if trim and trim.get('shard'):
+        f.write(f"**Shard:** {trim['shard']}")
+        if trim.get('ingest_bytes') is not None:
+            f.write(f" (ingested {trim['ingest_bytes'] / 1e6:.1f} MB of {trim['trace_bytes'] / 1e6:.1f} MB)")
+        f.write("\n")
+    if ingest:
+        f.write(f"**Trace Ingest:** {format_ingest(ingest)}\n")
+    f.write("\n")
     
     f.write("## Analysis Summary\n")
     success_count = sum(1 for r in results if not r.get('error'))
     f.write(f"- Total Scenarios: {len(results)}\n")
     f.write(f"- Successful: {success_count}\n")
-    f.write(f"- Failed: {len(results) - success_count}\n\n")
+    f.write(f"- Failed: {len(results) - success_count}\n")
+    if wall_seconds is not None:
+        f.write(f"- Wall Clock: {wall_seconds:.2f}s\n")
+    if any(r.get('cache') for r in results):
+        hits = sum(1 for r in results if r.get('cache') == 'hit')
+        f.write(f"- Result Cache: {hits} hits, {len(results) - hits} misses\n")
+    f.write("\n")
+    
+    timed = [r for r in results if r.get('elapsed') is not None]
+    if timed:
+        f.write("## Scenario Timings\n\n")
+        f.write("| Scenario | Time (s) | Estimated (s) |\n")
+        f.write("| --- | --- | --- |\n")
+        for res in sorted(timed, key=lambda r: -r['elapsed']):
+            estimate = res.get('estimate')
+            f.write(f"| {_scenario_label(res['desc'])} | {res['elapsed']:.2f} | "
+                    f"{'-' if estimate is None else f'{estimate:.2f}'} |\n")
+        f.write("\n")
+    
+    if shared:
+        f.write("## Shared Relations\n\n")
+        f.write("| Relation | Scenarios | Time (s) | Status |\n")
+        f.write("| --- | --- | --- | --- |\n")
+        for step in shared:
+            status = f"❌ {step['error']}" if step['error'] else "✅"
+            f.write(f"| `{step['name']}` | {', '.join(step['users'])} | {step['seconds']:.2f} | {status} |\n")
+        f.write("\n")
     
     f.write("## Detailed Results\n\n")
     
@@ -136,6 +274,11 @@ def generate_report(results: List[Dict[str, Any]], output_stream, trace_file: st
         error = res.get('error')
         
         f.write(f"### {desc}\n\n")
+        if res.get('cache') == 'hit':
+            cached_elapsed = res.get('cached_elapsed')
+            f.write("**Cache:** hit" + (f" (originally {cached_elapsed:.2f}s)" if cached_elapsed is not None else "") + "\n")
+        elif res.get('elapsed') is not None:
+            f.write(f"**Time:** {res['elapsed']:.2f}s" + (" (cache miss)" if res.get('cache') else "") + "\n")
         
         if error:
             f.write(f"**Status:** ❌ Error\n")
@@ -144,30 +287,118 @@ def generate_report(results: List[Dict[str, Any]], output_stream, trace_file: st
             f.write(f"**Status:** ⚠️ No Data Found\n")
             f.write("_The query executed successfully but returned no results._\n")
         else:
-            f.write(f"**Status:** ✅ Found {len(data)} rows\n")
+            f.write(f"**Status:** ✅ Found {data.total} rows\n")
+            if res.get('evidence'):
+                f.write(f"**Evidence:** `{res['evidence']}` (all {data.total} rows, CSV)\n")
             
-            # Render table for first few rows
-            if isinstance(data, list) and len(data) > 0:
-                # Check if it's a list of dicts
-                if isinstance(data[0], dict):
-                    headers = list(data[0].keys())
-                    f.write("| " + " | ".join(headers) + " |\n")
-                    f.write("| " + " | ".join(["---"] * len(headers)) + " |\n")
-                    
-                    for row in data[:20]: # Limit to top 20 rows
-                        vals = [str(row.get(h, '')) for h in headers]
-                        f.write("| " + " | ".join(vals) + " |\n")
-                    
-                    if len(data) > 20:
-                        f.write(f"\n_... {len(data) - 20} more rows hidden ..._\n")
-                else:
-                    f.write("```\n")
-                    for row in data[:20]:
-                        f.write(f"{row}\n")
-                    f.write("```\n")
+            # Render the sample the worker kept, read straight from the columns
+            headers = data.names
+            f.write("| " + " | ".join(headers) + " |\n")
+            f.write("| " + " | ".join(["---"] * len(headers)) + " |\n")
+            
+            for row in data.rows():
+                f.write("| " + " | ".join(str(v) for v in row) + " |\n")
+            
+            if data.total > len(data):
+                f.write(f"\n_... {data.total - len(data)} more rows hidden ..._\n")
         
         f.write("\n---\n")
 
+def run_scenarios(queries: List[Dict[str, str]], trace_path: str, tp_bin: str, jobs: int,
+                  use_server: bool, log_file, window: Optional[Tuple[int, int]] = None):
+    """Executes the scenarios on the trace, bounded to window ((start, end) in ns) if given.
+
+    Returns (results, ingest stats, wall clock seconds, shared relation stats);
+    each result carries the position of its scenario in queries under '_index'.
+    """
+    queries = [dict(q, index=i) for i, q in enumerate(queries)]
+    # Schedule scenarios longest-first, using runtimes measured on earlier traces
+    # (scaled to this trace's size). Workers pull them one at a time from the
+    # executor's shared queue, so no worker idles while others still have a backlog.
+    num_jobs = max(1, min(jobs, len(queries)))
+    trace_size = os.path.getsize(trace_path)
+    timings = ScenarioTimings.load()
+    
+    # Load the trace once into a shared trace_processor server; workers attach to it
+    # instead of each ingesting the whole trace again.
+    server = None
+    if use_server:
+        print("Loading trace into shared trace_processor server...", file=log_file)
+        try:
+            server = TraceProcessorServer(trace_path, tp_bin).start()
+            print(f"Trace loaded in {server.ingest_seconds:.2f}s ({server.addr})", file=log_file)
+        except Exception as e:
+            print(f"Shared server unavailable ({e}), falling back to per-worker ingest", file=sys.stderr)
+            server = None
+    tp_addr = server.addr if server else None
+    
+    # Bound every scenario to the time window: its relations are replaced by
+    # windowed copies created before the scenarios run.
+    window_steps = []
+    if window:
+        queries, window_steps = window_scenarios(queries, *window)
+    prelude = [stmt for step in window_steps for stmt in step.statements]
+    
+    # Materialize the scans and joins several scenarios share once in the server,
+    # and point those scenarios at the shared tables.
+    # Modules the scenarios include are loaded before any scenario is timed: once
+    # in the shared server, or in every worker's own trace processor.
+    shared = []
+    modules = required_modules(q['sql'] for q in queries)
+    loaded = ()
+    if server:
+        try:
+            session = TraceProcessorSession(open_trace_processor(trace_path, tp_bin, tp_addr))
+            try:
+                if window_steps:
+                    shared = _label_users(materialize(session, ScenarioPlan(window_steps, {})), queries)
+                    prelude = []
+                queries, relations = materialize_shared(queries, session)
+                shared += relations
+                session.prewarm(modules)
+            finally:
+                session.close()
+            loaded = tuple(session.modules)
+            if shared:
+                print(f"Materialized {sum(1 for s in shared if not s['error'])}/{len(shared)} "
+                      f"shared relations in {sum(s['seconds'] for s in shared):.2f}s", file=log_file)
+        except Exception as e:
+            print(f"Shared relations unavailable ({e}), running scenarios as written", file=sys.stderr)
+    ordered = timings.longest_first(queries, trace_size)
+    
+    print(f"Processing with {num_jobs} parallel workers (longest scenarios first)...", file=log_file)
+    
+    all_results = []
+    started = time.perf_counter()
+    
+    try:
+        with ProcessPoolExecutor(max_workers=num_jobs, initializer=init_scenario_worker,
+                                 initargs=(trace_path, tp_bin, tp_addr, modules, loaded,
+                                           prelude)) as executor:
+            futures = {executor.submit(execute_scenario_task, q): q for q in ordered}
+            
+            for future in as_completed(futures):
+                query = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"Worker failed: {e}", file=sys.stderr)
+                    result = {'desc': query['desc'], 'error': f"Worker failed: {e}"}
+                result['_index'] = query['index']
+                all_results.append(result)
+                if result.get('elapsed') is not None and not result.get('error'):
+                    timings.record(query, trace_size, result['elapsed'])
+    finally:
+        if server:
+            ingest = server.stats()
+            server.stop()
+        else:
+            ingest = {'mode': f'per-worker ingest, {num_jobs} workers',
+                      'ingest_seconds': None, 'peak_rss': None}
+    wall_seconds = time.perf_counter() - started
+    timings.save()
+    return all_results, ingest, wall_seconds, shared
+
 def main():
     parser = argparse.ArgumentParser(description="Global Ftrace Analysis Overview")
     parser.add_argument("trace_file", help="Path to the ftrace/perfetto trace file")
@@ -175,13 +406,42 @@ def main():
     parser.add_argument("--tp_bin", default=DEFAULT_TP_BIN, help="Path to trace_processor binary")
     parser.add_argument("--output_dir", default=".", help="Directory to save the report")
     parser.add_argument("--jobs", type=int, default=4, help="Number of parallel jobs (default: 4)")
-    parser.add_argument("--force", action="store_true", help="Force re-analysis even if report exists")
+    parser.add_argument("--force", action="store_true",
+                        help="Re-run every scenario, ignoring cached results (same as --no_result_cache)")
     parser.add_argument("--stdout", action="store_true", help="Print report to stdout instead of saving to file")
+    parser.add_argument("--no_server", action="store_true",
+                        help="Load the trace in every worker instead of sharing one trace_processor server")
+    parser.add_argument("--no_result_cache", action="store_true",
+                        help="Re-run every scenario instead of reusing cached results")
+    window_group = parser.add_mutually_exclusive_group()
+    window_group.add_argument("--window", nargs=2, type=float, metavar=("START", "END"),
+                              help="Only analyse events in [START, END] (trace timestamps in seconds)")
+    window_group.add_argument("--around", type=float, metavar="TS",
+                              help="Only analyse events within --span seconds of TS")
+    parser.add_argument("--span", type=float, default=0.1,
+                        help="Half-width of the --around window in seconds (default: 0.1)")
+    parser.add_argument("--margin", type=float, default=1.0,
+                        help="Extra seconds of context ingested on each side of the window (default: 1.0)")
+    add_shard_arguments(parser)
+    parser.add_argument("--no_proto", action="store_true",
+                        help="Load the text trace even if an up-to-date binary conversion (ftrace_proto.py) exists")
+    parser.add_argument("--sample_rows", type=int, default=DEFAULT_SAMPLE_ROWS,
+                        help=f"Rows of each scenario result kept and shown in the report (default: {DEFAULT_SAMPLE_ROWS})")
+    parser.add_argument("--evidence", nargs="+", metavar="SCENARIO",
+                        help="Scenarios (numbers, or 'all') whose full result is written to a CSV file")
+    parser.add_argument("--evidence_dir",
+                        help="Directory of the --evidence CSV files (default: evidence_<trace> next to the report)")
     
     args = parser.parse_args()
     
     trace_path = os.path.abspath(args.trace_file)
     output_dir = os.path.abspath(args.output_dir)
+    if args.around is not None:
+        args.window = [args.around - args.span, args.around + args.span]
+    if args.window and args.window[0] > args.window[1]:
+        parser.error("--window START must not be after END")
+    if args.sample_rows < 0:
+        parser.error("--sample_rows must not be negative")
     
     if not os.path.exists(trace_path):
         print(f"Error: Trace file not found: {trace_path}", file=sys.stderr)
@@ -189,19 +449,12 @@ def main():
         
     # Determine output filename
     trace_name = os.path.basename(trace_path)
-    report_file = os.path.join(output_dir, f"report_{trace_name}.md")
+    suffix = f"_{args.window[0]:.6f}-{args.window[1]:.6f}" if args.window else ""
+    if args.cpus is not None or args.events is not None:
+        suffix += f"_{ShardSpec(cpus=args.cpus, events=args.events).key[:8]}"
+    report_file = os.path.join(output_dir, f"report_{trace_name}{suffix}.md")
+    evidence_dir = os.path.abspath(args.evidence_dir or os.path.join(output_dir, f"evidence_{trace_name}{suffix}"))
     
-    # Check cache (only if not writing to stdout)
-    if not args.stdout and os.path.exists(report_file) and not args.force:
-        # Check if trace file is newer than report
-        trace_mtime = os.path.getmtime(trace_path)
-        report_mtime = os.path.getmtime(report_file)
-        
-        if report_mtime > trace_mtime:
-            print(f"Report already exists and is up-to-date: {report_file}", file=sys.stderr)
-            print("Skipping analysis. Use --force to override.", file=sys.stderr)
-            sys.exit(0)
-            
     # Redirect logs to stderr if printing report to stdout
     log_file = sys.stderr if args.stdout else sys.stdout
             
@@ -216,30 +469,95 @@ def main():
         print(f"Error parsing SQL file: {e}", file=sys.stderr)
         sys.exit(1)
         
-    # Distribute queries to workers
-    # To avoid loading the trace too many times, we want each worker to process a chunk of queries.
-    # If we have N jobs, we split queries into N chunks.
-    
-    num_jobs = min(args.jobs, len(queries))
-    chunk_size = (len(queries) + num_jobs - 1) // num_jobs
-    chunks = [queries[i:i + chunk_size] for i in range(0, len(queries), chunk_size)]
-    
-    print(f"Processing with {len(chunks)} parallel workers...", file=log_file)
+    for query in queries:
+        query['sample_rows'] = args.sample_rows
+        if args.evidence and evidence_wanted(query['desc'], args.evidence):
+            query['evidence'] = os.path.join(evidence_dir, evidence_name(query['desc']))
+    if any(q.get('evidence') for q in queries):
+        os.makedirs(evidence_dir, exist_ok=True)
+        print(f"Writing full scenario results to: {evidence_dir}", file=log_file)
+        
+    window_ns = None
+    if args.window:
+        window_ns = (int(round(args.window[0] * 1e9)), int(round(args.window[1] * 1e9)))
+        print(f"Time window: {args.window[0]:.6f} - {args.window[1]:.6f} s", file=log_file)
     
+    # Serve scenarios whose SQL and trace are unchanged from the result cache;
+    # only edited or missing scenarios are executed.
+    result_cache = None
+    if not (args.no_result_cache or args.force) and cache_enabled():
+        try:
+            variant = ','.join(part for part in (
+                f"window:{window_ns[0]}-{window_ns[1]}" if window_ns else "",
+                f"cpus:{','.join(map(str, sorted(args.cpus)))}" if args.cpus is not None else "",
+                f"events:{','.join(args.events)}" if args.events is not None else "",
+                f"rows:{args.sample_rows}" if args.sample_rows != DEFAULT_SAMPLE_ROWS else "") if part)
+            result_cache = ScenarioResultCache(trace_path, variant=variant)
+        except Exception as e:
+            print(f"Result cache unavailable ({e})", file=sys.stderr)
     all_results = []
+    if result_cache:
+        all_results, queries = result_cache.split(queries)
+        for res in all_results:
+            res['cache'] = 'hit'
+            # entries stored before results were sampled hold every row
+            res['data'] = res['data'].head(args.sample_rows)
+        print(f"Result cache: {result_cache.hits} hits, {result_cache.misses} misses", file=log_file)
     
-    with ProcessPoolExecutor(max_workers=num_jobs) as executor:
-        futures = [
-            executor.submit(execute_queries_worker, trace_path, args.tp_bin, chunk)
-            for chunk in chunks
-        ]
-        
-        for future in as_completed(futures):
+    ingest, wall_seconds, shared = None, None, []
+    trim_info = None
+    if args.window:
+        spec = ShardSpec(args.window[0] - args.margin, args.window[1] + args.margin, args.cpus, args.events)
+        trim_info = {'start': args.window[0], 'end': args.window[1]}
+    else:
+        spec = ShardSpec(cpus=args.cpus, events=args.events)
+    if queries:
+        # Compressed traces (.gz/.zst) are decompressed once into the cache;
+        # everything below works on the plain copy
+        source_path, source_temporary = trace_path, False
+        if compression(trace_path):
+            print(f"Decompressing {compression(trace_path)} trace...", file=log_file)
             try:
-                chunk_results = future.result()
-                all_results.extend(chunk_results)
+                source_path, source_temporary = load_decompressed(trace_path)
             except Exception as e:
-                print(f"Worker failed: {e}", file=sys.stderr)
+                print(f"Error: Failed to decompress trace: {e}", file=sys.stderr)
+                sys.exit(1)
+        # For text traces only the shard matching the window/CPU/event filters
+        # is handed to trace_processor, so ingest cost follows the subset rather
+        # than the trace. Shards are cached per trace for the next run.
+        ingest_path, temporary = source_path, False
+        if not spec.is_full and is_text_trace(source_path):
+            trim_info = trim_info or {}
+            trim_info.update(shard=spec.describe(), trace_bytes=os.path.getsize(source_path))
+            try:
+                ingest_path, temporary = load_shard(source_path, spec)
+                trim_info['ingest_bytes'] = os.path.getsize(ingest_path)
+                print(f"Loading shard ({spec.describe()}): {trim_info['ingest_bytes'] / 1e6:.1f} MB "
+                      f"of {trim_info['trace_bytes'] / 1e6:.1f} MB", file=log_file)
+            except Exception as e:
+                print(f"Trace sharding failed ({e}), ingesting the whole trace", file=sys.stderr)
+        elif args.cpus is not None or args.events is not None:
+            print("--cpus/--events only apply to text traces, ingesting the whole trace", file=sys.stderr)
+        if ingest_path == source_path and not args.no_proto:
+            ingest_path = preferred_trace(source_path)
+            if ingest_path != source_path:
+                print(f"Loading binary conversion: {ingest_path}", file=log_file)
+        try:
+            results, ingest, wall_seconds, shared = run_scenarios(
+                queries, ingest_path, args.tp_bin, args.jobs, not args.no_server, log_file, window_ns)
+        finally:
+            if temporary:
+                os.remove(ingest_path)
+            if source_temporary:
+                os.remove(source_path)
+        for res in results:
+            query = queries[res.pop('_index')]
+            if result_cache:
+                res['cache'] = 'miss'
+                result_cache.put(query, res)
+        all_results.extend(results)
+    if result_cache:
+        result_cache.close()
                 
     # Sort results to match original order (optional but nice)
     # We can use the description prefix "Scenario X" to sort if available, or just map back
@@ -249,10 +567,10 @@ def main():
     # Generate Report
     try:
         if args.stdout:
-            generate_report(all_results, sys.stdout, trace_path)
+            generate_report(all_results, sys.stdout, trace_path, ingest, wall_seconds, shared, trim_info)
         else:
             with open(report_file, 'w') as f:
-                generate_report(all_results, f, trace_path)
+                generate_report(all_results, f, trace_path, ingest, wall_seconds, shared, trim_info)
             print(f"Analysis complete. Report saved to: {report_file}", file=log_file)
     except Exception as e:
         print(f"Failed to generate report: {e}", file=sys.stderr)
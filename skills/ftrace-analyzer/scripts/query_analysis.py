@@ -1,7 +1,10 @@
 #!/usr/bin/env python3
 import os
 import sys
+import json
 import argparse
+import textwrap
+from itertools import chain, islice
 try:
     import pandas as pd
 except ImportError:
@@ -13,17 +16,89 @@ except ImportError:
     print("Error: 'perfetto' python module is not installed. Please install it using 'pip install perfetto'.")
     sys.exit(1)
 
+from ftrace_proto import preferred_trace
+from query_daemon import connect
+from tp_session import TraceProcessorSession, limit_sql, result_rows
+from trace_codec import compression, load_decompressed
+from trace_shards import ShardSpec, add_shard_arguments, is_text_trace, load_shard
+
 # Default paths
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DEFAULT_TP_BIN = os.path.join(BASE_DIR, 'trace_processor')
 
+# Rows used to size the table columns; later rows are printed with the same
+# widths (a longer value just widens its own line).
+TABLE_SAMPLE_ROWS = 1000
+
+def print_rows(rows, fmt, max_rows=None, out=sys.stdout):
+    """Streams the result rows (an iterator of dicts) as table, csv, json or jsonl.
+
+    Rows are written as they arrive, so memory does not grow with the result
+    set; the table format only buffers the first TABLE_SAMPLE_ROWS rows to
+    size its columns. Returns the number of rows written.
+    """
+    rows = iter(rows)
+    sample = list(islice(rows, TABLE_SAMPLE_ROWS if fmt == 'table' else 1))
+    if not sample:
+        print("Query executed successfully but returned no results.", file=sys.stderr if fmt != 'table' else out)
+        return 0
+    headers = list(sample[0].keys())
+    count = 0
+    if fmt == 'json':
+        out.write("[")
+        for r in chain(sample, rows):
+            out.write(("," if count else "") + "\n" + textwrap.indent(json.dumps(r, indent=2, default=str), "  "))
+            count += 1
+        out.write("\n]\n")
+    elif fmt == 'jsonl':
+        for r in chain(sample, rows):
+            out.write(json.dumps(r, default=str) + "\n")
+            count += 1
+    elif fmt == 'csv':
+        out.write(",".join(headers) + "\n")
+        for r in chain(sample, rows):
+            out.write(",".join([str(r.get(h, '')) for h in headers]) + "\n")
+            count += 1
+    else: # table
+        # Calculate widths from the sample
+        widths = {h: len(h) for h in headers}
+        for r in sample:
+            for h in headers:
+                widths[h] = max(widths[h], len(str(r.get(h, ''))))
+        
+        # Print header
+        header_line = " | ".join([h.ljust(widths[h]) for h in headers])
+        out.write("-" * len(header_line) + "\n")
+        out.write(header_line + "\n")
+        out.write("-" * len(header_line) + "\n")
+        
+        # Print rows
+        for r in chain(sample, rows):
+            out.write(" | ".join([str(r.get(h, '')).ljust(widths[h]) for h in headers]) + "\n")
+            count += 1
+        out.write("-" * len(header_line) + "\n")
+        limited = " (limited by --max-rows)" if max_rows is not None and count >= max_rows else ""
+        out.write(f"Total rows: {count}{limited}\n")
+    return count
+
 def main():
     parser = argparse.ArgumentParser(description="Ad-hoc Ftrace Query Analysis")
     parser.add_argument("trace_file", help="Path to the ftrace/perfetto trace file")
     parser.add_argument("--query", "-q", help="SQL query string to execute")
     parser.add_argument("--query_file", "-f", help="Path to a file containing the SQL query")
     parser.add_argument("--tp_bin", default=DEFAULT_TP_BIN, help="Path to trace_processor binary")
-    parser.add_argument("--format", choices=['table', 'csv', 'json'], default='table', help="Output format")
+    parser.add_argument("--format", choices=['table', 'csv', 'json', 'jsonl'], default='table',
+                        help="Output format (csv/json/jsonl stream row by row)")
+    parser.add_argument("--max-rows", "--max_rows", dest="max_rows", type=int, default=None,
+                        help="Return at most N rows (applied as a LIMIT inside trace_processor)")
+    parser.add_argument("--window", nargs=2, type=float, metavar=("START", "END"),
+                        help="Only load events in [START, END] (trace timestamps in seconds, text traces)")
+    add_shard_arguments(parser)
+    parser.add_argument("--no_proto", action="store_true",
+                        help="Load the text trace even if an up-to-date binary conversion (ftrace_proto.py) exists")
+    parser.add_argument("--no_daemon", action="store_true",
+                        help="Load the trace in this process instead of querying the resident query daemon")
+    parser.add_argument("--socket", default=None, help="Unix socket of the query daemon (default: see query_daemon.py)")
     
     args = parser.parse_args()
     
@@ -48,81 +123,111 @@ def main():
             
     # Set binary path
     os.environ["PERFETTO_BINARY_PATH"] = args.tp_bin
+    if args.max_rows is not None and args.max_rows < 0:
+        print("Error: --max-rows must not be negative")
+        sys.exit(1)
+    
+    # Progress goes to stderr for the machine-readable formats, so that stdout
+    # carries nothing but the rows
+    log = sys.stdout if args.format == 'table' else sys.stderr
     
-    print(f"Loading trace: {trace_path} ...")
+    # Compressed traces (.gz/.zst) are decompressed once into the cache
+    source_path, source_temporary = trace_path, False
+    if compression(trace_path):
+        print(f"Decompressing {compression(trace_path)} trace ...", file=log)
+        try:
+            source_path, source_temporary = load_decompressed(trace_path)
+        except Exception as e:
+            print(f"Error: Failed to decompress trace: {e}", file=log)
+            sys.exit(1)
+    
+    # Load only the cached shard matching the filters instead of the whole trace
+    start, end = args.window if args.window else (None, None)
+    spec = ShardSpec(start, end, args.cpus, args.events)
+    ingest_path, temporary = source_path, source_temporary
+    if not spec.is_full:
+        if not is_text_trace(source_path):
+            print("Error: --window/--cpus/--events only apply to ftrace text traces", file=log)
+            sys.exit(1)
+        print(f"Preparing shard ({spec.describe()}) ...", file=log)
+        ingest_path, temporary = load_shard(source_path, spec)
+        if source_temporary:
+            os.remove(source_path)
+    elif not args.no_proto and not source_temporary:
+        ingest_path = preferred_trace(source_path)
+    
+    # By default the query goes to the resident query daemon (started on first
+    # use), so only the first query on a trace pays for loading it.
+    if not args.no_daemon and not temporary:
+        try:
+            client = connect(args.tp_bin, args.socket)
+        except Exception as e:
+            print(f"Query daemon unavailable ({e}), loading the trace in-process", file=log)
+            client = None
+        if client:
+            print(f"Querying trace: {ingest_path} (via query daemon) ...", file=log)
+            sys.exit(run_daemon_query(client, ingest_path, sql, args, log))
+    
+    print(f"Loading trace: {ingest_path} ...", file=log)
     
     try:
-        tp = TraceProcessor(file_path=trace_path)
+        tp = TraceProcessorSession(TraceProcessor(file_path=ingest_path))
     except Exception as e:
-        print(f"Failed to load trace processor: {e}")
+        print(f"Failed to load trace processor: {e}", file=log)
+        if temporary:
+            os.remove(ingest_path)
         sys.exit(1)
         
-    print("Executing query...")
+    print("Executing query...", file=log)
     try:
-        # Use pandas integration for better formatting if available
-        # The user environment might not have pandas installed, but standard python perfetto lib usually works well with it
-        # Let's try standard query first to be safe, or check imports
-        
-        # Execute
-        stmts = [s.strip() for s in sql.split(';') if s.strip()]
-        last_result = None
+        # Execute (the session splits statements, honouring quotes and comments);
+        # --max-rows becomes a LIMIT so trace_processor never produces more rows
+        last_result = tp.execute(limit_sql(sql, args.max_rows) if args.max_rows is not None else sql)
         
-        for stmt in stmts:
-            if stmt.upper().startswith('INCLUDE'):
-                tp.query(stmt)
-            else:
-                last_result = tp.query(stmt)
-        
-        if last_result:
-            # Convert to list of dicts for display
-            rows = []
-            for row in last_result:
-                try:
-                    # Clean up internal fields
-                    d = {k: v for k, v in row.__dict__.items() if not k.startswith('_')}
-                    rows.append(d)
-                except:
-                    rows.append({"result": str(row)})
-            
-            if not rows:
-                print("Query executed successfully but returned no results.")
-            else:
-                if args.format == 'json':
-                    import json
-                    print(json.dumps(rows, indent=2, default=str))
-                elif args.format == 'csv':
-                    if rows:
-                        headers = list(rows[0].keys())
-                        print(",".join(headers))
-                        for r in rows:
-                            print(",".join([str(r.get(h, '')) for h in headers]))
-                else: # table
-                    # Basic table formatting
-                    if rows:
-                        headers = list(rows[0].keys())
-                        # Calculate widths
-                        widths = {h: len(h) for h in headers}
-                        for r in rows:
-                            for h in headers:
-                                widths[h] = max(widths[h], len(str(r.get(h, ''))))
-                        
-                        # Print header
-                        header_line = " | ".join([h.ljust(widths[h]) for h in headers])
-                        print("-" * len(header_line))
-                        print(header_line)
-                        print("-" * len(header_line))
-                        
-                        # Print rows
-                        for r in rows:
-                            print(" | ".join([str(r.get(h, '')).ljust(widths[h]) for h in headers]))
-                        print("-" * len(header_line))
-                        print(f"Total rows: {len(rows)}")
+        if last_result is not None:
+            rows = result_rows(last_result)
+            if args.max_rows is not None:
+                rows = islice(rows, args.max_rows)
+            print_rows(rows, args.format, args.max_rows)
                     
     except Exception as e:
-        print(f"Query Execution Failed: {e}")
+        print(f"Query Execution Failed: {e}", file=log)
         sys.exit(1)
     finally:
         tp.close()
+        if temporary:
+            os.remove(ingest_path)
+
+def run_daemon_query(client, trace_path, sql, args, log) -> int:
+    """Streams one query through the daemon to stdout; returns the exit code."""
+    try:
+        messages = client.query(trace_path, sql, args.max_rows)
+        header = next(messages)
+        if not header.get('ok'):
+            print(f"Query Execution Failed: {header.get('error')}", file=log)
+            return 1
+        if header.get('ingest_seconds') is not None:
+            print(f"Trace loaded in {header['ingest_seconds']:.2f}s (kept resident for later queries)", file=log)
+        trailer = {}
+
+        def rows():
+            for message in messages:
+                if isinstance(message, dict):
+                    trailer.update(message)
+                    return
+                yield dict(zip(header['columns'], message))
+
+        if header.get('has_result'):
+            print_rows(rows(), args.format, args.max_rows)
+        for _ in rows():
+            pass
+    except Exception as e:
+        print(f"Query Execution Failed: {e}", file=log)
+        return 1
+    if not trailer.get('ok'):
+        print(f"Query Execution Failed: {trailer.get('error')}", file=log)
+        return 1
+    return 0
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+"""
+Resident query daemon for query_analysis.py.
+
+The drill-down loop runs ``query_analysis.py`` many times against the same
+trace, and each run used to ingest the whole trace again for a single query.
+The daemon keeps loaded traces resident: every trace gets its own
+``TraceProcessorServer``, and the daemon queries it through a
+``TraceProcessorSession``, so module includes are not repeated either. Only
+the first query on a trace pays the ingest. Clients talk to the daemon over a
+Unix socket (``$FTRACE_QUERY_SOCKET``, default ``query_daemon.sock`` in the
+ftrace cache directory), one JSON value per line in each direction. A query
+result is streamed: a header, one array per row, then a trailer. The client
+never has to hold the whole result set in memory:
+
+    {"op": "query", "trace": "/abs/trace.log", "sql": "SELECT ...", "max_rows": 100}
+    -> {"ok": true, "columns": ["ts", "dur"], "has_result": true, "ingest_seconds": null}
+    -> [123, 45]
+    -> ...
+    -> {"end": true, "ok": true, "rows": 100, "elapsed": 0.01}
+
+``max_rows`` is pushed into the SQL as a ``LIMIT``. Other ops (``status``,
+``unload``, ``shutdown``) answer with a single object. Resident traces are kept
+in LRU order. The least recently used traces are unloaded once more than
+``--max_traces`` are loaded, or once their trace processors together use more
+than ``--max_mb`` of resident memory. A trace whose file changed on disk is
+reloaded. The daemon exits after ``--idle_timeout`` seconds without requests.
+
+``connect`` starts the daemon in the background on first use, so clients
+never have to manage it:
+
+    python query_daemon.py --status
+    python query_daemon.py --stop
+"""
+import argparse
+import json
+import os
+import socket
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+from collections import OrderedDict
+from itertools import chain
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+try:
+    from .ftrace_cache import cache_dir
+    from .tp_server import TraceProcessorServer
+    from .tp_session import TraceProcessorSession, limit_sql, result_rows
+except ImportError:
+    from ftrace_cache import cache_dir
+    from tp_server import TraceProcessorServer
+    from tp_session import TraceProcessorSession, limit_sql, result_rows
+
+SOCKET_NAME = 'query_daemon.sock'
+LOG_NAME = 'query_daemon.log'
+DEFAULT_MAX_TRACES = 2
+DEFAULT_MAX_MB = 8192
+DEFAULT_IDLE_TIMEOUT = 30 * 60
+START_TIMEOUT = 30
+# socket write buffer, so rows are not sent one syscall at a time
+WRITE_BUFFER = 64 * 1024
+
+Message = Union[Dict[str, Any], List[Any]]
+
+
+def default_socket_path() -> str:
+    return os.environ.get('FTRACE_QUERY_SOCKET') or os.path.join(cache_dir(), SOCKET_NAME)
+
+
+def _file_stamp(path: str) -> Tuple[int, int]:
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+def open_trace(trace_path: str, tp_bin: str):
+    """Loads ``trace_path`` into its own trace processor server: ``(session, server)``."""
+    from perfetto.trace_processor import TraceProcessor
+    server = TraceProcessorServer(trace_path, tp_bin).start()
+    try:
+        return TraceProcessorSession(TraceProcessor(addr=server.addr)), server
+    except BaseException:
+        server.stop()
+        raise
+
+
+class ResidentTrace:
+    """One loaded trace; ``lock`` serializes its load and queries."""
+
+    def __init__(self, trace_path: str, stamp: Tuple[int, int]):
+        self.trace_path = trace_path
+        self.stamp = stamp
+        self.lock = threading.Lock()
+        self.session = None
+        self.server = None
+        self.ingest_seconds = None
+        self.queries = 0
+        self.last_used = time.time()
+        self.closed = False
+
+    def load(self, opener: Callable, tp_bin: str) -> bool:
+        """Loads the trace unless it is resident; True if it was loaded now."""
+        if self.session is not None:
+            return False
+        started = time.perf_counter()
+        self.session, self.server = opener(self.trace_path, tp_bin)
+        self.ingest_seconds = time.perf_counter() - started
+        return True
+
+    def rss(self) -> Optional[int]:
+        return self.server.rss() if self.server is not None else None
+
+    def close(self):
+        if self.session is not None:
+            try:
+                self.session.close()
+            except Exception:
+                pass
+        if self.server is not None:
+            self.server.stop()
+        self.session = self.server = None
+        self.closed = True
+
+
+class QueryDaemon:
+    """Serves queries on resident traces; ``handle`` answers one request dict."""
+
+    def __init__(self, tp_bin: str, max_traces: int = DEFAULT_MAX_TRACES,
+                 max_bytes: int = DEFAULT_MAX_MB * 1024 * 1024,
+                 opener: Callable = open_trace):
+        self.tp_bin = tp_bin
+        self.max_traces = max_traces
+        self.max_bytes = max_bytes
+        self.opener = opener
+        self.traces: 'OrderedDict[str, ResidentTrace]' = OrderedDict()
+        self.lock = threading.Lock()
+        self.last_request = time.time()
+        self.stopping = threading.Event()
+
+    def _entry(self, trace_path: str) -> ResidentTrace:
+        stamp = _file_stamp(trace_path)
+        stale = None
+        with self.lock:
+            entry = self.traces.get(trace_path)
+            if entry is not None and entry.stamp != stamp:
+                stale, entry = entry, None
+            if entry is None:
+                entry = self.traces[trace_path] = ResidentTrace(trace_path, stamp)
+            self.traces.move_to_end(trace_path)
+        if stale is not None:
+            with stale.lock:
+                stale.close()
+        return entry
+
+    def _drop(self, entry: ResidentTrace):
+        with self.lock:
+            if self.traces.get(entry.trace_path) is entry:
+                del self.traces[entry.trace_path]
+
+    def evict(self, keep: Optional[ResidentTrace] = None) -> List[str]:
+        """Unloads least recently used traces beyond the count and memory limits."""
+        victims = []
+        with self.lock:
+            entries = list(self.traces.values())
+            total = sum(e.rss() or 0 for e in entries)
+            for entry in entries:
+                if len(entries) - len(victims) <= self.max_traces and total <= self.max_bytes:
+                    break
+                if entry is keep:
+                    continue
+                victims.append(entry)
+                total -= entry.rss() or 0
+                del self.traces[entry.trace_path]
+        for entry in victims:
+            with entry.lock:
+                entry.close()
+        return [e.trace_path for e in victims]
+
+    def query(self, trace_path: str, sql: str, max_rows: Optional[int] = None) -> Iterator[Message]:
+        """Streams a query result: a header dict, one list per row, then a trailer dict."""
+        while True:
+            entry = self._entry(trace_path)
+            with entry.lock:
+                if entry.closed:
+                    # evicted or reloaded while this request waited for it
+                    continue
+                try:
+                    loaded = entry.load(self.opener, self.tp_bin)
+                except Exception as e:
+                    entry.close()
+                    self._drop(entry)
+                    yield {'ok': False, 'error': f"Failed to load trace: {e}"}
+                    return
+                started = time.perf_counter()
+                count = 0
+                try:
+                    try:
+                        result = entry.session.execute(limit_sql(sql, max_rows) if max_rows else sql)
+                        rows = result_rows(result) if result is not None else iter(())
+                        first = next(rows, None)
+                    except Exception as e:
+                        yield {'ok': False, 'error': str(e)}
+                        return
+                    columns = list(first) if first is not None else []
+                    yield {'ok': True, 'columns': columns, 'has_result': result is not None,
+                           'ingest_seconds': entry.ingest_seconds if loaded else None}
+                    try:
+                        for row in chain([first] if first is not None else [], rows):
+                            if max_rows is not None and count >= max_rows:
+                                break
+                            yield [row.get(c) for c in columns]
+                            count += 1
+                    except Exception as e:
+                        yield {'end': True, 'ok': False, 'error': str(e), 'rows': count}
+                        return
+                finally:
+                    entry.queries += 1
+                    entry.last_used = time.time()
+                elapsed = time.perf_counter() - started
+            break
+        if loaded:
+            self.evict(keep=entry)
+        yield {'end': True, 'ok': True, 'rows': count, 'elapsed': elapsed}
+
+    def status(self) -> Dict[str, Any]:
+        with self.lock:
+            entries = list(self.traces.values())
+        now = time.time()
+        return {'ok': True, 'pid': os.getpid(), 'traces': [
+            {'trace': e.trace_path, 'loaded': e.session is not None, 'rss': e.rss(),
+             'ingest_seconds': e.ingest_seconds, 'queries': e.queries, 'idle': now - e.last_used}
+            for e in reversed(entries)]}
+
+    def handle(self, request: Dict[str, Any]) -> Iterator[Message]:
+        """The messages answering one request (a stream for ``query``, else a single dict)."""
+        self.last_request = time.time()
+        op = request.get('op')
+        if op == 'query':
+            trace_path = os.path.abspath(request['trace'])
+            if not os.path.exists(trace_path):
+                return iter([{'ok': False, 'error': f"Trace file not found: {trace_path}"}])
+            return self.query(trace_path, request['sql'], request.get('max_rows'))
+        if op == 'status':
+            return iter([self.status()])
+        if op == 'unload':
+            trace_path = os.path.abspath(request['trace'])
+            with self.lock:
+                entry = self.traces.pop(trace_path, None)
+            if entry is not None:
+                with entry.lock:
+                    entry.close()
+            return iter([{'ok': True, 'unloaded': entry is not None}])
+        if op == 'shutdown':
+            self.stopping.set()
+            return iter([{'ok': True}])
+        return iter([{'ok': False, 'error': f"Unknown op: {op!r}"}])
+
+    def close(self):
+        with self.lock:
+            entries = list(self.traces.values())
+            self.traces.clear()
+        for entry in entries:
+            with entry.lock:
+                entry.close()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    wbufsize = WRITE_BUFFER
+
+    def handle(self):
+        daemon = self.server.query_daemon
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            messages = None
+            try:
+                messages = daemon.handle(json.loads(line))
+                for message in messages:
+                    self.wfile.write(json.dumps(message, ensure_ascii=False, default=str).encode() + b'\n')
+            except (BrokenPipeError, ConnectionResetError):
+                return
+            except Exception as e:
+                self.wfile.write(json.dumps({'ok': False, 'error': f"{type(e).__name__}: {e}"}).encode() + b'\n')
+            finally:
+                if messages is not None and hasattr(messages, 'close'):
+                    # releases the trace if the client went away mid-stream
+                    messages.close()
+            self.wfile.flush()
+            if daemon.stopping.is_set():
+                break
+
+
+class _UnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def serve(daemon: QueryDaemon, socket_path: str, idle_timeout: float = DEFAULT_IDLE_TIMEOUT):
+    """Serves ``daemon`` on ``socket_path`` until shutdown or ``idle_timeout`` seconds without requests."""
+    if os.path.exists(socket_path):
+        if _ping(socket_path):
+            raise RuntimeError(f"A query daemon is already listening on {socket_path}")
+        os.remove(socket_path)
+    os.makedirs(os.path.dirname(os.path.abspath(socket_path)), exist_ok=True)
+    server = _UnixServer(socket_path, _Handler)
+    server.query_daemon = daemon
+
+    def watchdog():
+        while not daemon.stopping.wait(1.0):
+            if time.time() - daemon.last_request > idle_timeout:
+                daemon.stopping.set()
+        server.shutdown()
+
+    threading.Thread(target=watchdog, daemon=True).start()
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        daemon.close()
+
+
+# ==================== Client ====================
+
+class DaemonClient:
+    """Sends requests to a running daemon, one connection per request."""
+
+    def __init__(self, socket_path: Optional[str] = None, timeout: Optional[float] = None):
+        self.socket_path = socket_path or default_socket_path()
+        self.timeout = timeout
+
+    def request(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            sock.sendall(json.dumps(payload).encode() + b'\n')
+            with sock.makefile('rb') as reader:
+                line = reader.readline()
+        if not line:
+            raise ConnectionError("query daemon closed the connection")
+        return json.loads(line)
+
+    def query(self, trace_path: str, sql: str, max_rows: Optional[int] = None) -> Iterator[Message]:
+        """Streams the answer to a query: header dict, row lists, trailer dict."""
+        payload = {'op': 'query', 'trace': os.path.abspath(trace_path), 'sql': sql, 'max_rows': max_rows}
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            sock.sendall(json.dumps(payload).encode() + b'\n')
+            with sock.makefile('rb') as reader:
+                for line in reader:
+                    message = json.loads(line)
+                    yield message
+                    if isinstance(message, dict) and (message.get('end') or not message.get('ok')):
+                        return
+        raise ConnectionError("query daemon closed the connection mid-result")
+
+
+def _ping(socket_path: str) -> bool:
+    try:
+        return DaemonClient(socket_path, timeout=5).request({'op': 'status'}).get('ok', False)
+    except (OSError, ValueError):
+        return False
+
+
+def connect(tp_bin: str, socket_path: Optional[str] = None,
+            max_traces: int = DEFAULT_MAX_TRACES, max_mb: float = DEFAULT_MAX_MB) -> DaemonClient:
+    """A client of the daemon on ``socket_path``, starting the daemon in the background if needed."""
+    socket_path = socket_path or default_socket_path()
+    if _ping(socket_path):
+        return DaemonClient(socket_path)
+    os.makedirs(os.path.dirname(os.path.abspath(socket_path)), exist_ok=True)
+    log = open(os.path.join(os.path.dirname(os.path.abspath(socket_path)), LOG_NAME), 'ab')
+    try:
+        subprocess.Popen([sys.executable, os.path.abspath(__file__), '--socket', socket_path,
+                          '--tp_bin', tp_bin, '--max_traces', str(max_traces), '--max_mb', str(max_mb)],
+                         stdin=subprocess.DEVNULL, stdout=log, stderr=log, start_new_session=True)
+    finally:
+        log.close()
+    deadline = time.time() + START_TIMEOUT
+    while time.time() < deadline:
+        if _ping(socket_path):
+            return DaemonClient(socket_path)
+        time.sleep(0.1)
+    raise TimeoutError(f"query daemon did not start on {socket_path} (see {LOG_NAME})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resident trace_processor query daemon")
+    parser.add_argument("--socket", default=None, help="Unix socket path (default: $FTRACE_QUERY_SOCKET "
+                        "or query_daemon.sock in the ftrace cache directory)")
+    parser.add_argument("--tp_bin", default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                         'trace_processor'),
+                        help="Path to trace_processor binary")
+    parser.add_argument("--max_traces", type=int, default=DEFAULT_MAX_TRACES,
+                        help=f"Resident traces kept loaded (default: {DEFAULT_MAX_TRACES})")
+    parser.add_argument("--max_mb", type=float, default=DEFAULT_MAX_MB,
+                        help=f"Resident memory budget of the loaded traces in MB (default: {DEFAULT_MAX_MB})")
+    parser.add_argument("--idle_timeout", type=float, default=DEFAULT_IDLE_TIMEOUT,
+                        help=f"Exit after this many seconds without requests (default: {DEFAULT_IDLE_TIMEOUT})")
+    parser.add_argument("--status", action="store_true", help="Show the running daemon's resident traces")
+    parser.add_argument("--stop", action="store_true", help="Stop the running daemon")
+    args = parser.parse_args()
+
+    socket_path = args.socket or default_socket_path()
+    if args.status or args.stop:
+        if not _ping(socket_path):
+            print(f"No query daemon on {socket_path}")
+            return 1
+        client = DaemonClient(socket_path)
+        if args.stop:
+            client.request({'op': 'shutdown'})
+            print("Query daemon stopped")
+            return 0
+        status = client.request({'op': 'status'})
+        print(f"Query daemon pid {status['pid']} on {socket_path}")
+        for t in status['traces']:
+            rss = f"{t['rss'] / 1e6:.1f} MB" if t['rss'] is not None else "n/a"
+            print(f"  {t['trace']}: RSS {rss}, {t['queries']} queries, idle {t['idle']:.0f}s")
+        return 0
+
+    serve(QueryDaemon(args.tp_bin, args.max_traces, int(args.max_mb * 1024 * 1024)),
+          socket_path, args.idle_timeout)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
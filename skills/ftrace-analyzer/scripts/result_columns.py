@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Columnar query results for global_analysis.py.
+
+A scenario result used to travel as one dict per row: built from
+``row.__dict__`` in the worker, pickled to the parent process, and walked
+again by the report. ``ResultColumns`` keeps it column by column instead,
+with one pass over the trace processor's row iterator and no per-row dict:
+
+- integer and float columns without NULLs become ``array.array`` buffers
+  (``q`` / ``d``), which pickle as one block of bytes;
+- string columns are dictionary-encoded: an ``I`` array of codes plus the
+  distinct values, so a thread name repeated 100k times is sent once;
+- anything else (mixed types, NULLs) stays a plain list.
+
+When NumPy is installed, ``column()`` exposes the numeric buffers as
+zero-copy ndarrays. ``generate_report`` reads rows as tuples through
+``rows()``.
+
+A result can be a sample: ``from_result(..., limit=n)`` keeps the first
+``n`` rows and only counts the rest into ``total``, optionally streaming
+every row to a CSV writer on the way, so the full result never has to be
+held in memory.
+"""
+from array import array
+from itertools import chain, count, islice
+from operator import attrgetter
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+class DictColumn:
+    """A string column stored as codes into its distinct values."""
+    __slots__ = ('codes', 'values')
+
+    def __init__(self, codes: array, values: List[str]):
+        self.codes = codes
+        self.values = values
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.values[c] for c in self.codes[index]]
+        return self.values[self.codes[index]]
+
+    def __iter__(self):
+        values = self.values
+        return (values[c] for c in self.codes)
+
+
+def pack_column(values: List[Any]):
+    """The most compact representation of one column's values."""
+    if values and type(values[0]) is int:
+        try:
+            # rejects floats, strings and None; raises on ints beyond int64
+            return array('q', values)
+        except (TypeError, OverflowError):
+            return values
+    kinds = set(map(type, values))
+    if kinds == {float}:
+        return array('d', values)
+    if kinds == {str}:
+        distinct = list(dict.fromkeys(values))
+        codes = {v: i for i, v in enumerate(distinct)}
+        return DictColumn(array('I', map(codes.__getitem__, values)), distinct)
+    return values
+
+
+class ResultColumns:
+    """One query result: column ``names`` and a packed column per name.
+
+    ``total`` is the row count of the full result, which is larger than
+    ``len()`` when only a sample of it was kept.
+    """
+
+    def __init__(self, names: Sequence[str], columns: Sequence, total: Optional[int] = None):
+        self.names = list(names)
+        self.columns = list(columns)
+        self.total = len(self) if total is None else total
+        self._views = {}
+
+    @classmethod
+    def from_result(cls, result, limit: Optional[int] = None, writer=None) -> 'ResultColumns':
+        """Builds the columns from a trace processor result iterator, one row at a time.
+
+        Only the first ``limit`` rows are kept (all when None); the rest are
+        counted into ``total``. ``writer`` (a ``csv.writer``) receives the
+        header and every row of the result.
+        """
+        rows = iter(result)
+        first = next(rows, None)
+        if first is None:
+            return cls([], [])
+        try:
+            names = [k for k in first.__dict__ if not k.startswith('_')]
+            # one C-level attribute fetch per row, then a C-level transpose
+            getter = attrgetter(*names) if len(names) > 1 else (lambda row, name=names[0]: (getattr(row, name),))
+        except AttributeError:
+            names, getter = ['result'], lambda row: (str(row),)
+        if not names:
+            return cls([], [])
+        if writer is not None:
+            writer.writerow(names)
+        tuples = map(getter, chain([first], rows))
+        head = list(islice(tuples, limit))
+        if writer is not None:
+            writer.writerows(head)
+        # the rows past the sample are only counted (and written), never kept;
+        # zip stops on the exhausted map before drawing from the counter
+        counter = count()
+        rest = (row for row, _ in zip(tuples, counter))
+        if writer is not None:
+            writer.writerows(rest)
+        else:
+            for _ in rest:
+                pass
+        total = len(head) + next(counter)
+        return cls(names, [pack_column(list(col)) for col in zip(*head)], total)
+
+    @classmethod
+    def from_records(cls, records: Iterable[Dict[str, Any]]) -> 'ResultColumns':
+        """From a list of row dicts (the pre-columnar form, e.g. old cache entries)."""
+        records = list(records)
+        if not records:
+            return cls([], [])
+        if not isinstance(records[0], dict):
+            return cls(['result'], [[str(r) for r in records]])
+        names = list(records[0])
+        return cls(names, [pack_column([r.get(n) for r in records]) for n in names])
+
+    def __len__(self):
+        return len(self.columns[0]) if self.columns else 0
+
+    def __bool__(self):
+        return self.total > 0
+
+    def head(self, n: Optional[int]) -> 'ResultColumns':
+        """The first ``n`` rows as a sample, keeping ``total``."""
+        if n is None or n >= len(self):
+            return self
+        return ResultColumns(self.names, [pack_column(list(col[:n])) for col in self.columns], self.total)
+
+    def column(self, name: str):
+        """The column as an ndarray view (NumPy, numeric columns) or as stored."""
+        col = self.columns[self.names.index(name)]
+        if np is None or not isinstance(col, array):
+            return col
+        view = self._views.get(name)
+        if view is None:
+            view = np.frombuffer(col, dtype=col.typecode) if len(col) else np.zeros(0, dtype=col.typecode)
+            self._views[name] = view
+        return view
+
+    def rows(self, start: int = 0, stop: Optional[int] = None) -> Iterator[Tuple]:
+        """Rows ``[start, stop)`` as tuples in ``names`` order."""
+        stop = len(self) if stop is None else min(stop, len(self))
+        return zip(*(col[start:stop] for col in self.columns))
+
+    def to_json(self) -> Dict[str, Any]:
+        """Column-oriented plain lists, for JSON storage."""
+        return {'names': self.names, 'columns': [list(col) for col in self.columns], 'total': self.total}
+
+    @classmethod
+    def from_json(cls, data) -> 'ResultColumns':
+        if isinstance(data, list):
+            return cls.from_records(data)
+        return cls(data['names'], [pack_column(col) for col in data['columns']], data.get('total'))
+
+    def __getstate__(self):
+        return {'names': self.names, 'columns': self.columns, 'total': self.total}
+
+    def __setstate__(self, state):
+        self.names = state['names']
+        self.columns = state['columns']
+        self.total = state['total']
+        self._views = {}
@@ -2,6 +2,10 @@ import os
 import re
 from perfetto.trace_processor import TraceProcessor
 
+from ftrace_proto import preferred_trace
+from trace_codec import load_decompressed
+from tp_session import TraceProcessorSession, required_modules
+
 TRACE_PATH = '/opt/src/LogixAgent/logs/ftrace/trace.log'
 # SQL_FILE = '/opt/src/perfetto/ftrace.sql' # Original path
 # Use relative path to the SQL file
@@ -46,19 +50,35 @@ def parse_sql_file(file_path):
     return queries
 
 def main():
-    print(f"Loading trace: {TRACE_PATH}")
+    # A .gz/.zst trace is decompressed once into the cache first; an up-to-date
+    # binary conversion (ftrace_proto.py) loads much faster than the text
+    source_path, temporary = load_decompressed(TRACE_PATH)
+    trace_path = source_path if temporary else preferred_trace(source_path)
+    print(f"Loading trace: {trace_path}")
     try:
         # Try using file_path argument if trace argument fails, or vice versa.
         # Based on error "Did you mean 'file_path'?", it likely wants file_path for the trace.
-        tp = TraceProcessor(file_path=TRACE_PATH)
+        tp = TraceProcessorSession(TraceProcessor(file_path=trace_path))
     except Exception as e:
         print(f"Failed to load trace processor: {e}")
         # Fallback: try without bin_path if the lib handles it, or check if bin exists
         return
+    finally:
+        if temporary:
+            # trace_processor has read the whole trace by now
+            os.remove(source_path)
 
     queries = parse_sql_file(SQL_FILE)
     print(f"Found {len(queries)} scenarios.")
 
+    # Include every module the scenarios need once, before they run
+    modules = required_modules(q['sql'] for q in queries)
+    try:
+        seconds = tp.prewarm(modules)
+        print(f"Pre-warmed {len(modules)} modules in {seconds:.2f}s")
+    except Exception as e:
+        print(f"Module pre-warm failed: {e}")
+
     success_count = 0
     failure_count = 0
 
@@ -67,44 +87,22 @@ def main():
         # print(f"SQL: {q['sql'][:50]}...")
         
         try:
-            # We need to execute statements. 
             # Some scenarios have INCLUDE PERFETTO MODULE; followed by SELECT.
-            # tp.query() usually expects a single query.
-            # We might need to split by ';' if there are multiple statements.
-            
-            stmts = [s.strip() for s in q['sql'].split(';') if s.strip()]
-            
-            for stmt in stmts:
-                if stmt.upper().startswith('INCLUDE'):
-                    # It's a module include, just run it
-                    tp.query(stmt)
-                else:
-                    # It's likely the SELECT
-                    try:
-                        result = tp.query(stmt)
-                        # Iterate to get results without pandas
-                        rows = []
-                        for row in result:
-                            rows.append(row)
-                            if len(rows) >= 3:
-                                break
-                        
-                        # Count total (might need to iterate all if we want count)
-                        # But for verification, just checking if it runs is enough.
-                        # If we want count, we must iterate all.
-                        count = len(rows) 
-                        # Continue iterating to count rest if needed, but let's just say "at least X" or verify no error.
-                        # Actually, let's just print the first few.
-                        
-                        print(f"Result (first {len(rows)} rows):")
-                        for r in rows:
-                            print(r)
-                            
-                    except Exception as e:
-                         # If the error is about pandas, handle it. 
-                         # But tp.query() itself shouldn't require pandas.
-                         # The previous error was specifically calling as_pandas_dataframe().
-                         raise e
+            # tp.query() only takes one statement, so the session splits them
+            # (and skips modules that were already included).
+            for result in tp.results(q['sql']):
+                # Iterate to get results without pandas
+                rows = []
+                for row in result:
+                    rows.append(row)
+                    if len(rows) >= 3:
+                        break
+                
+                # For verification, just checking that it runs is enough,
+                # so only the first few rows are printed.
+                print(f"Result (first {len(rows)} rows):")
+                for r in rows:
+                    print(r)
             
             success_count += 1
             
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Per-scenario result cache for global_analysis.py.
+
+Each successful scenario result is stored in a SQLite database
+(``scenario_results.sqlite`` in the ftrace cache directory). The key is the
+trace fingerprint (see ``ftrace_cache.trace_fingerprint``) plus a hash of the
+scenario SQL after ``tp_session.normalize_sql``. On a rerun, only the
+scenarios that were edited, or that have no stored result for this trace,
+are executed. Comment or layout changes keep their entries.
+
+Entries older than ``$FTRACE_RESULT_CACHE_MAX_DAYS`` (default 30) are
+dropped. The least recently used entries are then evicted until the stored
+rows fit in ``$FTRACE_RESULT_CACHE_MAX_MB`` (default 256).
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional
+
+try:
+    from .ftrace_cache import cache_dir, trace_fingerprint
+    from .result_columns import ResultColumns
+    from .tp_session import normalize_sql
+except ImportError:
+    from ftrace_cache import cache_dir, trace_fingerprint
+    from result_columns import ResultColumns
+    from tp_session import normalize_sql
+
+RESULTS_FILE = 'scenario_results.sqlite'
+DEFAULT_MAX_DAYS = 30
+DEFAULT_MAX_MB = 256
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    fingerprint TEXT NOT NULL,
+    sql_hash TEXT NOT NULL,
+    data TEXT NOT NULL,
+    elapsed REAL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL,
+    size INTEGER NOT NULL,
+    PRIMARY KEY (fingerprint, sql_hash)
+)
+"""
+
+
+def sql_hash(sql: str) -> str:
+    return hashlib.sha1(normalize_sql(sql).encode('utf-8')).hexdigest()
+
+
+class ScenarioResultCache:
+    """``(trace fingerprint, SQL hash) -> rows`` store with age and size eviction."""
+
+    def __init__(self, trace_path: str, path: Optional[str] = None,
+                 max_age: Optional[float] = None, max_bytes: Optional[int] = None,
+                 variant: str = ''):
+        """variant separates results of the same trace analysed differently (e.g. a time window)."""
+        self.path = path or os.path.join(cache_dir(), RESULTS_FILE)
+        if max_age is None:
+            max_age = float(os.environ.get('FTRACE_RESULT_CACHE_MAX_DAYS', DEFAULT_MAX_DAYS)) * 86400
+        if max_bytes is None:
+            max_bytes = int(float(os.environ.get('FTRACE_RESULT_CACHE_MAX_MB', DEFAULT_MAX_MB)) * 1024 * 1024)
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.fingerprint = trace_fingerprint(trace_path) + (f":{variant}" if variant else "")
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.db = sqlite3.connect(self.path, timeout=30)
+        self.db.execute(_SCHEMA)
+        self.db.commit()
+
+    @staticmethod
+    def _key_sql(query: Dict[str, str]) -> str:
+        # rewrites onto shared tables return the same rows as the SQL as written
+        return query.get('original_sql', query['sql'])
+
+    def get(self, query: Dict[str, str]) -> Optional[Dict[str, Any]]:
+        """The stored result entry for the scenario, or None on a miss."""
+        key = sql_hash(self._key_sql(query))
+        row = self.db.execute("SELECT data, elapsed FROM results WHERE fingerprint = ? AND sql_hash = ?",
+                              (self.fingerprint, key)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.db.execute("UPDATE results SET accessed = ? WHERE fingerprint = ? AND sql_hash = ?",
+                        (time.time(), self.fingerprint, key))
+        self.db.commit()
+        self.hits += 1
+        return {'desc': query['desc'], 'data': ResultColumns.from_json(json.loads(row[0])), 'error': None,
+                'cached_elapsed': row[1]}
+
+    def put(self, query: Dict[str, str], result: Dict[str, Any]):
+        """Stores a successful result; errors are never cached."""
+        if result.get('error'):
+            return
+        data = result.get('data')
+        if isinstance(data, ResultColumns):
+            data = data.to_json()
+        data = json.dumps(data, ensure_ascii=False, default=str)
+        now = time.time()
+        self.db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (self.fingerprint, sql_hash(self._key_sql(query)), data,
+                         result.get('elapsed'), now, now, len(data)))
+        self.db.commit()
+
+    def split(self, queries: List[Dict[str, str]]):
+        """``(cached results, queries to run)`` for a scenario set.
+
+        Scenarios writing their full result to an evidence file always run:
+        only the sample of their rows is cached.
+        """
+        cached, missing = [], []
+        for query in queries:
+            result = None if query.get('evidence') else self.get(query)
+            if result is None:
+                missing.append(query)
+            else:
+                cached.append(result)
+        return cached, missing
+
+    def evict(self):
+        """Drops entries past ``max_age``, then LRU entries beyond ``max_bytes``."""
+        self.db.execute("DELETE FROM results WHERE created < ?", (time.time() - self.max_age,))
+        total = self.db.execute("SELECT coalesce(sum(size), 0) FROM results").fetchone()[0]
+        if total > self.max_bytes:
+            rows = self.db.execute("SELECT fingerprint, sql_hash, size FROM results ORDER BY accessed").fetchall()
+            for fingerprint, key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                self.db.execute("DELETE FROM results WHERE fingerprint = ? AND sql_hash = ?",
+                                (fingerprint, key))
+                total -= size
+        self.db.commit()
+
+    def close(self):
+        self.evict()
+        self.db.close()
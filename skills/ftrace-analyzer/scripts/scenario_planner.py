@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Shared-subexpression planning for perfetto_analysis.sql scenarios.
+
+Several scenarios start from the same relation: ``sched JOIN thread``,
+``thread_state JOIN thread`` narrowed to a few states, and the same
+``INCLUDE PERFETTO MODULE`` statements. Before the scenarios run,
+``plan_scenarios`` finds the relations used by at least two of them. Each
+one is materialized once per trace as a perfetto table
+(``CREATE PERFETTO TABLE``). Each scenario's ``FROM`` clause is then
+rewritten to read that table, and module includes are hoisted into the
+same prelude.
+
+A rewrite is only used when the prelude step it depends on succeeded.
+Every rewritten scenario keeps its original SQL under ``original_sql``
+so a failing rewrite can be retried as written.
+
+``window_scenarios`` bounds a scenario set to a time window. Every
+time-bearing relation the scenarios read (``sched``, ``thread_state``,
+``slice``, ...) is replaced by a ``ga_window_<table>`` copy holding only the
+rows that overlap the window. Intervals are kept whole, not clipped.
+"""
+import re
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set, Tuple
+
+TABLE_PREFIX = 'ga_shared_'
+WINDOW_PREFIX = 'ga_window_'
+
+# Time-bearing relations bounded by window_scenarios: table -> (module defining
+# it, whether rows are [ts, ts + dur) intervals rather than instants)
+WINDOWED_TABLES = {
+    'sched': (None, True),
+    'thread_state': (None, True),
+    'slice': (None, True),
+    'counter': (None, False),
+    'linux_hard_irqs': ('linux.irqs', True),
+    'linux_soft_irqs': ('linux.irqs', True),
+    'sched_latency_for_running_interval': ('sched.latency', True),
+    '_slice_flattened': ('slices.flat_slices', True),
+}
+
+# Words that can follow a table name but are not an alias.
+_SQL_KEYWORDS = {'WHERE', 'GROUP', 'ORDER', 'LIMIT', 'JOIN', 'LEFT', 'RIGHT', 'INNER', 'OUTER',
+                 'CROSS', 'FULL', 'NATURAL', 'ON', 'USING', 'UNION', 'EXCEPT', 'INTERSECT',
+                 'HAVING', 'WINDOW'}
+
+# Scenarios that must share a relation before it is worth materializing.
+MIN_USERS = 2
+
+_INCLUDE_PATTERN = re.compile(r'^\s*INCLUDE\s+PERFETTO\s+MODULE\s+([\w.]+)\s*;?\s*$',
+                              re.IGNORECASE | re.MULTILINE)
+_CLAUSE_END = re.compile(r'\b(?:GROUP\s+BY|ORDER\s+BY|LIMIT|HAVING|WINDOW|UNION)\b|;',
+                         re.IGNORECASE)
+_STATE_TERM = re.compile(r"^(?:\w+\.)?state\s*=\s*'([^']*)'$", re.IGNORECASE)
+
+
+@dataclass
+class SharedRelation:
+    """``FROM <base> <alias> JOIN thread <alias> USING (utid)`` materialized as one table."""
+    name: str
+    base: str
+    base_columns: List[str]
+    thread_columns: List[str]
+    # Narrow the table to the union of the states the users filter on.
+    by_state: bool = False
+
+    @property
+    def table(self) -> str:
+        return TABLE_PREFIX + self.name
+
+    @property
+    def pattern(self):
+        # the base may already be bounded to a time window by window_scenarios
+        return re.compile(r'\bFROM\s+((?:%s)?%s)\s+(?:AS\s+)?(\w+)\s+(?:INNER\s+)?JOIN\s+thread\s+'
+                          r'(?:AS\s+)?(\w+)\s+USING\s*\(\s*utid\s*\)' % (WINDOW_PREFIX, self.base),
+                          re.IGNORECASE)
+
+    def create_sql(self, source: str, states: Optional[Set[str]] = None) -> str:
+        columns = [f"b.{c}" for c in self.base_columns] + [f"t.{c}" for c in self.thread_columns]
+        sql = (f"CREATE PERFETTO TABLE {self.table} AS\n"
+               f"SELECT {', '.join(columns)}\n"
+               f"FROM {source} b\nJOIN thread t USING (utid)")
+        if states is not None:
+            sql += "\nWHERE b.state IN (%s)" % ', '.join(f"'{s}'" for s in sorted(states))
+        return sql
+
+    def rewrite(self, sql: str) -> Optional[str]:
+        """The scenario reading the shared table, or None if it does not use the relation."""
+        match = self.pattern.search(sql)
+        if not match:
+            return None
+        base_alias, thread_alias = match.group(2), match.group(3)
+        rest = sql[match.end():]
+        # every column taken from either side must exist in the shared table
+        available = set(self.base_columns) | set(self.thread_columns) | {'utid'}
+        for alias in (base_alias, thread_alias):
+            for column in re.findall(r'\b%s\.(\w+)' % re.escape(alias), sql):
+                if column not in available:
+                    return None
+        rest = re.sub(r'\b%s\.' % re.escape(thread_alias), f'{base_alias}.', rest)
+        head = re.sub(r'\b%s\.' % re.escape(thread_alias), f'{base_alias}.', sql[:match.start()])
+        return f"{head}FROM {self.table} {base_alias}{rest}"
+
+
+SHARED_RELATIONS = [
+    SharedRelation('sched_thread', 'sched',
+                   ['id', 'ts', 'dur', 'cpu', 'utid', 'end_state', 'priority'],
+                   ['tid', 'name', 'upid', 'is_main_thread']),
+    SharedRelation('thread_state_thread', 'thread_state',
+                   ['id', 'ts', 'dur', 'cpu', 'utid', 'state', 'io_wait', 'blocked_function',
+                    'waker_utid'],
+                   ['tid', 'name', 'upid', 'is_main_thread'],
+                   by_state=True),
+]
+
+
+def _top_level_split(text: str, keyword: str) -> List[str]:
+    """Splits on ``keyword`` outside parentheses."""
+    parts, depth, start = [], 0, 0
+    token = re.compile(r"\(|\)|'[^']*'|\b%s\b" % keyword, re.IGNORECASE)
+    for m in token.finditer(text):
+        if m.group() == '(':
+            depth += 1
+        elif m.group() == ')':
+            depth -= 1
+        elif m.group()[0] != "'" and depth == 0:
+            parts.append(text[start:m.start()])
+            start = m.end()
+    parts.append(text[start:])
+    return [p.strip() for p in parts]
+
+
+def _unwrap(text: str) -> str:
+    while text.startswith('(') and text.endswith(')') and _balanced(text[1:-1]):
+        text = text[1:-1].strip()
+    return text
+
+
+def _balanced(text: str) -> bool:
+    depth = 0
+    for ch in text:
+        depth += ch == '('
+        depth -= ch == ')'
+        if depth < 0:
+            return False
+    return depth == 0
+
+
+def required_states(sql: str, relation: SharedRelation) -> Optional[Set[str]]:
+    """States a scenario's WHERE clause restricts the relation to, or None if unrestricted.
+
+    Only a top-level ``AND`` conjunct made entirely of ``state = '<x>'`` terms
+    joined by ``OR`` counts as a restriction.
+    """
+    match = relation.pattern.search(sql)
+    where = re.search(r'\bWHERE\b', sql[match.end():], re.IGNORECASE) if match else None
+    if not where:
+        return None
+    clause = sql[match.end() + where.end():]
+    end = _CLAUSE_END.search(clause)
+    clause = clause[:end.start()] if end else clause
+    for conjunct in _top_level_split(clause, 'AND'):
+        states = set()
+        for term in _top_level_split(_unwrap(conjunct), 'OR'):
+            term_match = _STATE_TERM.match(_unwrap(term))
+            if not term_match:
+                break
+            states.add(term_match.group(1))
+        else:
+            return states
+    return None
+
+
+@dataclass
+class PlanStep:
+    """One prelude step and the scenarios (by index) whose rewrite depends on it."""
+    name: str
+    statements: List[str]
+    users: List[int]
+
+
+@dataclass
+class ScenarioPlan:
+    steps: List[PlanStep]
+    # scenario index -> names of the steps its rewrite needs, and the rewritten SQL
+    rewrites: Dict[int, Tuple[Set[str], str]]
+
+    def apply(self, queries: List[Dict[str, str]], available: Set[str]) -> List[Dict[str, str]]:
+        """Queries with the rewrites whose steps are all in ``available``."""
+        planned = []
+        for i, query in enumerate(queries):
+            needs, sql = self.rewrites.get(i, (set(), None))
+            if sql is not None and needs <= available:
+                query = dict(query, sql=sql, original_sql=query['sql'])
+            planned.append(query)
+        return planned
+
+
+def plan_scenarios(queries: List[Dict[str, str]], min_users: int = MIN_USERS) -> ScenarioPlan:
+    """Finds the shared relations and module includes of the scenarios."""
+    steps = []
+    sqls = [q['sql'] for q in queries]
+    needs: Dict[int, Set[str]] = {i: set() for i in range(len(queries))}
+
+    for relation in SHARED_RELATIONS:
+        users = {}
+        for i, sql in enumerate(sqls):
+            rewritten = relation.rewrite(sql)
+            if rewritten is not None:
+                users[i] = rewritten
+        if len(users) < min_users:
+            continue
+        states = None
+        if relation.by_state:
+            states = set()
+            for i in users:
+                restricted = required_states(sqls[i], relation)
+                if restricted is None:
+                    states = None
+                    break
+                states |= restricted
+        source = relation.pattern.search(sqls[min(users)]).group(1)
+        steps.append(PlanStep(relation.table, [relation.create_sql(source, states)], sorted(users)))
+        for i, rewritten in users.items():
+            sqls[i] = rewritten
+            needs[i].add(relation.table)
+
+    # module includes are global to the trace processor: run each one once up front
+    modules: Dict[str, List[int]] = {}
+    for i, sql in enumerate(sqls):
+        for module in _INCLUDE_PATTERN.findall(sql):
+            modules.setdefault(module, []).append(i)
+    includes = []
+    for module, users in modules.items():
+        name = f"module {module}"
+        includes.append(PlanStep(name, [f"INCLUDE PERFETTO MODULE {module}"], users))
+        for i in users:
+            sqls[i] = _INCLUDE_PATTERN.sub(
+                lambda m: '' if m.group(1) == module else m.group(0), sqls[i]).strip()
+            needs[i].add(name)
+
+    rewrites = {i: (needs[i], sqls[i]) for i in range(len(queries)) if needs[i]}
+    return ScenarioPlan(includes + steps, rewrites)
+
+
+def window_scenarios(queries: List[Dict[str, str]], start_ns: int,
+                     end_ns: int) -> Tuple[List[Dict[str, str]], List[PlanStep]]:
+    """Bounds the scenarios to ``[start_ns, end_ns]``.
+
+    Returns the rewritten queries and the prelude steps creating the windowed
+    tables they read; the steps must run before any of the queries.
+    """
+    pattern = re.compile(r'\b(FROM|JOIN)\s+(%s)\b(?!\.)(?:\s+(?:AS\s+)?(\w+))?'
+                         % '|'.join(map(re.escape, WINDOWED_TABLES)), re.IGNORECASE)
+    users: Dict[str, List[int]] = {}
+
+    def bound(i, m):
+        table = m.group(2).lower()
+        if i not in users.setdefault(table, []):
+            users[table].append(i)
+        alias = m.group(3)
+        tail = m.group(0)[m.end(2) - m.start():]
+        if alias is None or alias.upper() in _SQL_KEYWORDS:
+            # alias the copy by the table's own name so `table.column` still resolves
+            return f"{m.group(1)} {WINDOW_PREFIX}{table} {table}{tail}"
+        return f"{m.group(1)} {WINDOW_PREFIX}{table}{tail}"
+
+    windowed = [dict(q, sql=pattern.sub(lambda m, i=i: bound(i, m), q['sql']))
+                for i, q in enumerate(queries)]
+    steps = []
+    for table, table_users in users.items():
+        module, intervals = WINDOWED_TABLES[table]
+        if intervals:
+            # unfinished intervals have dur = -1
+            where = f"ts <= {end_ns} AND (ts + dur >= {start_ns} OR dur < 0)"
+        else:
+            where = f"ts BETWEEN {start_ns} AND {end_ns}"
+        statements = [f"INCLUDE PERFETTO MODULE {module}"] if module else []
+        statements.append(f"CREATE PERFETTO TABLE {WINDOW_PREFIX}{table} AS\n"
+                          f"SELECT * FROM {table} WHERE {where}")
+        steps.append(PlanStep(WINDOW_PREFIX + table, statements, table_users))
+    return windowed, steps
+
+
+def materialize(tp, plan: ScenarioPlan) -> List[Dict]:
+    """Runs the plan's prelude on ``tp``.
+
+    Returns one ``{'name', 'users', 'seconds', 'error'}`` entry per step; the
+    names of the steps without an error are what ``ScenarioPlan.apply`` accepts.
+    """
+    stats = []
+    for step in plan.steps:
+        started = time.perf_counter()
+        error = None
+        try:
+            for stmt in step.statements:
+                tp.query(stmt)
+        except Exception as e:
+            error = str(e)
+        stats.append({'name': step.name, 'users': step.users,
+                      'seconds': time.perf_counter() - started, 'error': error})
+    return stats
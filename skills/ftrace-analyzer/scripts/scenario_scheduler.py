@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Cost-aware scheduling of perfetto_analysis.sql scenarios.
+
+Every run records how long each scenario took on a trace of a given size
+(``scenario_timings.json`` in the ftrace cache directory). The next run
+estimates each scenario's cost on the new trace from the recorded sample with
+the closest trace size, scaled linearly by size, and submits the scenarios
+longest-first to a shared queue that idle workers pull from (longest
+processing time first list scheduling).
+
+Scenarios are identified by a hash of their SQL, so editing a query starts
+its history afresh. Scenarios without history are treated as the most
+expensive ones so that they run early and get measured.
+"""
+import hashlib
+import json
+import math
+import os
+import tempfile
+from typing import Dict, List, Optional
+
+try:
+    from .ftrace_cache import cache_dir
+except ImportError:
+    from ftrace_cache import cache_dir
+
+TIMINGS_FILE = 'scenario_timings.json'
+TIMINGS_VERSION = 1
+
+# Samples kept per scenario (most recent last).
+MAX_SAMPLES = 8
+
+
+def scenario_key(query: Dict[str, str]) -> str:
+    # a scenario rewritten by the planner keeps the history of its SQL as written
+    sql = query.get('original_sql', query['sql'])
+    return hashlib.sha1(sql.encode('utf-8')).hexdigest()[:16]
+
+
+class ScenarioTimings:
+    """Measured scenario runtimes, keyed by scenario, as ``[trace_size, seconds]`` samples."""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.path.join(cache_dir(), TIMINGS_FILE)
+        self.scenarios: Dict[str, Dict] = {}
+
+    @classmethod
+    def load(cls, path: Optional[str] = None) -> 'ScenarioTimings':
+        timings = cls(path)
+        try:
+            with open(timings.path) as f:
+                data = json.load(f)
+            if data.get('version') == TIMINGS_VERSION:
+                timings.scenarios = data.get('scenarios', {})
+        except (OSError, ValueError):
+            pass
+        return timings
+
+    def save(self):
+        """Writes the history atomically; failures only cost the history."""
+        directory = os.path.dirname(self.path)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=directory)
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'version': TIMINGS_VERSION, 'scenarios': self.scenarios}, f)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass
+
+    def record(self, query: Dict[str, str], trace_size: int, seconds: float):
+        entry = self.scenarios.setdefault(scenario_key(query), {'desc': query['desc'], 'samples': []})
+        entry['desc'] = query['desc']
+        entry['samples'] = (entry['samples'] + [[trace_size, seconds]])[-MAX_SAMPLES:]
+
+    def estimate(self, query: Dict[str, str], trace_size: int) -> Optional[float]:
+        """Estimated seconds on a trace of ``trace_size`` bytes, or None without history."""
+        entry = self.scenarios.get(scenario_key(query))
+        if not entry or not entry['samples']:
+            return None
+        size = max(trace_size, 1)
+        sample_size, seconds = min(entry['samples'],
+                                   key=lambda s: abs(math.log(max(s[0], 1) / size)))
+        return seconds * size / max(sample_size, 1)
+
+    def longest_first(self, queries: List[Dict[str, str]], trace_size: int) -> List[Dict[str, str]]:
+        """Queries ordered by decreasing estimated cost; each gets an ``estimate`` key.
+
+        Unknown scenarios sort first; ties keep file order.
+        """
+        estimates = [self.estimate(q, trace_size) for q in queries]
+        ordered = sorted(range(len(queries)),
+                         key=lambda i: (estimates[i] is not None, -(estimates[i] or 0.0)))
+        return [dict(queries[i], estimate=estimates[i]) for i in ordered]
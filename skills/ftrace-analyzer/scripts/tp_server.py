@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Shared trace_processor server.
+
+Loads a trace once into a single long-lived ``trace_processor_shell`` running
+in HTTP RPC mode on localhost; any number of worker processes then attach to
+it with ``TraceProcessor(addr=server.addr)`` instead of each ingesting the
+trace on its own. The server records how long the ingest took and, on Linux,
+its peak resident memory (``VmHWM``).
+"""
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Optional
+
+# Upper bound for loading the trace before the server is given up on.
+DEFAULT_LOAD_TIMEOUT = 30 * 60
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _format_bytes(size: Optional[int]) -> str:
+    if size is None:
+        return "n/a"
+    if size < 1024:
+        return f"{size} B"
+    for unit in ('KB', 'MB', 'GB'):
+        size /= 1024
+        if size < 1024 or unit == 'GB':
+            return f"{size:.1f} {unit}"
+
+
+class TraceProcessorServer:
+    """A trace_processor_shell serving one trace over HTTP on 127.0.0.1."""
+
+    def __init__(self, trace_path: str, tp_bin: str, port: Optional[int] = None,
+                 load_timeout: float = DEFAULT_LOAD_TIMEOUT):
+        self.trace_path = trace_path
+        self.tp_bin = tp_bin
+        self.port = port
+        self.load_timeout = load_timeout
+        self.process: Optional[subprocess.Popen] = None
+        self.ingest_seconds: Optional[float] = None
+        self._peak_rss: Optional[int] = None
+        self._stderr = None
+
+    @property
+    def addr(self) -> str:
+        return f"127.0.0.1:{self.port}"
+
+    def _command(self):
+        # The bundled trace_processor is the amalgamated Python launcher that
+        # downloads and execs the native shell, so it keeps the same pid.
+        cmd = [self.tp_bin] if os.access(self.tp_bin, os.X_OK) else [sys.executable, self.tp_bin]
+        return cmd + ['-D', '--http-port', str(self.port), self.trace_path]
+
+    def start(self) -> 'TraceProcessorServer':
+        """Starts the server and blocks until the trace is loaded and it accepts connections."""
+        if self.port is None:
+            self.port = _free_port()
+        started = time.perf_counter()
+        # stderr goes to a file: trace_processor logs ingest progress there and
+        # an undrained pipe would eventually block it
+        self._stderr = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(self._command(), stdout=subprocess.DEVNULL,
+                                        stderr=self._stderr)
+        deadline = started + self.load_timeout
+        while True:
+            returncode = self.process.poll()
+            if returncode is not None:
+                self._stderr.seek(0)
+                err = self._stderr.read().decode('utf-8', 'replace').strip()
+                self._stderr.close()
+                self.process = None
+                raise RuntimeError(f"trace_processor exited with code {returncode}"
+                                   + (f": {err.splitlines()[-1]}" if err else ""))
+            try:
+                with socket.create_connection(('127.0.0.1', self.port), timeout=1):
+                    break
+            except OSError:
+                pass
+            if time.perf_counter() > deadline:
+                self.stop()
+                raise TimeoutError(f"trace_processor did not come up within {self.load_timeout:.0f}s")
+            time.sleep(0.1)
+        self.ingest_seconds = time.perf_counter() - started
+        return self
+
+    def _status_bytes(self, field: str) -> Optional[int]:
+        """A memory field of /proc/<pid>/status in bytes (None if not running or unavailable)."""
+        if self.process is None or self.process.poll() is not None:
+            return None
+        try:
+            with open(f"/proc/{self.process.pid}/status") as f:
+                for line in f:
+                    if line.startswith(field + ':'):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return None
+
+    def peak_rss(self) -> Optional[int]:
+        """Peak resident memory of the server in bytes (None where /proc is unavailable)."""
+        peak = self._status_bytes('VmHWM')
+        if peak is not None:
+            self._peak_rss = peak
+        return self._peak_rss
+
+    def rss(self) -> Optional[int]:
+        """Current resident memory of the server in bytes."""
+        return self._status_bytes('VmRSS')
+
+    def stats(self) -> dict:
+        """Ingest figures for the report header."""
+        return {
+            'mode': f'shared trace_processor server ({self.addr})',
+            'ingest_seconds': self.ingest_seconds,
+            'peak_rss': self.peak_rss(),
+        }
+
+    def stop(self):
+        if self.process is None:
+            return
+        self.peak_rss()
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self._stderr.close()
+        self.process = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+
+def format_ingest(stats: dict) -> str:
+    """One-line summary of ``TraceProcessorServer.stats()``."""
+    seconds = stats.get('ingest_seconds')
+    return (f"{seconds:.2f}s" if seconds is not None else "n/a") + \
+        f", peak RSS {_format_bytes(stats.get('peak_rss'))} ({stats.get('mode')})"
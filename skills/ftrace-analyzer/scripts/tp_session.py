@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Statement-level session on top of a ``TraceProcessor``.
+
+``TraceProcessor.query()`` takes one statement at a time, while scenario and
+ad-hoc SQL usually holds several (``INCLUDE PERFETTO MODULE ...;`` followed by
+a ``SELECT``). ``split_statements`` splits such text on the semicolons that
+end a statement; semicolons inside string literals, quoted identifiers and
+comments are left alone. The session runs each statement and remembers which
+stdlib modules the trace processor has already included, so a repeated
+``INCLUDE`` is skipped instead of being sent again. ``prewarm`` includes every
+module a set of scenarios needs up front, so the include cost is not charged
+to whichever scenario happens to run first.
+"""
+import re
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set
+
+_TOKEN = re.compile(r"""
+      '(?:[^']|'')*'?           # string literal, '' escapes a quote
+    | "(?:[^"]|"")*"?           # quoted identifier
+    | `[^`]*`?
+    | \[[^\]]*\]?
+    | --[^\n]*                  # line comment
+    | /\*.*?(?:\*/|\Z)          # block comment
+    | ;
+    | [^'"`\[;/-]+
+    | .
+""", re.VERBOSE | re.DOTALL)
+
+_INCLUDE = re.compile(r'^INCLUDE\s+PERFETTO\s+MODULE\s+([\w.]+)$', re.IGNORECASE)
+_ROW_STATEMENT = re.compile(r'^(?:SELECT|WITH|VALUES)\b', re.IGNORECASE)
+
+
+def split_statements(sql: str) -> List[str]:
+    """The non-empty statements of ``sql``, with comments removed."""
+    statements = []
+    current = []
+    for m in _TOKEN.finditer(sql):
+        token = m.group()
+        if token == ';':
+            statements.append(''.join(current).strip())
+            current = []
+        elif token.startswith('--'):
+            continue
+        elif token.startswith('/*'):
+            current.append(' ')
+        else:
+            current.append(token)
+    statements.append(''.join(current).strip())
+    return [s for s in statements if s]
+
+
+def normalize_sql(sql: str) -> str:
+    """``sql`` without comments, with whitespace outside literals collapsed.
+
+    Two texts that differ only in comments, layout or trailing semicolons
+    normalize to the same string.
+    """
+    statements = []
+    for stmt in split_statements(sql):
+        tokens = []
+        for m in _TOKEN.finditer(stmt):
+            token = m.group()
+            if token[0] in "'\"`[":
+                tokens.append(token)
+            else:
+                tokens.append(re.sub(r'\s+', ' ', token))
+        statements.append(''.join(tokens))
+    return ';\n'.join(statements)
+
+
+def limit_sql(sql: str, max_rows: int) -> str:
+    """``sql`` with its last statement wrapped in ``LIMIT max_rows`` if it returns rows.
+
+    The limit is applied by trace_processor, so rows beyond it are never
+    materialized or sent to the client.
+    """
+    statements = split_statements(sql)
+    if not statements or not _ROW_STATEMENT.match(statements[-1]):
+        return sql
+    statements[-1] = f"SELECT * FROM ({statements[-1]}) LIMIT {int(max_rows)}"
+    return ';\n'.join(statements)
+
+
+def result_rows(result) -> Iterator[Dict[str, Any]]:
+    """The rows of a query result as dicts without private fields, one at a time."""
+    for row in result:
+        try:
+            yield {k: v for k, v in row.__dict__.items() if not k.startswith('_')}
+        except AttributeError:
+            yield {'result': str(row)}
+
+
+def include_module(statement: str) -> Optional[str]:
+    """The module an ``INCLUDE PERFETTO MODULE`` statement loads, else None."""
+    m = _INCLUDE.match(statement)
+    return m.group(1) if m else None
+
+
+def required_modules(sqls: Iterable[str]) -> List[str]:
+    """Modules included by any of ``sqls``, in first-use order."""
+    modules = []
+    for sql in sqls:
+        for stmt in split_statements(sql):
+            module = include_module(stmt)
+            if module and module not in modules:
+                modules.append(module)
+    return modules
+
+
+class TraceProcessorSession:
+    """Wraps a ``TraceProcessor`` and deduplicates module includes.
+
+    ``loaded`` names modules already included by another client of the same
+    trace processor (e.g. the process that prepared a shared server).
+    """
+
+    def __init__(self, tp, loaded: Iterable[str] = ()):
+        self.tp = tp
+        self.modules: Set[str] = set(loaded)
+        self.skipped_includes = 0
+        self.include_seconds = 0.0
+
+    def include(self, module: str):
+        if module in self.modules:
+            self.skipped_includes += 1
+            return
+        started = time.perf_counter()
+        self.tp.query(f"INCLUDE PERFETTO MODULE {module}")
+        self.include_seconds += time.perf_counter() - started
+        self.modules.add(module)
+
+    def prewarm(self, modules: Iterable[str]) -> float:
+        """Includes ``modules`` ahead of time; returns the seconds spent."""
+        before = self.include_seconds
+        for module in modules:
+            self.include(module)
+        return self.include_seconds - before
+
+    def query(self, statement: str):
+        """Runs a single statement; an include returns None."""
+        module = include_module(statement)
+        if module:
+            self.include(module)
+            return None
+        return self.tp.query(statement)
+
+    def results(self, sql: str) -> Iterator:
+        """Runs every statement of ``sql`` in order, yielding each non-include result."""
+        for stmt in split_statements(sql):
+            result = self.query(stmt)
+            if result is not None:
+                yield result
+
+    def execute(self, sql: str):
+        """Runs every statement of ``sql``; returns the result of the last non-include one."""
+        last = None
+        for last in self.results(sql):
+            pass
+        return last
+
+    def close(self):
+        self.tp.close()
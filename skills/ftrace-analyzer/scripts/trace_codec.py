@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Compressed trace files (``.gz`` / ``.zst``) for the ftrace tooling.
+
+Input compression is recognised from the magic bytes, so a renamed file
+still works. gzip uses the standard library. zstd needs the optional
+``zstandard`` package (``pip install zstandard``); without it, zstd traces
+are rejected with an error that says so.
+
+- ``iter_decompressed`` streams the decompressed bytes. A background thread
+  decompresses a few blocks ahead of the consumer. zlib and zstd release the
+  GIL while they inflate, so disk I/O, decompression and parsing overlap.
+  ``TraceReader`` reads compressed traces this way.
+- ``load_decompressed`` returns a plain copy of the trace for consumers that
+  need a seekable file, such as trace_processor and the block index. The
+  copy is written once and kept under ``decompressed/`` in the ftrace cache
+  directory, within an LRU disk budget of ``$FTRACE_DECOMPRESS_CACHE_MAX_MB``
+  (default 16384).
+- ``open_output`` writes a text file, compressed when the name ends in
+  ``.gz`` or ``.zst``. Compression runs in a background thread; zstd also
+  uses one worker thread per core.
+"""
+import gzip
+import io
+import os
+import queue
+import tempfile
+import threading
+from typing import Iterator, Optional, TextIO, Tuple
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    from .ftrace_cache import TraceCache, cache_dir, cache_enabled
+except ImportError:
+    from ftrace_cache import TraceCache, cache_dir, cache_enabled
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+# Codec of an output file, by its suffix.
+OUTPUT_SUFFIXES = {'.gz': 'gzip', '.zst': 'zstd'}
+
+# Decompressed bytes per block handed from the background thread.
+BLOCK_SIZE = 1024 * 1024
+
+# Blocks the background thread may decompress ahead of the consumer.
+READ_AHEAD = 8
+
+DECOMPRESSED_SUFFIX = '.trace'
+DEFAULT_MAX_MB = 16384
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def compression(path: str) -> Optional[str]:
+    """``'gzip'``, ``'zstd'`` or None (uncompressed), from the file's magic bytes."""
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(4)
+    except OSError:
+        return None
+    if head.startswith(GZIP_MAGIC):
+        return 'gzip'
+    if head.startswith(ZSTD_MAGIC):
+        return 'zstd'
+    return None
+
+
+def output_compression(path: str) -> Optional[str]:
+    """Codec to write ``path`` with, from its suffix."""
+    return OUTPUT_SUFFIXES.get(os.path.splitext(path)[1].lower())
+
+
+def _require_zstd():
+    if zstandard is None:
+        raise RuntimeError("zstd compressed traces need the 'zstandard' module: pip install zstandard")
+
+
+def open_decompressed(path: str):
+    """A binary file object reading the decompressed contents of ``path``."""
+    codec = compression(path)
+    if codec == 'gzip':
+        return gzip.open(path, 'rb')
+    if codec == 'zstd':
+        _require_zstd()
+        # traces written by pzstd or in several sessions hold several frames
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), read_across_frames=True,
+                                                           closefd=True)
+    return open(path, 'rb')
+
+
+def _put(blocks: queue.Queue, item, stop: threading.Event) -> bool:
+    """Queues ``item`` unless the consumer went away; False when it did."""
+    while not stop.is_set():
+        try:
+            blocks.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def iter_decompressed(path: str, block_size: int = BLOCK_SIZE,
+                      read_ahead: int = READ_AHEAD) -> Iterator[bytes]:
+    """Yields the decompressed contents of ``path`` in blocks.
+
+    A background thread reads and decompresses up to ``read_ahead`` blocks
+    ahead. Errors in the thread are raised in the consumer. Closing the
+    generator early stops the thread.
+    """
+    blocks = queue.Queue(read_ahead)
+    stop = threading.Event()
+
+    def produce():
+        try:
+            with open_decompressed(path) as f:
+                while True:
+                    block = f.read(block_size)
+                    if not block or not _put(blocks, block, stop):
+                        break
+            _put(blocks, None, stop)
+        except BaseException as e:
+            _put(blocks, e, stop)
+
+    thread = threading.Thread(target=produce, name='trace-decompress', daemon=True)
+    thread.start()
+    try:
+        while True:
+            block = blocks.get()
+            if block is None:
+                return
+            if isinstance(block, BaseException):
+                raise block
+            yield block
+    finally:
+        stop.set()
+
+
+class BackgroundWriter(io.RawIOBase):
+    """Hands written bytes to a thread that feeds a (compressing) binary file."""
+
+    def __init__(self, target, name: str, depth: int = READ_AHEAD):
+        super().__init__()
+        self.name = name
+        self._target = target
+        self._blocks = queue.Queue(depth)
+        self._error = None
+        self._thread = threading.Thread(target=self._drain, name='trace-compress', daemon=True)
+        self._thread.start()
+
+    def _drain(self):
+        try:
+            while True:
+                block = self._blocks.get()
+                if block is None:
+                    break
+                if self._error is None:
+                    self._target.write(block)
+        except BaseException as e:
+            self._error = e
+            # keep consuming so that writers never block on a full queue
+            while self._blocks.get() is not None:
+                pass
+
+    def _check(self):
+        if self._error is not None:
+            raise self._error
+
+    def writable(self):
+        return True
+
+    def write(self, b) -> int:
+        self._check()
+        # the caller may reuse its buffer once write() returns
+        data = bytes(b)
+        self._blocks.put(data)
+        return len(data)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self._blocks.put(None)
+            self._thread.join()
+            self._target.close()
+        finally:
+            super().close()
+        self._check()
+
+
+def open_output(path: str, encoding: str = 'utf-8', buffering: int = 8 * 1024 * 1024) -> TextIO:
+    """Opens ``path`` for writing text, compressed if it ends in .gz or .zst."""
+    codec = output_compression(path)
+    if codec is None:
+        return open(path, 'w', encoding=encoding, buffering=buffering)
+    if codec == 'gzip':
+        target = gzip.open(path, 'wb', compresslevel=GZIP_LEVEL)
+    else:
+        _require_zstd()
+        target = zstandard.ZstdCompressor(level=ZSTD_LEVEL, threads=-1).stream_writer(
+            open(path, 'wb'), closefd=True, write_return_read=True)
+    return io.TextIOWrapper(io.BufferedWriter(BackgroundWriter(target, path), buffering), encoding=encoding)
+
+
+def decompress_to(trace_path: str, out_path: str) -> int:
+    """Writes the decompressed trace to ``out_path``; returns its size in bytes."""
+    size = 0
+    with open(out_path, 'wb') as out:
+        for block in iter_decompressed(trace_path):
+            out.write(block)
+            size += len(block)
+    return size
+
+
+class DecompressedCache(TraceCache):
+    """``<fingerprint>-decompressed.trace`` files under ``decompressed/`` with an LRU disk budget."""
+    suffix = DECOMPRESSED_SUFFIX
+
+    def __init__(self, directory: Optional[str] = None, max_bytes: Optional[int] = None):
+        if max_bytes is None:
+            max_bytes = int(float(os.environ.get('FTRACE_DECOMPRESS_CACHE_MAX_MB', DEFAULT_MAX_MB)) * 1024 * 1024)
+        super().__init__(directory or os.path.join(cache_dir(), 'decompressed'), max_bytes)
+
+    def get(self, trace_path: str) -> str:
+        """Path of the decompressed copy, written (and the cache evicted) on a miss."""
+        entry = self.entry_path(trace_path, 'decompressed')
+        if os.path.exists(entry):
+            try:
+                os.utime(entry)
+            except OSError:
+                pass
+            self.hits += 1
+            return entry
+        self.misses += 1
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        os.close(fd)
+        try:
+            decompress_to(trace_path, tmp_path)
+            os.replace(tmp_path, entry)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.evict(keep=entry)
+        return entry
+
+
+def load_decompressed(trace_path: str) -> Tuple[str, bool]:
+    """A seekable, uncompressed file with the trace's contents: ``(path, temporary)``.
+
+    Uncompressed traces are returned as they are. Compressed ones come from
+    the decompression cache; with caching disabled (``FTRACE_CACHE=0``) they
+    are written to a temporary file that the caller removes when
+    ``temporary`` is True.
+    """
+    if compression(trace_path) is None:
+        return trace_path, False
+    if cache_enabled():
+        return DecompressedCache().get(trace_path), False
+    fd, out_path = tempfile.mkstemp(prefix='trace-', suffix=DECOMPRESSED_SUFFIX)
+    os.close(fd)
+    try:
+        decompress_to(trace_path, out_path)
+    except BaseException:
+        os.remove(out_path)
+        raise
+    return out_path, True
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+Pre-ingest trimming of ftrace text traces.
+
+trace_processor spends most of its time ingesting multi-GB ``trace.log``
+files, even when an investigation only looks at a time window, a few CPUs
+or the scheduling events. A ``ShardSpec`` describes such a subset: a time
+window, a CPU set and an event-type allowlist of ``fnmatch`` patterns such
+as ``sched_*``. ``write_shards`` streams the trace once and writes one
+trimmed ftrace text file per spec. The file header is kept, and lines
+following an event (stack traces and the like) stay with their event. With
+a time window, only the ``TraceFile`` index blocks that overlap a window
+are read.
+
+Shards are cached per trace in ``shards/`` under the ftrace cache
+directory, with the same fingerprinting and LRU budget as ``TraceCache``
+(``$FTRACE_SHARD_CACHE_MAX_MB``, default 4096). A repeated investigation
+therefore loads its shard without rescanning the trace.
+
+    python trace_shards.py trace.log --window 7541.2 7541.6 --events 'sched_*,irq_*'
+"""
+import argparse
+import fnmatch
+import hashlib
+import os
+import re
+import sys
+import tempfile
+from dataclasses import dataclass
+from typing import FrozenSet, List, Optional, Sequence, Tuple
+
+try:
+    from .ftrace_cache import TraceCache, cache_dir, cache_enabled
+    from .ftrace_file import BLOCK_SIZE, TraceFile
+    from .ftrace_reader import TraceReader
+except ImportError:
+    from ftrace_cache import TraceCache, cache_dir, cache_enabled
+    from ftrace_file import BLOCK_SIZE, TraceFile
+    from ftrace_reader import TraceReader
+
+SHARD_SUFFIX = '.shard'
+DEFAULT_MAX_MB = 4096
+
+# Start of every event line: cpu, timestamp, event name.
+_EVENT_HEAD = re.compile(
+    rb'^[ \t]*.*?-\d+[ \t]+(?:\([ \t]*[\d-]+\)[ \t]+)?\[(\d+)\][ \t]+'
+    rb'(?:\S{4,5}[ \t]+)?(\d+\.\d+):[ \t]+(\w+):',
+    re.M
+)
+
+
+def parse_cpu_list(text: str) -> FrozenSet[int]:
+    """``"0-3,6"`` -> {0, 1, 2, 3, 6}."""
+    cpus = set()
+    for part in text.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-', 1)
+            cpus.update(range(int(first), int(last) + 1))
+        else:
+            cpus.add(int(part))
+    return frozenset(cpus)
+
+
+def parse_event_list(text: str) -> Tuple[str, ...]:
+    """``"sched_*, irq_*"`` -> ('irq_*', 'sched_*')."""
+    return tuple(sorted({p.strip() for p in text.split(',') if p.strip()}))
+
+
+@dataclass(frozen=True)
+class ShardSpec:
+    """Subset of a trace: [start, end] in seconds, CPUs and event-name patterns (None = all)."""
+    start: Optional[float] = None
+    end: Optional[float] = None
+    cpus: Optional[FrozenSet[int]] = None
+    events: Optional[Tuple[str, ...]] = None
+
+    @property
+    def is_full(self) -> bool:
+        return self.start is None and self.end is None and self.cpus is None and self.events is None
+
+    @property
+    def key(self) -> str:
+        text = (f"{self.start!r}|{self.end!r}|{sorted(self.cpus) if self.cpus is not None else None}"
+                f"|{list(self.events) if self.events is not None else None}")
+        return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+    def describe(self) -> str:
+        parts = []
+        if self.start is not None or self.end is not None:
+            start, end = (round(t, 9) if t is not None else '-' for t in (self.start, self.end))
+            parts.append(f"time {start} - {end} s")
+        if self.cpus is not None:
+            parts.append(f"CPUs {','.join(map(str, sorted(self.cpus)))}")
+        if self.events is not None:
+            parts.append(f"events {','.join(self.events)}")
+        return ', '.join(parts) or 'full trace'
+
+    def accepts_block(self, ts_min: float, ts_max: float) -> bool:
+        return not ((self.end is not None and ts_min > self.end) or
+                    (self.start is not None and ts_max < self.start))
+
+    def time_only_within(self, ts_min: float, ts_max: float) -> bool:
+        """True when every event of a block passes, so it can be copied as is."""
+        return (self.cpus is None and self.events is None and
+                (self.start is None or ts_min >= self.start) and
+                (self.end is None or ts_max <= self.end))
+
+
+class _ShardWriter:
+    def __init__(self, spec: ShardSpec, out):
+        self.spec = spec
+        self.out = out
+        self.written = 0
+        self.keep = True
+        self._events = {}
+
+    def _event_ok(self, event: bytes) -> bool:
+        ok = self._events.get(event)
+        if ok is None:
+            name = event.decode('ascii', 'replace')
+            ok = self._events[event] = any(fnmatch.fnmatchcase(name, p) for p in self.spec.events)
+        return ok
+
+    def write(self, data):
+        self.out.write(data)
+        self.written += len(data)
+
+    def filter_chunk(self, chunk: bytes, heads: List[re.Match]):
+        spec = self.spec
+        pos = 0
+        for m in heads:
+            if self.keep and m.start() > pos:
+                self.write(chunk[pos:m.start()])
+            ts = float(m.group(2))
+            self.keep = ((spec.start is None or ts >= spec.start) and
+                         (spec.end is None or ts <= spec.end) and
+                         (spec.cpus is None or int(m.group(1)) in spec.cpus) and
+                         (spec.events is None or self._event_ok(m.group(3))))
+            pos = m.start()
+        if self.keep and pos < len(chunk):
+            self.write(chunk[pos:])
+
+
+def write_shards(trace_path: str, specs: Sequence[ShardSpec], out_paths: Sequence[str]) -> List[int]:
+    """Streams the trace once, writing one shard per spec; returns the bytes written to each."""
+    trace = TraceFile(trace_path)
+    files = [open(path, 'wb') for path in out_paths]
+    try:
+        writers = [_ShardWriter(spec, f) for spec, f in zip(specs, files)]
+        header_end = 0
+        with open(trace.filepath, 'rb') as src:
+            for line in src:
+                if not line.startswith(b'#'):
+                    break
+                for writer in writers:
+                    writer.write(line)
+                header_end += len(line)
+
+        blocks = trace.blocks
+        with TraceReader(trace.filepath) as reader:
+            for block_id, (_, ts_min, ts_max, _) in enumerate(blocks):
+                begin, stop = trace.block_range(block_id)
+                begin = max(begin, header_end)
+                if begin >= stop:
+                    continue
+                if ts_min is None:
+                    # no events: continuation lines of the previous block's last event
+                    targets = [w for w in writers if w.keep]
+                    raw = targets
+                else:
+                    targets = [w for w in writers if w.spec.accepts_block(ts_min, ts_max)]
+                    raw = [w for w in targets if w.spec.time_only_within(ts_min, ts_max)]
+                for w in writers:
+                    if w not in targets:
+                        w.keep = False
+                if not targets:
+                    continue
+                filtered = [w for w in targets if w not in raw]
+                for chunk in reader.iter_chunks(begin, stop, BLOCK_SIZE):
+                    for w in raw:
+                        w.write(chunk)
+                    if filtered:
+                        heads = list(_EVENT_HEAD.finditer(chunk))
+                        for w in filtered:
+                            w.filter_chunk(chunk, heads)
+                for w in raw:
+                    w.keep = True
+    finally:
+        for f in files:
+            f.close()
+    return [w.written for w in writers]
+
+
+class ShardCache(TraceCache):
+    """``<fingerprint>-<spec key>.shard`` files under ``shards/`` with an LRU disk budget."""
+    suffix = SHARD_SUFFIX
+
+    def __init__(self, directory: Optional[str] = None, max_bytes: Optional[int] = None):
+        if max_bytes is None:
+            max_bytes = int(float(os.environ.get('FTRACE_SHARD_CACHE_MAX_MB', DEFAULT_MAX_MB)) * 1024 * 1024)
+        super().__init__(directory or os.path.join(cache_dir(), 'shards'), max_bytes)
+
+    def get(self, trace_path: str, spec: ShardSpec) -> str:
+        """Path of the shard, written (and the cache evicted) on a miss."""
+        entry = self.entry_path(trace_path, spec.key)
+        if os.path.exists(entry):
+            try:
+                os.utime(entry)
+            except OSError:
+                pass
+            self.hits += 1
+            return entry
+        self.misses += 1
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        os.close(fd)
+        try:
+            write_shards(trace_path, [spec], [tmp_path])
+            os.replace(tmp_path, entry)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.evict(keep=entry)
+        return entry
+
+
+def load_shard(trace_path: str, spec: ShardSpec) -> Tuple[str, bool]:
+    """The file to ingest for ``spec``: ``(path, temporary)``.
+
+    The shard comes from the shard cache; with caching disabled
+    (``FTRACE_CACHE=0``) it is written to a temporary file that the caller
+    removes when ``temporary`` is True.
+    """
+    if spec.is_full:
+        return trace_path, False
+    if cache_enabled():
+        return ShardCache().get(trace_path, spec), False
+    fd, out_path = tempfile.mkstemp(prefix='shard-', suffix='.txt')
+    os.close(fd)
+    try:
+        write_shards(trace_path, [spec], [out_path])
+    except BaseException:
+        os.remove(out_path)
+        raise
+    return out_path, True
+
+
+def add_shard_arguments(parser: argparse.ArgumentParser):
+    """The --cpus/--events trimming options shared by the analysis scripts."""
+    parser.add_argument("--cpus", type=parse_cpu_list, metavar="LIST",
+                        help="Only load events of these CPUs, e.g. 0-3,6 (text traces)")
+    parser.add_argument("--events", type=parse_event_list, metavar="PATTERNS",
+                        help="Only load these event types, e.g. 'sched_*,irq_*,softirq_*' (text traces)")
+
+
+def is_text_trace(trace_path: str) -> bool:
+    """True for a textual ftrace log (as opposed to a binary perfetto trace)."""
+    with open(trace_path, 'rb') as f:
+        head = f.read(4096)
+    try:
+        text = head.decode('utf-8')
+    except UnicodeDecodeError:
+        # a multi-byte character may be cut at the end of the sample
+        text = head[:-4].decode('utf-8', 'replace')
+    return not any(ord(c) < 32 and c not in '\t\n\r' for c in text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a trimmed ftrace shard for trace_processor")
+    parser.add_argument("trace_file", help="Path to the ftrace text log")
+    parser.add_argument("--window", nargs=2, type=float, metavar=("START", "END"),
+                        help="Only keep events in [START, END] (trace timestamps in seconds)")
+    add_shard_arguments(parser)
+    parser.add_argument("--per_cpu", action="store_true",
+                        help="Write one shard per CPU in a single pass instead of one shard")
+    parser.add_argument("--output_dir", default=None,
+                        help="Write shards here instead of the shard cache")
+    args = parser.parse_args()
+
+    start, end = args.window if args.window else (None, None)
+    if args.per_cpu:
+        cpus = TraceFile(args.trace_file).get_cpus()
+        if args.cpus is not None:
+            cpus = [cpu for cpu in cpus if cpu in args.cpus]
+        specs = [ShardSpec(start, end, frozenset([cpu]), args.events) for cpu in cpus]
+    else:
+        specs = [ShardSpec(start, end, args.cpus, args.events)]
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+        base = os.path.basename(args.trace_file)
+        paths = [os.path.join(args.output_dir, f"{base}.{spec.key}{SHARD_SUFFIX}") for spec in specs]
+        sizes = write_shards(args.trace_file, specs, paths)
+    elif len(specs) > 1:
+        cache = ShardCache()
+        missing = [s for s in specs if not os.path.exists(cache.entry_path(args.trace_file, s.key))]
+        if missing:
+            os.makedirs(cache.directory, exist_ok=True)
+            write_shards(args.trace_file, missing,
+                         [cache.entry_path(args.trace_file, s.key) for s in missing])
+            cache.evict()
+        paths = [cache.entry_path(args.trace_file, s.key) for s in specs]
+        sizes = [os.path.getsize(p) for p in paths]
+    else:
+        paths = [ShardCache().get(args.trace_file, specs[0])]
+        sizes = [os.path.getsize(paths[0])]
+
+    total = os.path.getsize(args.trace_file)
+    for spec, path, size in zip(specs, paths, sizes):
+        print(f"{path}\t{size / 1e6:.1f} MB of {total / 1e6:.1f} MB\t({spec.describe()})")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
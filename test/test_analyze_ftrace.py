@@ -0,0 +1,67 @@
+import io
+import os
+import random
+import sys
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import analyze_ftrace
+
+COMMS = ['kube-apiserver', 'qemu-kvm', 'vhost-4120', 'kworker/u16:0', 'containerd', 'swapper/0']
+
+class TestAnalyzeFtraceParallel(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        rng = random.Random(7)
+        fd, cls.log_path = tempfile.mkstemp(suffix='.log')
+        with os.fdopen(fd, 'w') as f:
+            f.write("# tracer: nop\n#\n")
+            ts = 7541.0
+            for i in range(20000):
+                ts += 0.0001
+                cpu = rng.randrange(4)
+                prev, nxt = rng.choice(COMMS), rng.choice(COMMS)
+                if i % 5 == 0:
+                    f.write(f"  {prev}-1 [{cpu:03d}] d.h3 {ts:.6f}: sched_wakeup: comm={nxt} pid=2 prio=120\n")
+                    continue
+                state = rng.choice(['S', 'R', 'R+', 'D', 'I'])
+                f.write(f"  {prev}-1 [{cpu:03d}] d..2 {ts:.6f}: sched_switch: prev_comm={prev} "
+                        f"prev_pid=1 prev_prio=120 prev_state={state} ==> "
+                        f"next_comm={nxt} next_pid=2 next_prio=120\n")
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.log_path)
+
+    def test_split_ranges_are_line_aligned(self):
+        ranges = analyze_ftrace.split_file_ranges(self.log_path, 7)
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[-1][1], os.path.getsize(self.log_path))
+        with open(self.log_path, 'rb') as f:
+            data = f.read()
+        for (start, end), (next_start, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(end, next_start)
+            self.assertEqual(data[end - 1:end], b'\n')
+
+    def test_parallel_report_matches_serial(self):
+        serial = analyze_ftrace.scan_sched_switch(self.log_path)
+        with redirect_stdout(io.StringIO()):
+            parallel = analyze_ftrace.scan_ftrace_log(self.log_path, jobs=4, cache=False)
+
+        self.assertEqual(serial['total_events'], parallel['total_events'])
+        for name in analyze_ftrace.COUNTER_NAMES:
+            self.assertEqual(list(serial[name].most_common()), list(parallel[name].most_common()))
+
+        reports = []
+        for stats in (serial, parallel):
+            buf = io.StringIO()
+            with redirect_stdout(buf):
+                analyze_ftrace.print_report(stats)
+            reports.append(buf.getvalue())
+        self.assertEqual(reports[0], reports[1])
+
+if __name__ == '__main__':
+    unittest.main()
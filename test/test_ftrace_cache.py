@@ -0,0 +1,92 @@
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from array import array
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import analyze_ftrace
+from ftrace_cache import TraceCache
+from ftrace_columns import EventStore
+
+
+class TestTraceCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = TraceCache(self.cache_dir)
+        fd, self.log_path = tempfile.mkstemp(suffix='.log')
+        with os.fdopen(fd, 'w') as f:
+            f.write("# tracer: nop\n#\n")
+            ts = 100.0
+            for i in range(3000):
+                ts += 0.0001
+                state = 'D' if i % 7 == 0 else 'S'
+                f.write(f"  qemu-kvm-4120  [{i % 4:03d}] d..2 {ts:.6f}: sched_switch: "
+                        f"prev_comm=qemu-kvm prev_pid=4120 prev_prio=120 prev_state={state} ==> "
+                        f"next_comm=kworker/{i % 5} next_pid={100 + i % 5} next_prio=120\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+        os.remove(self.log_path)
+
+    def test_round_trip_and_invalidation(self):
+        columns = {'a': array('d', [1.5, 2.5]), 'b': array('H', [3, 4, 5])}
+        self.assertIsNone(self.cache.load(self.log_path, 'test'))
+        self.cache.store(self.log_path, 'test', columns, {'names': ['x', None]})
+        loaded, meta = self.cache.load(self.log_path, 'test')
+        self.assertEqual(loaded, columns)
+        self.assertEqual(meta, {'names': ['x', None]})
+
+        with open(self.log_path, 'a') as f:
+            f.write("\n")
+        self.assertIsNone(self.cache.load(self.log_path, 'test'))
+
+    def test_lru_eviction_keeps_recently_used(self):
+        column = {'a': array('q', range(1000))}
+        paths = []
+        for i in range(3):
+            path = os.path.join(self.cache_dir, f'trace{i}.log')
+            with open(path, 'w') as f:
+                f.write(f"trace {i}\n")
+            entry = self.cache.store(path, 'test', column, {})
+            os.utime(entry, (time.time() - 100 + i, time.time() - 100 + i))
+            paths.append(path)
+        self.cache.load(paths[0], 'test')
+
+        self.cache.max_bytes = 2 * os.path.getsize(self.cache.entry_path(paths[0], 'test'))
+        self.cache.evict()
+        self.assertIsNotNone(self.cache.load(paths[0], 'test'))
+        self.assertIsNone(self.cache.load(paths[1], 'test'))
+        self.assertIsNotNone(self.cache.load(paths[2], 'test'))
+
+    def test_tools_reuse_cached_parse(self):
+        reports = []
+        for expect_hits in (0, 1):
+            with redirect_stdout(io.StringIO()):
+                stats = analyze_ftrace.scan_ftrace_log(self.log_path, cache=self.cache)
+            buf = io.StringIO()
+            with redirect_stdout(buf):
+                analyze_ftrace.print_report(stats)
+            reports.append(buf.getvalue())
+            self.assertEqual(self.cache.hits, expect_hits)
+        self.assertEqual(reports[0], reports[1])
+        buf = io.StringIO()
+        with redirect_stdout(buf):
+            analyze_ftrace.print_report(analyze_ftrace.scan_sched_switch(self.log_path))
+        self.assertEqual(buf.getvalue(), reports[0])
+
+        fresh = EventStore.load(self.log_path, cache=self.cache)
+        cached = EventStore.load(self.log_path, cache=self.cache)
+        self.assertEqual(self.cache.hits, 2)
+        self.assertEqual(cached.arrays, fresh.arrays)
+        self.assertEqual(cached.comms, fresh.comms)
+        self.assertEqual(repr(cached.events([5])[0]), repr(fresh.events([5])[0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import os
+import random
+import tempfile
+import unittest
+
+from ftrace_analyzer import Analyzer
+from ftrace_columns import EventStore
+from ftrace_event import parse_events
+from ftrace_file import TraceFile
+
+TASKS = [('swapper/0', 0), ('kube-apiserver', 3711), ('kworker/u16:0', 7828), ('ksoftirqd/1', 16)]
+
+
+class TestEventStore(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        rng = random.Random(1)
+        fd, cls.log_path = tempfile.mkstemp(suffix='.log')
+        with os.fdopen(fd, 'w') as f:
+            f.write("# tracer: nop\n#\n##### CPU 0 buffer started ####\n")
+            ts = 100.0
+            current = {cpu: TASKS[0] for cpu in range(4)}
+            for i in range(3000):
+                ts += rng.choice((0.00001, 0.0002, 0.003))
+                cpu = rng.randrange(4)
+                comm, pid = current[cpu]
+                if i % 4 == 0:
+                    f.write(f"  {comm}-{pid}  [{cpu:03d}] d.h3 {ts:.6f}: sched_wakeup: "
+                            f"comm=kube-apiserver pid=3711 prio=120 target_cpu=001\n")
+                    continue
+                nxt = TASKS[rng.randrange(len(TASKS))]
+                f.write(f"  {comm}-{pid}  [{cpu:03d}] d..2 {ts:.6f}: sched_switch: "
+                        f"prev_comm={comm} prev_pid={pid} prev_prio=120 prev_state=S ==> "
+                        f"next_comm={nxt[0]} next_pid={nxt[1]} next_prio=120\n")
+                current[cpu] = nxt
+        with open(cls.log_path) as f:
+            cls.events = list(parse_events(f))
+        cls.store = EventStore.from_file(cls.log_path)
+        cls.analyzer = Analyzer(TraceFile(cls.log_path), store=cls.store)
+
+    @classmethod
+    def tearDownClass(cls):
+        for path in (cls.log_path, cls.log_path + '.index'):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_columns_match_parsed_events(self):
+        self.assertEqual(len(self.store), len(self.events))
+        for row in (0, 1, 2, 1500, len(self.events) - 1):
+            event = self.events[row]
+            self.assertEqual(self.store.arrays['ts'][row], event.timestamp)
+            self.assertEqual(self.store.arrays['cpu'][row], event.cpu)
+            self.assertEqual(self.store.comm_of(row), event.comm)
+            self.assertEqual(self.store.arrays['next_pid'][row],
+                             event.next_pid if event.next_pid is not None else -1)
+            self.assertEqual(repr(self.store.events([row])[0]), repr(event))
+
+    def test_time_range(self):
+        stamps = [e.timestamp for e in self.events]
+        self.assertEqual((self.store.start_time, self.store.end_time), (min(stamps), max(stamps)))
+        self.assertEqual(self.store._cache['time_range'], (min(stamps), max(stamps)))
+        self.assertEqual(EventStore().time_range(), (0.0, 0.0))
+
+    def test_gaps_match_object_scan(self):
+        result = self.analyzer.detect_time_anomalies(threshold_us=1000, limit=5)
+        expected = [b.timestamp - a.timestamp for a, b in zip(self.events, self.events[1:])
+                    if b.timestamp - a.timestamp > 0.001]
+        self.assertEqual(result['summary']['total_gaps'], len(expected))
+        self.assertAlmostEqual(result['summary']['max_gap_us'], max(expected) * 1e6)
+        self.assertEqual(len(result['gaps']), 5)
+        starts = [gap['start'] for gap in result['gaps']]
+        self.assertEqual(starts, sorted(starts))
+
+        cpu_gaps = self.store.gaps(0.001, by='cpu')[2]
+        expected = 0
+        for cpu in range(4):
+            ts = [e.timestamp for e in self.events if e.cpu == cpu]
+            expected += sum(1 for a, b in zip(ts, ts[1:]) if b - a > 0.001)
+        self.assertEqual(len(cpu_gaps), expected)
+
+    def test_run_time_and_distribution(self):
+        timeline = self.analyzer.get_context_timeline(2)
+        switches = [e for e in self.events if e.cpu == 2 and e.event_type == 'sched_switch']
+        self.assertEqual(len(timeline), len(switches))
+        self.assertEqual([seg['pid'] for seg in timeline], [e.next_pid for e in switches])
+
+        busy = sum(seg['end'] - seg['start'] for cpu in range(4)
+                   for seg in self.analyzer.get_context_timeline(cpu) if seg['context'] != 'idle')
+        distribution = self.analyzer.get_time_distribution(bin_size=0.01)
+        self.assertEqual(sum(distribution['event_counts']), len(self.events))
+        self.assertAlmostEqual(sum(distribution['cpu_util']) * 0.01 * 4, busy, places=2)
+
+        run_time = sum(seg['end'] - seg['start'] for cpu in range(4)
+                       for seg in self.analyzer.get_context_timeline(cpu) if seg['pid'] == 3711)
+        self.assertAlmostEqual(self.analyzer.check_process_running(3711)['run_time'], run_time, places=5)
+
+
+if __name__ == '__main__':
+    unittest.main()
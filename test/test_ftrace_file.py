@@ -0,0 +1,82 @@
+import json
+import os
+import tempfile
+import unittest
+
+import ftrace_file
+from ftrace_file import TraceFile
+
+class TestTraceFileIndex(unittest.TestCase):
+    def setUp(self):
+        fd, self.log_path = tempfile.mkstemp(suffix='.log')
+        # 小块大小让测试文件也能切出多个索引块
+        self._block_size = ftrace_file.BLOCK_SIZE
+        ftrace_file.BLOCK_SIZE = 4096
+        with os.fdopen(fd, 'w') as f:
+            f.write("# tracer: nop\n#\n")
+            ts = 7541.0
+            for i in range(2000):
+                ts += 0.001
+                cpu = i % 4
+                if i < 1000:
+                    prev, prev_pid, nxt, nxt_pid = 'kube-apiserver', 3711, 'swapper/%d' % cpu, 0
+                else:
+                    prev, prev_pid, nxt, nxt_pid = 'kworker/u16:0', 7828, 'containerd', 2634
+                f.write(f"  {prev}-{prev_pid}  [{cpu:03d}] d..2 {ts:.6f}: sched_switch: "
+                        f"prev_comm={prev} prev_pid={prev_pid} prev_prio=120 prev_state=S ==> "
+                        f"next_comm={nxt} next_pid={nxt_pid} next_prio=120\n")
+
+    def tearDown(self):
+        ftrace_file.BLOCK_SIZE = self._block_size
+        for path in (self.log_path, self.log_path + ftrace_file.INDEX_SUFFIX):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_index_is_persisted_and_reused(self):
+        trace = TraceFile(self.log_path)
+        self.assertFalse(trace.has_index())
+        info = trace.info()
+        self.assertTrue(os.path.exists(self.log_path + ftrace_file.INDEX_SUFFIX))
+        self.assertEqual(info['event_count'], 2000)
+        self.assertEqual(info['line_count'], 2002)
+        self.assertEqual(info['event_types'], ['sched_switch'])
+
+        reopened = TraceFile(self.log_path)
+        self.assertTrue(reopened.has_index())
+        self.assertEqual(reopened.get_cpus(), [0, 1, 2, 3])
+        self.assertAlmostEqual(reopened.get_time_range()[0], 7541.001)
+        self.assertAlmostEqual(reopened.get_time_range()[1], 7543.0)
+        procs = {p['pid']: p for p in reopened.get_processes()}
+        self.assertEqual(procs[3711]['type'], 'user')
+        self.assertEqual(procs[7828]['type'], 'kernel_thread')
+        self.assertEqual(procs[0]['type'], 'idle')
+        self.assertIn(2634, procs)
+
+    def test_postings_point_at_blocks_containing_pid(self):
+        trace = TraceFile(self.log_path)
+        trace.build_index()
+        self.assertGreater(len(trace.blocks), 4)
+        for pid in (3711, 7828, 2634):
+            block_ids = trace.postings('pid', pid)
+            self.assertTrue(block_ids)
+            with open(self.log_path, 'rb') as f:
+                data = f.read()
+            for block_id, block in enumerate(trace.blocks):
+                start, end = trace.block_range(block_id)
+                present = f"{pid}".encode() in data[start:end]
+                self.assertEqual(present, block_id in block_ids)
+
+    def test_parallel_index_matches_serial(self):
+        trace = TraceFile(self.log_path)
+        trace.build_index()
+        with open(trace.index_path) as f:
+            serial = [json.loads(line) for line in f]
+        trace.build_index(force=True, jobs=3)
+        with open(trace.index_path) as f:
+            parallel = [json.loads(line) for line in f]
+        self.assertEqual(serial[0]['event_count'], parallel[0]['event_count'])
+        self.assertEqual(serial[0]['processes'], parallel[0]['processes'])
+        self.assertEqual(serial[0]['cpus'], parallel[0]['cpus'])
+
+if __name__ == '__main__':
+    unittest.main()
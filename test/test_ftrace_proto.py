@@ -0,0 +1,166 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import ftrace_proto
+from ftrace_proto import convert, encode_event, preferred_trace, proto_path, varint
+
+TRACE = """# tracer: nop
+#
+           <idle>-0       [001] d..2  7541.000100: sched_switch: prev_comm=swapper/1 prev_pid=0 prev_prio=120 prev_state=R ==> next_comm=kube-apiserver next_pid=3711 next_prio=120
+   kube-apiserver-3711    [001] d..2  7541.000250: sched_switch: prev_comm=kube-apiserver prev_pid=3711 prev_prio=120 prev_state=R+ ==> next_comm=swapper/1 next_pid=0 next_prio=120
+           <idle>-0       [002] d.h3  7541.000300: sched_wakeup: comm=containerd pid=2634 prio=120 target_cpu=002
+           <idle>-0       [002] d.h1  7541.000400: irq_handler_entry: irq=27 name=eth0
+           <idle>-0       [002] d.h1  7541.000450: irq_handler_exit: irq=27 ret=handled
+           <idle>-0       [002] ..s1  7541.000500: softirq_entry: vec=3 [action=NET_RX]
+       containerd-2634    [003] ....  7541.000600: tracing_mark_write: B|2634|pull
+"""
+
+
+def _fields(data):
+    """Minimal protobuf decoder: [(field number, value)], value is int or bytes."""
+    fields, pos = [], 0
+    while pos < len(data):
+        key, pos = _varint(data, pos)
+        number, wire = key >> 3, key & 7
+        if wire == 0:
+            value, pos = _varint(data, pos)
+        elif wire == 2:
+            size, pos = _varint(data, pos)
+            value, pos = data[pos:pos + size], pos + size
+        else:
+            raise ValueError(f"unexpected wire type {wire}")
+        fields.append((number, value))
+    return fields
+
+
+def _varint(data, pos):
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        shift += 7
+        if byte < 0x80:
+            return value, pos
+
+
+class TestFtraceProto(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.tmp, 'trace.log')
+        with open(self.log_path, 'w') as f:
+            f.write(TRACE)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def _events(self):
+        with open(proto_path(self.log_path), 'rb') as f:
+            packets = [dict(_fields(p)) for n, p in _fields(f.read()) if n == 1]
+        events = []
+        for packet in packets:
+            if 1 not in packet:
+                continue
+            bundle = _fields(packet[1])
+            cpu = dict(bundle)[1]
+            events += [(cpu, _fields(e)) for n, e in bundle if n == 2]
+        return packets, events
+
+    def test_varint(self):
+        self.assertEqual(varint(1), b'\x01')
+        self.assertEqual(varint(300), b'\xac\x02')
+        self.assertEqual(len(varint(-1)), 10)
+
+    def test_convert_encodes_events(self):
+        meta = convert(self.log_path)
+        self.assertTrue(meta['lossless'])
+        self.assertEqual(meta['events'], 7)
+        packets, events = self._events()
+        self.assertEqual(len(events), 7)
+        by_ts = {dict(fields)[1]: (cpu, dict(fields)) for cpu, fields in events}
+
+        cpu, switch = by_ts[7541000250000]
+        self.assertEqual((cpu, switch[2]), (1, 3711))
+        self.assertEqual(dict(_fields(switch[4])), {1: b'kube-apiserver', 2: 3711, 3: 120, 4: 256,
+                                                    5: b'swapper/1', 6: 0, 7: 120})
+        self.assertEqual(dict(_fields(by_ts[7541000300000][1][17])),
+                         {1: b'containerd', 2: 2634, 3: 120, 5: 2})
+        self.assertEqual(dict(_fields(by_ts[7541000400000][1][36])), {1: 27, 2: b'eth0'})
+        self.assertEqual(dict(_fields(by_ts[7541000450000][1][37])), {1: 27, 2: 1})
+        self.assertEqual(dict(_fields(by_ts[7541000500000][1][24])), {1: 3})
+        self.assertEqual(dict(_fields(by_ts[7541000600000][1][3])), {2: b'B|2634|pull\n'})
+
+        # thread names from the task column go into a process tree packet
+        tree = [p[2] for p in packets if 2 in p][0]
+        threads = {dict(_fields(t))[1]: dict(_fields(t))[2] for n, t in _fields(tree) if n == 2}
+        self.assertEqual(threads, {3711: b'kube-apiserver', 2634: b'containerd'})
+
+    def test_tgid_links_threads_to_processes(self):
+        with open(self.log_path, 'w') as f:
+            f.write("# tracer: nop\n#\n")
+            f.write("       containerd-2634  ( 2634) [003] ....  7541.000600: tracing_mark_write: B|2634|pull\n")
+            f.write("  containerd-sh-2650  ( 2634) [001] d..2  7541.000700: sched_wakeup: "
+                    "comm=kworker/1:0 pid=40 prio=120 target_cpu=001\n")
+            f.write("        dockerd-3001  ( 2990) [000] d..2  7541.000800: sched_wakeup: "
+                    "comm=kworker/0:1 pid=41 prio=120 target_cpu=000\n")
+            f.write("           <idle>-0     (-----) [002] d.h1  7541.000900: irq_handler_entry: irq=27 name=eth0\n")
+        self.assertTrue(convert(self.log_path)['lossless'])
+        packets, _ = self._events()
+        tree = _fields([p[2] for p in packets if 2 in p][0])
+        threads = {d[1]: (d[2], d.get(3)) for d in (dict(_fields(t)) for n, t in tree if n == 2)}
+        self.assertEqual(threads, {2634: (b'containerd', 2634), 2650: (b'containerd-sh', 2634),
+                                   3001: (b'dockerd', 2990)})
+        processes = {d[1]: (d[3], d[7]) for d in (dict(_fields(p)) for n, p in tree if n == 1)}
+        # the process is named after its main thread, or any thread if that one is missing
+        self.assertEqual(processes, {2634: (b'containerd', 1), 2990: (b'dockerd', 1)})
+
+    def test_unsupported_events_make_conversion_lossy(self):
+        self.assertIsNone(encode_event(b'mm_page_alloc', b'page=0x0 pfn=1'))
+        self.assertIsNone(encode_event(b'sched_switch', b'prev_comm=x prev_pid=1 prev_prio=120 '
+                                                        b'prev_state=Q ==> next_comm=y next_pid=2 next_prio=120'))
+        with open(self.log_path, 'a') as f:
+            f.write("       containerd-2634    [003] ....  7541.000700: mm_page_alloc: page=0x0 pfn=1\n")
+        meta = convert(self.log_path)
+        self.assertFalse(meta['lossless'])
+        self.assertEqual(meta['skipped'], {'mm_page_alloc': 1})
+        self.assertEqual(preferred_trace(self.log_path), self.log_path)
+
+    def test_unparsed_lines_make_conversion_lossy(self):
+        with open(self.log_path, 'a') as f:
+            f.write("CPU:2 [LOST 118 EVENTS]\n")
+            f.write("       containerd-2634    [003] 7541.000700: tracing_mark_write: no flags column\n")
+            f.write(" => __schedule\n\n")
+        meta = convert(self.log_path)
+        self.assertFalse(meta['lossless'])
+        self.assertEqual((meta['events'], meta['skipped']), (8, {'<unparsed>': 2}))
+        self.assertEqual(preferred_trace(self.log_path), self.log_path)
+
+    def test_preferred_trace(self):
+        self.assertEqual(preferred_trace(self.log_path), self.log_path)
+        convert(self.log_path)
+        self.assertEqual(preferred_trace(self.log_path), proto_path(self.log_path))
+        # a rewritten text trace invalidates the conversion
+        time.sleep(0.01)
+        with open(self.log_path, 'a') as f:
+            f.write("\n")
+        later = time.time() + 5
+        os.utime(self.log_path, (later, later))
+        self.assertEqual(preferred_trace(self.log_path), self.log_path)
+
+    def test_bundles_are_split(self):
+        self._bundle_events = ftrace_proto.BUNDLE_EVENTS
+        ftrace_proto.BUNDLE_EVENTS = 1
+        try:
+            convert(self.log_path)
+        finally:
+            ftrace_proto.BUNDLE_EVENTS = self._bundle_events
+        packets, events = self._events()
+        self.assertEqual(len(events), 7)
+        self.assertEqual(sum(1 for p in packets if 1 in p), 7)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+import os
+import tempfile
+import unittest
+
+import ftrace_file
+from ftrace_event import parse_events
+from ftrace_file import TraceFile
+
+COMMS = [('kube-apiserver', 3711), ('containerd', 2634), ('kworker/u16:0', 7828), ('qemu-kvm', 4120)]
+
+class TestQueryBuilder(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls._block_size = ftrace_file.BLOCK_SIZE
+        ftrace_file.BLOCK_SIZE = 8192
+        fd, cls.log_path = tempfile.mkstemp(suffix='.log')
+        with os.fdopen(fd, 'w') as f:
+            f.write("# tracer: nop\n#\n")
+            ts = 100.0
+            for i in range(5000):
+                ts += 0.001
+                cpu = i % 4
+                comm, pid = COMMS[(i // 500) % len(COMMS)]
+                nxt, nxt_pid = COMMS[(i + 1) % len(COMMS)]
+                if i % 3 == 0:
+                    f.write(f"  {comm}-{pid}  [{cpu:03d}] d.h3 {ts:.6f}: sched_wakeup: "
+                            f"comm={nxt} pid={nxt_pid} prio=120 target_cpu=001\n")
+                else:
+                    state = 'D' if i % 7 == 0 else 'S'
+                    f.write(f"  {comm}-{pid}  [{cpu:03d}] d..2 {ts:.6f}: sched_switch: "
+                            f"prev_comm={comm} prev_pid={pid} prev_prio=120 prev_state={state} ==> "
+                            f"next_comm={nxt} next_pid={nxt_pid} next_prio=120\n")
+        cls.trace = TraceFile(cls.log_path)
+        cls.trace.build_index()
+        with open(cls.log_path) as f:
+            cls.all_events = list(parse_events(f))
+
+    @classmethod
+    def tearDownClass(cls):
+        ftrace_file.BLOCK_SIZE = cls._block_size
+        for path in (cls.log_path, cls.log_path + ftrace_file.INDEX_SUFFIX):
+            os.remove(path)
+
+    def assertSameEvents(self, events, expected):
+        self.assertEqual([(e.timestamp, e.details) for e in events],
+                         [(e.timestamp, e.details) for e in expected])
+
+    def test_time_range_reads_only_overlapping_blocks(self):
+        query = self.trace.query().time_range(101.0, 101.2)
+        ranges = query.plan()
+        self.assertLess(sum(end - start for start, end in ranges), os.path.getsize(self.log_path) / 4)
+        expected = [e for e in self.all_events if 101.0 <= e.timestamp <= 101.2]
+        self.assertSameEvents(query.execute(), expected)
+
+    def test_cpu_pid_filters_match_full_scan(self):
+        result = self.trace.query().cpu(1).pid(7828).execute()
+        expected = [e for e in self.all_events if e.cpu == 1 and 7828 in e.related_pids]
+        self.assertSameEvents(result, expected)
+        self.assertLess(len(self.trace.query().pid(7828).plan()), len(self.trace.blocks))
+
+    def test_state_event_type_and_comm(self):
+        count = self.trace.query().event_type('sched_switch').prev_state('D').comm('qemu-kvm').count()
+        expected = [e for e in self.all_events if e.event_type == 'sched_switch'
+                    and e.prev_state == 'D' and e.comm == 'qemu-kvm']
+        self.assertEqual(count, len(expected))
+
+    def test_limit_and_order(self):
+        first = self.trace.query().event_type('sched_wakeup').limit(3).execute()
+        expected = [e for e in self.all_events if e.event_type == 'sched_wakeup'][:3]
+        self.assertSameEvents(first, expected)
+        last = self.trace.query().order_by('timestamp', ascending=False).first(2)
+        self.assertSameEvents(last, self.all_events[::-1][:2])
+        self.assertEqual(self.trace.query().count(), len(self.all_events))
+
+class TestStreamingQueryResult(TestQueryBuilder):
+    def test_result_is_lazy_and_aggregates_in_one_pass(self):
+        scans = []
+        query = self.trace.query().event_type('sched_switch')
+
+        result = query.execute()
+        source = result._source
+        result._source = lambda: (scans.append(1), source())[1]
+        self.assertEqual(scans, [])
+
+        expected = [e for e in self.all_events if e.event_type == 'sched_switch']
+        summary = result.summary()
+        self.assertEqual(summary['count'], len(expected))
+        self.assertEqual(len(result), len(expected))
+        self.assertEqual(summary['cpus'], sorted({e.cpu for e in expected}))
+        self.assertEqual(len(scans), 1)
+        self.assertIsNone(result._events)
+
+        by_cpu = result.by_cpu()
+        self.assertEqual(len(scans), 1)
+        self.assertEqual(len(by_cpu[2]), sum(1 for e in expected if e.cpu == 2))
+
+    def test_groups_read_only_their_blocks(self):
+        query = self.trace.query().event_type('sched_switch', 'sched_wakeup')
+        by_process = query.execute().by_process()
+        self.assertEqual(sorted(by_process), sorted({e.pid for e in self.all_events}))
+        for pid, group in by_process.items():
+            self.assertSameEvents(group, [e for e in self.all_events if e.pid == pid])
+            self.assertLess(len(query.plan(('pid', pid))), len(self.trace.blocks))
+        states = self.trace.query().execute().by_state()
+        self.assertEqual(list(states), ['S', 'D'])
+        self.assertSameEvents(states['D'], [e for e in self.all_events if e.prev_state == 'D'])
+
+    def test_groups_of_a_limited_result_are_partitioned_in_one_pass(self):
+        scans = []
+        result = self.trace.query().limit(600).execute()
+        source = result._source
+        result._source = lambda: (scans.append(1), source())[1]
+        by_process = result.by_process()
+        self.assertEqual(len(scans), 1)
+        self.assertEqual({pid: len(group) for pid, group in by_process.items()}, {3711: 500, 2634: 100})
+
+    def test_streaming_exports(self):
+        result = self.trace.query().cpu(3).limit(50).execute()
+        fd, csv_path = tempfile.mkstemp(suffix='.csv')
+        os.close(fd)
+        try:
+            self.assertEqual(result.to_csv(csv_path), csv_path)
+            with open(csv_path, newline='') as f:
+                self.assertEqual(f.read(), result.to_csv())
+        finally:
+            os.remove(csv_path)
+        timeline = result.timeline(bin_size=0.01)
+        self.assertEqual(sum(timeline['counts']), 50)
+        self.assertEqual(result[-1].timestamp, result.materialize()[-1].timestamp)
+
+if __name__ == '__main__':
+    unittest.main()
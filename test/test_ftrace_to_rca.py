@@ -0,0 +1,195 @@
+import gzip
+import io
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'transform'))
+
+import ftrace_file
+from ftrace_reader import TraceReader
+from ftrace_to_rca import (TIMESTAMP_FORMAT, EventFilter, SecondFormatter, convert_parallel, convert_range,
+                           convert_ranges, follow, window_header)
+from trace_codec import open_output
+
+BASE_DT = datetime.fromisoformat('2026-01-09T10:38:15+00:00')
+
+
+class TestFtraceToRca(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        # small index blocks so that filters can skip some of them
+        self._block_size = ftrace_file.BLOCK_SIZE
+        ftrace_file.BLOCK_SIZE = 16 * 1024
+        self.log_path = os.path.join(self.tmp, 'trace.log')
+        with open(self.log_path, 'w') as f:
+            f.write("# tracer: nop\n#\n")
+            ts = 7541.0
+            for i in range(3000):
+                ts += 0.0007
+                if i == 1500:
+                    f.write("##### CPU 2 buffer started ####\n")
+                f.write(f"  kworker/u16:{i % 7}-{100 + i % 13} [{i % 4:03d}] d..2 {ts:.6f}: "
+                        f"sched_{'wakeup' if i % 3 else 'switch'}: comm=containerd pid={i} prio=120 "
+                        f"target_cpu=00{i % 4}\n")
+
+    def tearDown(self):
+        ftrace_file.BLOCK_SIZE = self._block_size
+        shutil.rmtree(self.tmp)
+
+    def test_convert_range(self):
+        out = io.StringIO()
+        self.assertEqual(convert_range(self.log_path, 0, os.path.getsize(self.log_path), BASE_DT, out), 3000)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0], "2026-01-09T12:43:56Z ftrace: [CPU 000] kworker/u16:0-100: "
+                                   "sched_switch: comm=containerd pid=0 prio=120 target_cpu=000")
+        self.assertTrue(window_header(BASE_DT, '2026-01-09T10:38:15Z').startswith(
+            "window=2026-01-09T10:38:15Z-2026-01-09T11:08:15Z "))
+
+    def test_second_memo_matches_strftime(self):
+        rng = random.Random(3)
+        for base in (BASE_DT, datetime.fromisoformat('2026-01-09T10:38:15.999999+00:00')):
+            fmt = SecondFormatter(base)
+            text, lo, hi = '', 1.0, 0.0
+            # near whole-second boundaries (timedelta rounds to microseconds) and random
+            stamps = [7541 + k + d for k in range(3) for d in (-1e-6, -5e-7, -4e-7, 0.0, 4e-7, 5e-7, 1e-6)]
+            stamps += sorted(rng.uniform(7540, 7545) for _ in range(2000))
+            for ts in stamps:
+                if not lo <= ts < hi:
+                    text, lo, hi = fmt.format(ts)
+                self.assertEqual(text, (base + timedelta(seconds=ts)).strftime(TIMESTAMP_FORMAT), ts)
+
+    def test_parallel_output_is_byte_identical(self):
+        outputs = []
+        for jobs in (1, 3):
+            path = os.path.join(self.tmp, f'rca_{jobs}.log')
+            with open(path, 'w', encoding='utf-8') as fout:
+                fout.write(window_header(BASE_DT, '2026-01-09T10:38:15Z'))
+                if jobs > 1:
+                    count = convert_parallel(self.log_path, fout, BASE_DT, jobs)
+                else:
+                    count = convert_range(self.log_path, 0, os.path.getsize(self.log_path), BASE_DT, fout)
+            self.assertEqual(count, 3000)
+            with open(path, 'rb') as f:
+                outputs.append(f.read())
+        self.assertEqual(outputs[0], outputs[1])
+        # the temporary segments are gone
+        self.assertEqual(sorted(os.listdir(self.tmp)), ['rca_1.log', 'rca_3.log', 'trace.log'])
+
+    def _serial_output(self):
+        out = io.StringIO()
+        out.write(window_header(BASE_DT, '2026-01-09T10:38:15Z'))
+        convert_range(self.log_path, 0, os.path.getsize(self.log_path), BASE_DT, out)
+        return out.getvalue().encode('utf-8')
+
+    def test_event_filter_pushdown(self):
+        with TraceReader(self.log_path) as reader:
+            self.assertEqual(list(reader.iter_lines((b'[001]', b'-103 '))),
+                             [line for line in reader.iter_lines() if '[001]' in line or '-103 ' in line])
+
+        expected = self._serial_output().decode('utf-8').splitlines(keepends=True)[1:]
+        pattern = re.compile(r"\S+ ftrace: \[CPU (\d+)\] (.*)-(\d+): (\w+):")
+        # the timestamp is recovered from the converted line's position in the (ascending) trace
+        stamps = [7541.0 + 0.0007 * (i + 1) for i in range(3000)]
+        cases = [
+            (EventFilter(events=('sched_switch',)), lambda cpu, comm, pid, event, ts: event == 'sched_switch'),
+            (EventFilter(cpus=frozenset({1, 3}), events=('sched_w*',)),
+             lambda cpu, comm, pid, event, ts: cpu in (1, 3) and event == 'sched_wakeup'),
+            (EventFilter(pids=frozenset({103, 110})), lambda cpu, comm, pid, event, ts: pid in (103, 110)),
+            (EventFilter(comms=('kworker/u16:[25]',)), lambda cpu, comm, pid, event, ts: comm[-1] in '25'),
+            (EventFilter(start=7541.7, end=7542.1, cpus=frozenset({2})),
+             lambda cpu, comm, pid, event, ts: cpu == 2 and 7541.7 <= ts <= 7542.1),
+        ]
+        for event_filter, keep in cases:
+            wanted = ''.join(line for line, ts in zip(expected, stamps)
+                             if keep(*((int(v) if v.isdigit() else v) for v in pattern.match(line).groups()), ts))
+            self.assertTrue(wanted)
+            ranges = event_filter.index_ranges(self.log_path)
+            out = io.StringIO()
+            if ranges is None:
+                convert_range(self.log_path, 0, None, BASE_DT, out, event_filter=event_filter)
+            else:
+                convert_ranges(self.log_path, ranges, BASE_DT, out, event_filter=event_filter)
+            self.assertEqual(out.getvalue(), wanted, event_filter.describe())
+            path = os.path.join(self.tmp, 'rca_filtered.log')
+            with open(path, 'w', encoding='utf-8') as fout:
+                convert_parallel(self.log_path, fout, BASE_DT, 3, event_filter=event_filter, ranges=ranges)
+            with open(path, encoding='utf-8') as f:
+                self.assertEqual(f.read(), wanted, event_filter.describe())
+
+        # the window is pushed down to the index: only the blocks around it are read
+        ranges = EventFilter(start=7541.7, end=7541.8).index_ranges(self.log_path)
+        self.assertLess(sum(end - start for start, end in ranges), os.path.getsize(self.log_path))
+
+    def test_compressed_input_and_output(self):
+        gz_input = self.log_path + '.gz'
+        with open(self.log_path, 'rb') as src, gzip.open(gz_input, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        gz_output = os.path.join(self.tmp, 'rca.log.gz')
+        with open_output(gz_output) as fout:
+            fout.write(window_header(BASE_DT, '2026-01-09T10:38:15Z'))
+            self.assertEqual(convert_range(gz_input, 0, None, BASE_DT, fout), 3000)
+        with gzip.open(gz_output, 'rb') as f:
+            self.assertEqual(f.read(), self._serial_output())
+        with self.assertRaises(ValueError):
+            follow(gz_input, os.path.join(self.tmp, 'rca.log'), BASE_DT, '2026-01-09T10:38:15Z', idle_exit=0)
+
+    def test_follow_resumes_from_checkpoint(self):
+        with open(self.log_path, 'rb') as f:
+            data = f.read()
+        expected = self._serial_output()
+        growing = os.path.join(self.tmp, 'growing.log')
+        output = os.path.join(self.tmp, 'rca.log')
+        # the writer stopped in the middle of a line: only complete lines are converted
+        cut = len(data) // 3 + 17
+        with open(growing, 'wb') as f:
+            f.write(data[:cut])
+        first = follow(growing, output, BASE_DT, '2026-01-09T10:38:15Z', idle_exit=0)
+        with open(output, 'rb') as f:
+            self.assertTrue(expected.startswith(f.read()))
+
+        # a restart after a crash mid-batch: output past the checkpoint is redone
+        with open(output, 'ab') as f:
+            f.write(b"half a batch")
+        with open(growing, 'ab') as f:
+            f.write(data[cut:])
+        second = follow(growing, output, BASE_DT, '2026-01-09T10:38:15Z', idle_exit=0)
+        self.assertEqual(first + second, 3000)
+        with open(output, 'rb') as f:
+            self.assertEqual(f.read(), expected)
+
+    def test_follow_tails_a_growing_file(self):
+        with open(self.log_path, 'rb') as f:
+            lines = f.read().splitlines(keepends=True)
+        growing = os.path.join(self.tmp, 'growing.log')
+        output = os.path.join(self.tmp, 'rca.log')
+        open(growing, 'wb').close()
+        stop = threading.Event()
+        thread = threading.Thread(target=follow, args=(growing, output, BASE_DT, '2026-01-09T10:38:15Z'),
+                                  kwargs={'poll_interval': 0.01, 'stop': stop})
+        thread.start()
+        try:
+            with open(growing, 'ab') as f:
+                for i in range(0, len(lines), 500):
+                    f.write(b''.join(lines[i:i + 500]))
+                    f.flush()
+                    time.sleep(0.02)
+            deadline = time.time() + 10
+            while os.path.getsize(output) < len(self._serial_output()) and time.time() < deadline:
+                time.sleep(0.01)
+        finally:
+            stop.set()
+            thread.join(10)
+        with open(output, 'rb') as f:
+            self.assertEqual(f.read(), self._serial_output())
+
+
+if __name__ == '__main__':
+    unittest.main()
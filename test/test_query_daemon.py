@@ -0,0 +1,150 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+from types import SimpleNamespace
+
+from query_daemon import DaemonClient, QueryDaemon, serve
+from tp_session import TraceProcessorSession
+
+
+class SqliteTraceProcessor:
+    """Stands in for TraceProcessor: a table holding the trace file's lines."""
+
+    def __init__(self, trace_path):
+        self.db = sqlite3.connect(':memory:', check_same_thread=False)
+        self.db.row_factory = lambda cur, row: SimpleNamespace(
+            **{col[0]: value for col, value in zip(cur.description, row)})
+        self.db.execute("CREATE TABLE lines (n INTEGER, text TEXT)")
+        with open(trace_path) as f:
+            self.db.executemany("INSERT INTO lines VALUES (?, ?)", enumerate(f.read().splitlines()))
+
+    def query(self, sql):
+        if sql.strip().upper().startswith('INCLUDE'):
+            return []
+        return self.db.execute(sql).fetchall()
+
+    def close(self):
+        self.db.close()
+
+
+class FakeServer:
+    def __init__(self, rss):
+        self._rss = rss
+        self.stopped = False
+
+    def rss(self):
+        return self._rss
+
+    def stop(self):
+        self.stopped = True
+
+
+def run_query(daemon, trace_path, sql, max_rows=None):
+    """``(header, rows, trailer)`` of a streamed query."""
+    messages = list(daemon.handle({'op': 'query', 'trace': trace_path, 'sql': sql, 'max_rows': max_rows}))
+    rows = [m for m in messages if isinstance(m, list)]
+    return messages[0], rows, messages[-1]
+
+
+class TestQueryDaemon(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.loads = []
+        self.servers = {}
+        self.traces = []
+        for i in range(3):
+            path = os.path.join(self.tmp, f'trace{i}.log')
+            with open(path, 'w') as f:
+                f.write(''.join(f"line {i}.{n}\n" for n in range(5)))
+            self.traces.append(path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def opener(self, trace_path, tp_bin, rss=100):
+        self.loads.append(trace_path)
+        server = self.servers[trace_path] = FakeServer(rss)
+        return TraceProcessorSession(SqliteTraceProcessor(trace_path)), server
+
+    def test_trace_stays_resident(self):
+        daemon = QueryDaemon('tp', opener=self.opener)
+        header, rows, trailer = run_query(daemon, self.traces[0], "SELECT count(*) AS n FROM lines")
+        self.assertEqual((header['columns'], rows), (['n'], [[5]]))
+        self.assertIsNotNone(header['ingest_seconds'])
+        self.assertEqual((trailer['end'], trailer['ok'], trailer['rows']), (True, True, 1))
+        header, rows, _ = run_query(daemon, self.traces[0],
+                                    "INCLUDE PERFETTO MODULE x; SELECT text FROM lines WHERE n = 2")
+        self.assertEqual(rows, [['line 0.2']])
+        self.assertIsNone(header['ingest_seconds'])
+        self.assertEqual(self.loads, [self.traces[0]])
+
+        header, _, _ = run_query(daemon, self.traces[0], "SELECT nope FROM lines")
+        self.assertFalse(header['ok'])
+        self.assertIn('nope', header['error'])
+        header, rows, _ = run_query(daemon, self.traces[0], "INCLUDE PERFETTO MODULE x")
+        self.assertEqual((header['has_result'], rows), (False, []))
+
+    def test_max_rows_is_pushed_down(self):
+        daemon = QueryDaemon('tp', opener=self.opener)
+        header, rows, trailer = run_query(daemon, self.traces[0], "SELECT n FROM lines ORDER BY n DESC", 2)
+        self.assertEqual(rows, [[4], [3]])
+        self.assertEqual(trailer['rows'], 2)
+
+    def test_lru_limits(self):
+        daemon = QueryDaemon('tp', max_traces=2, max_bytes=250, opener=self.opener)
+        for path in (self.traces[0], self.traces[1], self.traces[0], self.traces[2]):
+            self.assertTrue(run_query(daemon, path, "SELECT 1 AS x")[2]['ok'])
+        # trace1 was the least recently used when trace2 was loaded
+        self.assertEqual(list(daemon.traces), [self.traces[0], self.traces[2]])
+        self.assertTrue(self.servers[self.traces[1]].stopped)
+
+        daemon.max_bytes = 150
+        daemon.evict(keep=daemon.traces[self.traces[2]])
+        self.assertEqual(list(daemon.traces), [self.traces[2]])
+
+    def test_changed_trace_is_reloaded(self):
+        daemon = QueryDaemon('tp', opener=self.opener)
+        sql = "SELECT count(*) AS n FROM lines"
+        run_query(daemon, self.traces[0], sql)
+        with open(self.traces[0], 'a') as f:
+            f.write("line extra\n")
+        later = time.time() + 5
+        os.utime(self.traces[0], (later, later))
+        self.assertEqual(run_query(daemon, self.traces[0], sql)[1], [[6]])
+        self.assertEqual(len(self.loads), 2)
+
+    def test_unix_socket_round_trip(self):
+        socket_path = os.path.join(self.tmp, 'daemon.sock')
+        daemon = QueryDaemon('tp', opener=self.opener)
+        thread = threading.Thread(target=serve, args=(daemon, socket_path, 60))
+        thread.start()
+        try:
+            deadline = time.time() + 10
+            while not os.path.exists(socket_path) and time.time() < deadline:
+                time.sleep(0.01)
+            client = DaemonClient(socket_path)
+            for _ in range(2):
+                messages = list(client.query(self.traces[1], "SELECT text FROM lines ORDER BY n DESC LIMIT 1"))
+                self.assertEqual(messages[1:-1], [['line 1.4']])
+                self.assertTrue(messages[-1]['end'])
+            # a client that stops reading early releases the trace
+            stream = client.query(self.traces[1], "SELECT text FROM lines")
+            next(stream)
+            next(stream)
+            stream.close()
+            status = client.request({'op': 'status'})
+            self.assertEqual([(t['trace'], t['queries']) for t in status['traces']], [(self.traces[1], 3)])
+        finally:
+            DaemonClient(socket_path).request({'op': 'shutdown'})
+            thread.join(10)
+        self.assertFalse(thread.is_alive())
+        self.assertFalse(os.path.exists(socket_path))
+        self.assertTrue(self.servers[self.traces[1]].stopped)
+
+
+if __name__ == '__main__':
+    unittest.main()
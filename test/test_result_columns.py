@@ -0,0 +1,65 @@
+import csv
+import io
+import pickle
+import unittest
+from array import array
+from types import SimpleNamespace
+
+from result_columns import DictColumn, ResultColumns, pack_column
+
+
+class TestResultColumns(unittest.TestCase):
+    def test_from_result_packs_columns(self):
+        rows = [SimpleNamespace(_private=1, utid=i, dur=i * 0.5, name=f"t{i % 3}", state=None if i % 2 else 'S')
+                for i in range(1000)]
+        data = ResultColumns.from_result(iter(rows))
+        self.assertEqual(data.names, ['utid', 'dur', 'name', 'state'])
+        self.assertEqual(len(data), 1000)
+        utid, dur, name, state = data.columns
+        self.assertEqual((utid.typecode, dur.typecode), ('q', 'd'))
+        self.assertIsInstance(name, DictColumn)
+        self.assertEqual(name.values, ['t0', 't1', 't2'])
+        self.assertIsInstance(state, list)
+        self.assertEqual(list(data.rows(1, 3)), [(1, 0.5, 't1', None), (2, 1.0, 't2', 'S')])
+        self.assertEqual(len(list(data.rows(990, 2000))), 10)
+
+        restored = pickle.loads(pickle.dumps(data))
+        self.assertEqual(list(restored.rows()), list(data.rows()))
+        # each distinct string crosses the pickle once, numbers as one buffer
+        self.assertEqual(restored.columns[2].values, ['t0', 't1', 't2'])
+        self.assertEqual(restored.columns[0].typecode, 'q')
+
+    def test_sample_counts_and_streams_every_row(self):
+        rows = [SimpleNamespace(n=i, name=f"t{i % 2}") for i in range(50)]
+        out = io.StringIO()
+        data = ResultColumns.from_result(iter(rows), 5, csv.writer(out))
+        self.assertEqual((len(data), data.total), (5, 50))
+        self.assertEqual(list(data.rows())[-1], (4, 't0'))
+        lines = out.getvalue().splitlines()
+        self.assertEqual((lines[0], lines[1], lines[-1], len(lines)), ('n,name', '0,t0', '49,t1', 51))
+
+        self.assertEqual(ResultColumns.from_result(iter(rows), 0).total, 50)
+        restored = pickle.loads(pickle.dumps(data))
+        self.assertEqual((len(restored), restored.total), (5, 50))
+        head = ResultColumns.from_result(iter(rows)).head(3)
+        self.assertEqual((list(head.rows()), head.total), ([(0, 't0'), (1, 't1'), (2, 't0')], 50))
+
+    def test_empty_and_mixed(self):
+        empty = ResultColumns.from_result(iter([]))
+        self.assertFalse(empty)
+        self.assertEqual(list(empty.rows()), [])
+        self.assertEqual(pack_column([1, 2.5]), [1, 2.5])
+        self.assertEqual(pack_column([1 << 70]), [1 << 70])
+        self.assertEqual(pack_column([1, 2]), array('q', [1, 2]))
+
+    def test_json_round_trip(self):
+        data = ResultColumns(['a', 'b'], [array('q', [1, 2]), pack_column(['x', 'x'])])
+        self.assertEqual(list(ResultColumns.from_json(data.to_json()).rows()), [(1, 'x'), (2, 'x')])
+        sample = ResultColumns.from_json(ResultColumns(data.names, data.columns, 10).to_json())
+        self.assertEqual((len(sample), sample.total), (2, 10))
+        legacy = ResultColumns.from_json([{'a': 1, 'b': 'x'}])
+        self.assertEqual((legacy.names, list(legacy.rows())), (['a', 'b'], [(1, 'x')]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from array import array
+
+from result_columns import ResultColumns
+from scenario_cache import ScenarioResultCache
+
+
+class TestScenarioResultCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmp_dir, 'results.sqlite')
+        self.trace = os.path.join(self.tmp_dir, 'trace.log')
+        with open(self.trace, 'w') as f:
+            f.write("trace\n")
+        self.query = {'desc': '-- Scenario 1: test', 'sql': '-- Scenario 1: test\nSELECT cpu FROM sched;'}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def cache(self, **kwargs):
+        return ScenarioResultCache(self.trace, path=self.db_path, **kwargs)
+
+    def test_hit_after_put_and_normalized_sql(self):
+        cache = self.cache()
+        self.assertIsNone(cache.get(self.query))
+        cache.put(self.query, {'desc': self.query['desc'], 'error': None, 'elapsed': 1.5,
+                               'data': ResultColumns(['cpu', 'comm'], [array('q', [0, 3]), ['a', None]])})
+        cache.put({'desc': 'x', 'sql': 'SELECT 1'}, {'data': None, 'error': 'boom'})
+        cache.close()
+
+        cache = self.cache()
+        reformatted = dict(self.query, sql="SELECT cpu\n  FROM sched  -- same query")
+        cached, missing = cache.split([reformatted, {'desc': 'x', 'sql': 'SELECT 1'}])
+        self.assertEqual(cached[0]['data'].names, ['cpu', 'comm'])
+        self.assertEqual(list(cached[0]['data'].rows()), [(0, 'a'), (3, None)])
+        self.assertEqual(cached[0]['cached_elapsed'], 1.5)
+        self.assertEqual([q['desc'] for q in missing], ['x'])
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertIsNone(cache.get(dict(self.query, sql='SELECT cpu FROM sched WHERE cpu = 1')))
+        # only a sample is cached: scenarios writing a full evidence file rerun
+        cached, missing = cache.split([dict(self.query, evidence='/tmp/scenario_1.csv')])
+        self.assertEqual((cached, len(missing)), ([], 1))
+        cache.close()
+
+        with open(self.trace, 'a') as f:
+            f.write("more\n")
+        cache = self.cache()
+        self.assertIsNone(cache.get(self.query))
+        cache.close()
+
+    def test_eviction_by_age_and_size(self):
+        cache = self.cache(max_bytes=10 ** 6)
+        result = {'data': [{'v': 'x' * 100}], 'error': None, 'elapsed': 0.1}
+        queries = [{'desc': str(i), 'sql': f'SELECT {i}'} for i in range(4)]
+        for query in queries:
+            cache.put(query, result)
+        cache.db.execute("UPDATE results SET created = ?, accessed = ? WHERE sql_hash IN "
+                         "(SELECT sql_hash FROM results ORDER BY rowid LIMIT 1)",
+                         (time.time() - 10 ** 9, time.time() - 10 ** 9))
+        cache.get(queries[1])
+        cache.max_bytes = 2 * len('[{"v": "' + 'x' * 100 + '"}]')
+        cache.evict()
+        self.assertEqual([cache.get(q) is not None for q in queries], [False, True, False, True])
+        cache.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
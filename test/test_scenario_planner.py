@@ -0,0 +1,134 @@
+import os
+import random
+import re
+import sqlite3
+import unittest
+from types import SimpleNamespace
+
+from scenario_planner import materialize, plan_scenarios, window_scenarios
+
+SQL_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        'skills', 'ftrace-analyzer', 'scripts', 'perfetto_analysis.sql')
+
+
+class SqliteTraceProcessor:
+    """Stands in for TraceProcessor.query() on the scheduling tables, backed by sqlite."""
+
+    def __init__(self):
+        self.db = sqlite3.connect(':memory:')
+        self.db.row_factory = lambda cur, row: SimpleNamespace(
+            **{col[0]: value for col, value in zip(cur.description, row)})
+        self.db.executescript("""
+            CREATE TABLE process (upid INTEGER PRIMARY KEY, name TEXT);
+            CREATE TABLE thread (utid INTEGER PRIMARY KEY, tid INTEGER, name TEXT,
+                                 upid INTEGER, is_main_thread INTEGER);
+            CREATE TABLE sched (id INTEGER PRIMARY KEY, ts INTEGER, dur INTEGER, cpu INTEGER,
+                                utid INTEGER, end_state TEXT, priority INTEGER);
+            CREATE TABLE thread_state (id INTEGER PRIMARY KEY, ts INTEGER, dur INTEGER,
+                                       cpu INTEGER, utid INTEGER, state TEXT, io_wait INTEGER,
+                                       blocked_function TEXT, waker_utid INTEGER);
+        """)
+        rng = random.Random(7)
+        self.db.executemany("INSERT INTO process VALUES (?, ?)",
+                            [(upid, f"proc{upid}") for upid in range(8)])
+        self.db.executemany("INSERT INTO thread VALUES (?, ?, ?, ?, ?)",
+                            [(utid, 1000 + utid, f"worker{utid % 25}",
+                              None if utid % 11 == 0 else utid % 8, int(utid % 8 == 0))
+                             for utid in range(40)])
+        ts = 0
+        sched, states = [], []
+        for i in range(5000):
+            ts += rng.randrange(1000, 100000)
+            utid = rng.randrange(40)
+            sched.append((i, ts, rng.randrange(1, 10 ** 9), rng.randrange(8), utid, 'S', 120))
+            state = rng.choice('RSDDZX')
+            dur = rng.randrange(1, 10 ** 10)
+            states.append((i, ts, dur, rng.randrange(8), utid, state, 0, None, rng.randrange(40)))
+        self.db.executemany("INSERT INTO sched VALUES (?, ?, ?, ?, ?, ?, ?)", sched)
+        self.db.executemany("INSERT INTO thread_state VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", states)
+
+    def query(self, sql):
+        if sql.strip().upper().startswith('INCLUDE'):
+            return []
+        sql = sql.replace('CREATE PERFETTO TABLE', 'CREATE TABLE')
+        return self.db.execute(sql).fetchall()
+
+
+def run_scenario(tp, sql):
+    rows = []
+    for stmt in (s.strip() for s in sql.split(';')):
+        if stmt:
+            rows = [vars(r) for r in tp.query(stmt)] or rows
+    return rows
+
+
+class TestScenarioPlanner(unittest.TestCase):
+    def setUp(self):
+        with open(SQL_FILE) as f:
+            parts = re.split(r'(?m)^(?=-- Scenario)', f.read())
+        self.queries = [{'desc': p.splitlines()[0], 'sql': p.strip()} for p in parts if p.strip()]
+
+    def test_shared_relations_found(self):
+        plan = plan_scenarios(self.queries)
+        users = {step.name: [i + 1 for i in step.users] for step in plan.steps}
+        self.assertEqual(users['ga_shared_sched_thread'], [3, 7, 28])
+        self.assertEqual(users['ga_shared_thread_state_thread'], [8, 9, 16, 22])
+        self.assertEqual(users['module linux.irqs'], [5, 6])
+        self.assertIn("IN ('D', 'S', 'X', 'Z')", plan.steps[-1].statements[0])
+
+    def test_results_unchanged(self):
+        original_tp, planned_tp = SqliteTraceProcessor(), SqliteTraceProcessor()
+        plan = plan_scenarios(self.queries)
+        stats = materialize(planned_tp, plan)
+        available = {s['name'] for s in stats if not s['error']}
+        self.assertIn('ga_shared_sched_thread', available)
+        self.assertIn('ga_shared_thread_state_thread', available)
+
+        planned = plan.apply(self.queries, available)
+        checked = 0
+        for query, rewritten in zip(self.queries, planned):
+            if 'original_sql' not in rewritten or 'INCLUDE' in query['sql']:
+                continue
+            expected = run_scenario(original_tp, query['sql'])
+            self.assertTrue(expected, query['desc'])
+            self.assertEqual(run_scenario(planned_tp, rewritten['sql']), expected, query['desc'])
+            checked += 1
+        self.assertEqual(checked, 7)
+
+    def test_window_bounds_every_time_relation(self):
+        windowed, steps = window_scenarios(self.queries, 10 ** 9, 2 * 10 ** 9)
+        tables = {step.name: [i + 1 for i in step.users] for step in steps}
+        self.assertEqual(tables['ga_window_sched'], [1, 2, 3, 7, 24, 28, 29, 30])
+        self.assertEqual(tables['ga_window_linux_hard_irqs'], [5])
+        self.assertNotRegex('\n'.join(q['sql'] for q in windowed),
+                            r'(?i)\b(FROM|JOIN)\s+(sched|thread_state|slice|counter)\b')
+
+        tp = SqliteTraceProcessor()
+        for step in steps:
+            if step.name in ('ga_window_sched', 'ga_window_thread_state'):
+                for stmt in step.statements:
+                    tp.query(stmt)
+        rows = run_scenario(tp, windowed[23]['sql'])
+        count = tp.query("SELECT count(*) AS n FROM sched WHERE ts <= 2000000000 "
+                         "AND ts + dur >= 1000000000")[0].n
+        self.assertEqual(rows[0]['sched_events'], count)
+        self.assertLess(count, 5000)
+
+        # shared relations are built on top of the windowed tables
+        plan = plan_scenarios(windowed)
+        available = {s['name'] for s in materialize(tp, plan) if not s['error']}
+        planned = plan.apply(windowed, available)
+        for i in (2, 7, 8):
+            self.assertIn('original_sql', planned[i])
+            self.assertEqual(run_scenario(tp, planned[i]['sql']), run_scenario(tp, windowed[i]['sql']))
+
+    def test_failed_step_keeps_original_sql(self):
+        plan = plan_scenarios(self.queries)
+        planned = plan.apply(self.queries, {'module linux.irqs'})
+        self.assertEqual(planned[2]['sql'], self.queries[2]['sql'])
+        self.assertNotIn('INCLUDE', planned[4]['sql'])
+        self.assertEqual(planned[4]['original_sql'], self.queries[4]['sql'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from scenario_scheduler import ScenarioTimings
+
+
+def _query(n):
+    return {'desc': f'-- Scenario {n}: test', 'sql': f'SELECT {n};'}
+
+
+class TestScenarioTimings(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'timings.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_estimate_scales_nearest_sample(self):
+        timings = ScenarioTimings(self.path)
+        self.assertIsNone(timings.estimate(_query(1), 1000))
+        timings.record(_query(1), 1000, 2.0)
+        timings.record(_query(1), 100000, 50.0)
+        self.assertAlmostEqual(timings.estimate(_query(1), 2000), 4.0)
+        self.assertAlmostEqual(timings.estimate(_query(1), 50000), 25.0)
+
+    def test_longest_first_with_unknown_first(self):
+        timings = ScenarioTimings(self.path)
+        queries = [_query(i) for i in range(4)]
+        timings.record(queries[0], 1000, 1.0)
+        timings.record(queries[1], 1000, 5.0)
+        timings.record(queries[3], 1000, 3.0)
+        ordered = timings.longest_first(queries, 1000)
+        self.assertEqual([q['sql'] for q in ordered],
+                         [queries[i]['sql'] for i in (2, 1, 3, 0)])
+        self.assertIsNone(ordered[0]['estimate'])
+        self.assertAlmostEqual(ordered[1]['estimate'], 5.0)
+
+    def test_save_load_round_trip(self):
+        timings = ScenarioTimings(self.path)
+        timings.record(_query(1), 1000, 1.5)
+        timings.save()
+        loaded = ScenarioTimings.load(self.path)
+        self.assertEqual(loaded.scenarios, timings.scenarios)
+        edited = dict(_query(1), sql='SELECT 1 + 0;')
+        self.assertIsNone(loaded.estimate(edited, 1000))
+
+
+if __name__ == '__main__':
+    unittest.main()
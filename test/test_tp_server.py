@@ -0,0 +1,60 @@
+import os
+import socket
+import stat
+import sys
+import tempfile
+import unittest
+
+from tp_server import TraceProcessorServer, format_ingest
+
+# 模拟 trace_processor_shell -D --http-port N trace：先“加载”再监听端口
+FAKE_SHELL = '''#!{python}
+import socket, sys, time
+port = int(sys.argv[sys.argv.index('--http-port') + 1])
+if sys.argv[-1].endswith('.bad'):
+    sys.stderr.write("could not parse trace\\n")
+    sys.exit(2)
+time.sleep(0.2)
+server = socket.socket()
+server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+server.bind(('127.0.0.1', port))
+server.listen(8)
+while True:
+    conn, _ = server.accept()
+    conn.close()
+'''
+
+
+class TestTraceProcessorServer(unittest.TestCase):
+    def setUp(self):
+        fd, self.tp_bin = tempfile.mkstemp(suffix='.py')
+        with os.fdopen(fd, 'w') as f:
+            f.write(FAKE_SHELL.format(python=sys.executable))
+        os.chmod(self.tp_bin, os.stat(self.tp_bin).st_mode | stat.S_IXUSR)
+
+    def tearDown(self):
+        os.remove(self.tp_bin)
+
+    def test_start_reports_ingest_and_stops(self):
+        server = TraceProcessorServer('trace.pftrace', self.tp_bin).start()
+        try:
+            self.assertGreaterEqual(server.ingest_seconds, 0.2)
+            with socket.create_connection(('127.0.0.1', server.port), timeout=1):
+                pass
+            stats = server.stats()
+            if sys.platform.startswith('linux'):
+                self.assertGreater(stats['peak_rss'], 0)
+            self.assertIn('shared trace_processor server', format_ingest(stats))
+        finally:
+            process = server.process
+            server.stop()
+        self.assertIsNotNone(process.returncode)
+
+    def test_failed_load_raises(self):
+        with self.assertRaises(RuntimeError) as ctx:
+            TraceProcessorServer('trace.bad', self.tp_bin).start()
+        self.assertIn('could not parse trace', str(ctx.exception))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+
+from tp_session import TraceProcessorSession, limit_sql, required_modules, split_statements
+
+
+class RecordingTraceProcessor:
+    def __init__(self):
+        self.statements = []
+
+    def query(self, sql):
+        self.statements.append(sql)
+        return [sql]
+
+    def close(self):
+        pass
+
+
+class TestSplitStatements(unittest.TestCase):
+    def test_semicolons_in_strings_and_comments(self):
+        sql = """-- Scenario: a; b
+INCLUDE PERFETTO MODULE sched.latency;
+/* block; comment */ SELECT 'x;y' AS "a;b", name -- trailing; comment
+FROM slice WHERE name = 'it''s;here';
+;"""
+        self.assertEqual(split_statements(sql), [
+            "INCLUDE PERFETTO MODULE sched.latency",
+            "SELECT 'x;y' AS \"a;b\", name \nFROM slice WHERE name = 'it''s;here'",
+        ])
+
+    def test_required_modules(self):
+        sqls = ["INCLUDE PERFETTO MODULE linux.irqs; SELECT 1;",
+                "-- INCLUDE PERFETTO MODULE not.used;\nINCLUDE PERFETTO MODULE sched.latency;",
+                "include perfetto module linux.irqs;"]
+        self.assertEqual(required_modules(sqls), ['linux.irqs', 'sched.latency'])
+
+    def test_limit_wraps_last_row_statement(self):
+        self.assertEqual(limit_sql("INCLUDE PERFETTO MODULE a.b;\nSELECT * FROM sched ORDER BY dur DESC;", 10),
+                         "INCLUDE PERFETTO MODULE a.b;\nSELECT * FROM (SELECT * FROM sched ORDER BY dur DESC) LIMIT 10")
+        self.assertTrue(limit_sql("with x AS (SELECT 1) SELECT * FROM x", 5).endswith(") LIMIT 5"))
+        sql = "CREATE PERFETTO TABLE t AS SELECT 1"
+        self.assertEqual(limit_sql(sql, 5), sql)
+
+
+class TestTraceProcessorSession(unittest.TestCase):
+    def test_includes_are_deduplicated(self):
+        tp = RecordingTraceProcessor()
+        session = TraceProcessorSession(tp, loaded=['linux.irqs'])
+        self.assertGreaterEqual(session.prewarm(['sched.latency', 'linux.irqs']), 0.0)
+        result = session.execute("INCLUDE PERFETTO MODULE sched.latency;\n"
+                                 "INCLUDE PERFETTO MODULE linux.irqs;\nSELECT 1;")
+        self.assertEqual(result, ['SELECT 1'])
+        self.assertEqual(tp.statements, ['INCLUDE PERFETTO MODULE sched.latency', 'SELECT 1'])
+        self.assertEqual(session.skipped_includes, 3)
+
+    def test_results_yield_each_select(self):
+        session = TraceProcessorSession(RecordingTraceProcessor())
+        self.assertEqual(list(session.results("SELECT 1; INCLUDE PERFETTO MODULE a.b; SELECT 2")),
+                         [['SELECT 1'], ['SELECT 2']])
+        self.assertIsNone(session.execute("-- only a comment;"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+import trace_codec
+from ftrace_reader import TraceReader
+from trace_codec import (DecompressedCache, compression, iter_decompressed, load_decompressed,
+                         open_output)
+
+
+class TestTraceCodec(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.tmp, 'trace.log')
+        with open(self.log_path, 'w') as f:
+            f.write("# tracer: nop\n#\n")
+            for i in range(5000):
+                f.write(f"  bash-{1000 + i % 7}  [{i % 4:03d}] d..2 {100 + i * 0.001:.6f}: "
+                        f"sched_wakeup: comm=kworker/{i % 9} pid={i} prio=120\n")
+            f.write("  bash-1000  [000] d..2 105.000000: tracing_mark_write: no newline")
+        with open(self.log_path, 'rb') as f:
+            self.data = f.read()
+        # a renamed file is still recognised by its magic bytes
+        self.gz_path = os.path.join(self.tmp, 'trace.archived')
+        with gzip.open(self.gz_path, 'wb') as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_compression_and_streaming(self):
+        self.assertEqual((compression(self.log_path), compression(self.gz_path)), (None, 'gzip'))
+        self.assertEqual(b''.join(iter_decompressed(self.gz_path, block_size=1000)), self.data)
+        # stopping early releases the background thread
+        blocks = iter_decompressed(self.gz_path, block_size=100, read_ahead=2)
+        self.assertEqual(next(blocks), self.data[:100])
+        blocks.close()
+
+        broken = os.path.join(self.tmp, 'broken.gz')
+        with open(broken, 'wb') as f:
+            f.write(gzip.compress(self.data)[:2000])
+        with self.assertRaises(EOFError):
+            b''.join(iter_decompressed(broken))
+
+    def test_reader_streams_compressed_lines(self):
+        with TraceReader(self.log_path) as plain, TraceReader(self.gz_path) as packed:
+            self.assertIsNone(packed.size)
+            self.assertEqual(packed.split_ranges(4), [(0, None)])
+            self.assertEqual(list(packed.iter_data_lines()), list(plain.iter_data_lines()))
+            self.assertEqual(list(packed.iter_lines(b'kworker/3')), list(plain.iter_lines(b'kworker/3')))
+            with self.assertRaises(ValueError):
+                list(packed.iter_chunks(0, 100))
+
+    def test_compressed_output(self):
+        out_path = os.path.join(self.tmp, 'out.log.gz')
+        with open_output(out_path, buffering=4096) as out:
+            for i in range(20000):
+                out.write(f"line {i}\n")
+        with gzip.open(out_path, 'rt') as f:
+            self.assertEqual(f.read(), ''.join(f"line {i}\n" for i in range(20000)))
+
+    @unittest.skipIf(trace_codec.zstandard is not None, "zstandard is installed")
+    def test_zstd_needs_zstandard(self):
+        with self.assertRaises(RuntimeError):
+            open_output(os.path.join(self.tmp, 'out.log.zst'))
+
+    def test_load_decompressed_is_cached(self):
+        self.assertEqual(load_decompressed(self.log_path), (self.log_path, False))
+        cache = DecompressedCache(os.path.join(self.tmp, 'cache'))
+        path = cache.get(self.gz_path)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertEqual(cache.get(self.gz_path), path)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
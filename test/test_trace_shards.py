@@ -0,0 +1,106 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import ftrace_file
+from trace_shards import ShardCache, ShardSpec, load_shard, parse_cpu_list, parse_event_list, write_shards
+
+
+class TestTraceShards(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.tmp, 'trace.log')
+        # 小块大小让测试文件也能切出多个索引块
+        self._block_size = ftrace_file.BLOCK_SIZE
+        ftrace_file.BLOCK_SIZE = 4096
+        with open(self.log_path, 'w') as f:
+            f.write("# tracer: nop\n#\n")
+            ts = 100.0
+            for i in range(1200):
+                ts += 0.001
+                cpu = i % 4
+                if i % 3 == 0:
+                    f.write(f"  bash-1000  [{cpu:03d}] d..2 {ts:.6f}: sched_switch: "
+                            f"prev_comm=bash prev_pid=1000 prev_prio=120 prev_state=S ==> "
+                            f"next_comm=swapper/{cpu} next_pid=0 next_prio=120\n")
+                elif i % 3 == 1:
+                    f.write(f"  <idle>-0  [{cpu:03d}] d.h1 {ts:.6f}: irq_handler_entry: irq=27 name=eth0\n")
+                else:
+                    f.write(f"  bash-1000  [{cpu:03d}] .... {ts:.6f}: tracing_mark_write: B|1000|draw\n")
+                    f.write(" => __schedule\n => schedule\n")
+
+    def tearDown(self):
+        ftrace_file.BLOCK_SIZE = self._block_size
+        shutil.rmtree(self.tmp)
+
+    def _events(self, path):
+        events = []
+        with open(path) as f:
+            lines = f.read().splitlines()
+        for line in lines:
+            if line.startswith('#') or line.startswith(' =>'):
+                continue
+            head, _, _ = line.partition(': ')
+            cpu = int(head.split('[')[1].split(']')[0])
+            ts = float(head.split()[-1])
+            events.append((ts, cpu, line.split(': ')[1]))
+        return lines, events
+
+    def test_parse_lists(self):
+        self.assertEqual(parse_cpu_list("0-2,6"), frozenset({0, 1, 2, 6}))
+        self.assertEqual(parse_event_list("sched_*, irq_*"), ('irq_*', 'sched_*'))
+
+    def test_filters_by_time_cpu_and_event(self):
+        out = os.path.join(self.tmp, 'shard.txt')
+        spec = ShardSpec(100.3, 100.6, frozenset({1, 2}), ('sched_*', 'tracing_*'))
+        write_shards(self.log_path, [spec], [out])
+        lines, events = self._events(out)
+        self.assertEqual(lines[:2], ["# tracer: nop", "#"])
+        self.assertTrue(events)
+        for ts, cpu, event in events:
+            self.assertTrue(100.3 <= ts <= 100.6)
+            self.assertIn(cpu, (1, 2))
+            self.assertIn(event, ('sched_switch', 'tracing_mark_write'))
+        # the stack lines stay with the events they belong to
+        marks = sum(1 for _, _, event in events if event == 'tracing_mark_write')
+        self.assertEqual(sum(1 for line in lines if line.startswith(' =>')), 2 * marks)
+
+    def test_one_pass_writes_several_shards(self):
+        specs = [ShardSpec(cpus=frozenset({cpu})) for cpu in range(4)]
+        outs = [os.path.join(self.tmp, f'cpu{cpu}.txt') for cpu in range(4)]
+        sizes = write_shards(self.log_path, specs, outs)
+        self.assertEqual(sizes, [os.path.getsize(p) for p in outs])
+        counts = [len(self._events(p)[1]) for p in outs]
+        self.assertEqual(counts, [300] * 4)
+
+    def test_time_only_shard_matches_window(self):
+        out = os.path.join(self.tmp, 'window.txt')
+        write_shards(self.log_path, [ShardSpec(100.2, 100.9)], [out])
+        _, events = self._events(out)
+        _, everything = self._events(self.log_path)
+        self.assertEqual(events, [e for e in everything if 100.2 <= e[0] <= 100.9])
+
+    def test_shard_cache_reuses_shards(self):
+        cache = ShardCache(directory=os.path.join(self.tmp, 'shards'), max_bytes=1 << 30)
+        spec = ShardSpec(events=('irq_*',))
+        path = cache.get(self.log_path, spec)
+        mtime = os.path.getmtime(path)
+        self.assertEqual(cache.get(self.log_path, spec), path)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertGreaterEqual(os.path.getmtime(path), mtime)
+        self.assertEqual(len(self._events(path)[1]), 400)
+
+    def test_load_shard_without_cache_is_temporary(self):
+        os.environ['FTRACE_CACHE'] = '0'
+        try:
+            path, temporary = load_shard(self.log_path, ShardSpec(cpus=frozenset({0})))
+        finally:
+            del os.environ['FTRACE_CACHE']
+        self.assertTrue(temporary)
+        os.remove(path)
+        self.assertEqual(load_shard(self.log_path, ShardSpec()), (self.log_path, False))
+
+
+if __name__ == '__main__':
+    unittest.main()
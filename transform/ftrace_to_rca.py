@@ -1,21 +1,453 @@
 import os
 import re
+import sys
 import argparse
+import fnmatch
+import json
+import shutil
+import signal
+import stat
+import tempfile
+import threading
 import time
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+# 共享的 mmap 日志读取模块位于 ftrace-analyzer skill 的 scripts 目录
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                           'skills', 'ftrace-analyzer', 'scripts')
+sys.path.insert(0, SCRIPTS_DIR)
+
+from ftrace_file import TraceFile
+from ftrace_reader import TraceReader, split_file_ranges
+from trace_codec import compression, open_output, output_compression
+from trace_shards import parse_cpu_list, parse_event_list
 
 # 预编译正则表达式以提高性能
 FTRACE_PATTERN = re.compile(
     r"^\s*(?P<task>.*?)-(?P<pid>\d+)\s+\[(?P<cpu>\d+)\]\s+(?P<flags>\S{4,5})\s+(?P<timestamp>[\d.]+):\s+(?P<message>.*)$"
 )
 
+# 输出使用较大的缓冲区 (8MB) 提高 I/O 性能
+OUTPUT_BUFFER = 8 * 1024 * 1024
+
+# 并行模式下每个进程分到的字节段数：段越多负载越均衡，段的合并开销可忽略
+SEGMENTS_PER_JOB = 4
+
+# --follow 模式每批最多转换的字节数：积压较多时分批追赶，保证检查点足够频繁
+FOLLOW_BATCH_BYTES = 64 * 1024 * 1024
+
+# --follow 检查点文件格式版本
+CHECKPOINT_VERSION = 1
+
+# 输出时间戳的格式（秒级精度）
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+# 整秒边界两侧的保护带（秒）：timedelta 按微秒舍入，离边界不足半微秒的
+# 时间戳可能被舍入到相邻的一秒，这类时间戳总是走完整的 datetime 计算
+SECOND_GUARD = 1e-6
+
+class SecondFormatter:
+    """ftrace 时间戳（秒）-> 输出时间字符串，按整秒缓存
+
+    输出只有秒级精度，连续的大量事件落在同一秒内：format() 计算一次
+    base_dt + timedelta 和 strftime，同时返回这一秒在 ftrace 时间轴上的
+    [lo, hi) 区间，调用方对落在区间内的时间戳直接复用字符串，
+    每行只剩一次浮点比较。结果与逐行计算逐字节一致。
+    """
+
+    def __init__(self, base_dt: datetime):
+        self.base_dt = base_dt
+        self._base_second = base_dt.replace(microsecond=0)
+        self._offset = base_dt.microsecond / 1e6
+
+    def format(self, timestamp_s: float):
+        """返回 (时间字符串, lo, hi)；[lo, hi) 内的时间戳格式化结果都相同"""
+        event_dt = self.base_dt + timedelta(seconds=timestamp_s)
+        # 事件所在的秒（相对基准时间所在的秒），换算回 ftrace 时间轴上的区间
+        second = (event_dt.replace(microsecond=0) - self._base_second) // timedelta(seconds=1)
+        lo = second - self._offset + SECOND_GUARD
+        hi = second + 1 - self._offset - SECOND_GUARD
+        return event_dt.strftime(TIMESTAMP_FORMAT), lo, hi
+
+def parse_pid_list(text: str) -> FrozenSet[int]:
+    """``"1234,5678"`` -> {1234, 5678}"""
+    return frozenset(int(part) for part in text.split(',') if part.strip())
+
+def _is_literal(pattern: str) -> bool:
+    return not any(c in pattern for c in '*?[')
+
+class EventFilter:
+    """转换前的事件过滤条件，None 表示该维度不过滤
+
+    events/comms 为 fnmatch 模式（如 sched_*），cpus/pids 为整数集合，
+    [start, end] 为 ftrace 时间戳窗口（秒，闭区间）。过滤分三层，越早丢弃越省：
+    1. index_ranges()：时间窗口/CPU/PID 借助 TraceFile 索引下推到字节范围，
+       不相关的索引块根本不读取；
+    2. needles：被保留的行必然包含的字节串（事件名、PID、进程名或 CPU 之一），
+       不含这些字节串的行在原始字节上就被跳过，不会解码和正则匹配；
+    3. accepts()：正则解析后按各字段精确判断。
+    """
+
+    def __init__(self, events: Optional[Tuple[str, ...]] = None, cpus: Optional[FrozenSet[int]] = None,
+                 pids: Optional[FrozenSet[int]] = None, comms: Optional[Tuple[str, ...]] = None,
+                 start: Optional[float] = None, end: Optional[float] = None):
+        self.events = events
+        self.cpus = cpus
+        self.pids = pids
+        self.comms = comms
+        self.start = start
+        self.end = end
+        # 事件名/进程名 -> 是否匹配，避免每行都做 fnmatch
+        self._event_ok: Dict[str, bool] = {}
+        self._comm_ok: Dict[str, bool] = {}
+
+    @property
+    def is_empty(self) -> bool:
+        return all(v is None for v in (self.events, self.cpus, self.pids, self.comms, self.start, self.end))
+
+    def describe(self) -> str:
+        parts = []
+        if self.events is not None:
+            parts.append(f"事件 {','.join(self.events)}")
+        if self.cpus is not None:
+            parts.append(f"CPU {','.join(map(str, sorted(self.cpus)))}")
+        if self.pids is not None:
+            parts.append(f"PID {','.join(map(str, sorted(self.pids)))}")
+        if self.comms is not None:
+            parts.append(f"进程 {','.join(self.comms)}")
+        if self.start is not None or self.end is not None:
+            parts.append(f"时间 {self.start if self.start is not None else '-'} - "
+                         f"{self.end if self.end is not None else '-'} s")
+        return ', '.join(parts) or '不过滤'
+
+    @property
+    def needles(self) -> Optional[Tuple[bytes, ...]]:
+        """每个被保留的行都至少包含其中一个字节串；None 表示无法在字节层面预过滤"""
+        if self.events is not None and all(map(_is_literal, self.events)):
+            return tuple(e.encode() + b':' for e in self.events)
+        if self.pids is not None:
+            return tuple(b'-%d' % pid for pid in sorted(self.pids))
+        if self.comms is not None and all(map(_is_literal, self.comms)):
+            # task 列的格式为 comm-pid
+            return tuple(c.encode() + b'-' for c in self.comms)
+        if self.cpus is not None:
+            # 内核按 [%03d] 输出 CPU 号，不补零的写法也一并匹配
+            return tuple(sorted({b'[%03d]' % c for c in self.cpus} | {b'[%d]' % c for c in self.cpus}))
+        return None
+
+    def accepts(self, data: Dict[str, str], timestamp_s: float) -> bool:
+        """FTRACE_PATTERN 解析出的一行是否满足全部条件"""
+        if (self.start is not None and timestamp_s < self.start) or \
+                (self.end is not None and timestamp_s > self.end):
+            return False
+        if self.cpus is not None and int(data['cpu']) not in self.cpus:
+            return False
+        if self.pids is not None and int(data['pid']) not in self.pids:
+            return False
+        if self.comms is not None:
+            task = data['task']
+            ok = self._comm_ok.get(task)
+            if ok is None:
+                ok = self._comm_ok[task] = any(fnmatch.fnmatchcase(task, p) for p in self.comms)
+            if not ok:
+                return False
+        if self.events is not None:
+            event = data['message'].partition(':')[0]
+            ok = self._event_ok.get(event)
+            if ok is None:
+                ok = self._event_ok[event] = any(fnmatch.fnmatchcase(event, p) for p in self.events)
+            if not ok:
+                return False
+        return True
+
+    def index_ranges(self, input_path: str, jobs: int = 1) -> Optional[List[Tuple[int, int]]]:
+        """时间窗口/CPU/PID 条件下推后需要读取的字节范围；没有这类条件或输入是压缩文件时返回 None
+
+        使用 TraceFile 的旁路索引（<input>.index，首次使用时建立并保存，之后复用）：
+        只保留时间范围与窗口相交、且在 CPU/PID 倒排表中的索引块。
+        """
+        if self.start is None and self.end is None and self.cpus is None and self.pids is None:
+            return None
+        if compression(input_path):
+            return None
+        trace = TraceFile(input_path)
+        trace.build_index(jobs=jobs)
+        selected = None
+        for kind, keys in (('cpu', self.cpus), ('pid', self.pids)):
+            if keys is not None:
+                ids = set()
+                for key in keys:
+                    ids.update(trace.postings(kind, key))
+                selected = ids if selected is None else selected & ids
+        ranges = []
+        for block_id, (_, ts_min, ts_max, _) in enumerate(trace.blocks):
+            if ts_min is None or (selected is not None and block_id not in selected):
+                continue
+            if (self.end is not None and ts_min > self.end) or (self.start is not None and ts_max < self.start):
+                continue
+            begin, stop = trace.block_range(block_id)
+            if ranges and ranges[-1][1] == begin:
+                ranges[-1] = (ranges[-1][0], stop)
+            else:
+                ranges.append((begin, stop))
+        return ranges
+
+def window_header(base_dt: datetime, base_time: str) -> str:
+    """输出文件第一行的 window 信息（基准时间起 30 分钟）"""
+    window_end = (base_dt + timedelta(minutes=30)).strftime(TIMESTAMP_FORMAT)
+    return f"window={base_time}-{window_end} start_utc={base_time} end_utc={window_end} tag=ftrace_transform\n"
+
+def convert_reader(reader: TraceReader, start: int, end: int, base_dt: datetime, fout,
+                   progress=None, event_filter: Optional[EventFilter] = None) -> int:
+    """把已打开的 reader 中 [start, end) 字节范围内的事件转换为 RCA 日志行写入 fout，返回转换的行数
+
+    给定 event_filter 时只转换满足条件的事件。
+    """
+    count = 0
+    write = fout.write
+    # 当前整秒的时间字符串及其时间戳区间；初始区间为空
+    format_second = SecondFormatter(base_dt).format
+    ts_str, lo, hi = '', 1.0, 0.0
+    accepts = None
+    lines = None
+    if event_filter is not None and not event_filter.is_empty:
+        accepts = event_filter.accepts
+        needles = event_filter.needles
+        if needles:
+            # 字节级预过滤：不含任何 needle 的行不会被解码，也不做正则匹配
+            lines = reader.iter_lines(needles, start, end)
+    if lines is None:
+        lines = reader.iter_data_lines(start, end)
+    # 为了极致性能，将循环内的逻辑尽量展平，减少函数调用
+    for line in lines:
+        match = FTRACE_PATTERN.match(line)
+        if not match:
+            continue
+
+        data = match.groupdict()
+
+        # 时间转换优化：同一秒内的事件复用已格式化的字符串，只有跨秒时才重新计算
+        timestamp_s = float(data['timestamp'])
+        if accepts is not None and not accepts(data, timestamp_s):
+            continue
+        if not lo <= timestamp_s < hi:
+            ts_str, lo, hi = format_second(timestamp_s)
+
+        # 组装输出行
+        write(f"{ts_str} ftrace: [CPU {data['cpu']}] {data['task']}-{data['pid']}: {data['message']}\n")
+
+        count += 1
+        # 每 100,000 行打印一次进度
+        if progress and count % 100000 == 0:
+            progress(count)
+    return count
+
+def convert_range(input_path: str, start: int, end: Optional[int], base_dt: datetime, fout,
+                  progress=None, event_filter: Optional[EventFilter] = None) -> int:
+    """把 [start, end) 字节范围内的事件转换为 RCA 日志行写入 fout，返回转换的行数
+
+    start/end 必须位于行边界（见 split_file_ranges），end 为 None 表示到文件末尾；
+    压缩的输入 (.gz/.zst) 只能整体转换 (0, None)。串行模式与并行 worker
+    共用本函数，保证两条路径的输出逐字节一致。progress(count) 每 100,000 行调用一次。
+    """
+    # 输入通过 mmap 读取：注释行和 buffer started 行在字节层面剔除，不会被解码
+    with TraceReader(input_path) as reader:
+        return convert_reader(reader, start, end, base_dt, fout, progress, event_filter)
+
+def convert_ranges(input_path: str, ranges: List[Tuple[int, int]], base_dt: datetime, fout,
+                   progress=None, event_filter: Optional[EventFilter] = None) -> int:
+    """依次转换多个字节范围（如索引下推得到的范围），返回转换的行数"""
+    count = 0
+    with TraceReader(input_path) as reader:
+        for start, end in ranges:
+            done = count
+            count += convert_reader(reader, start, end, base_dt, fout,
+                                    progress and (lambda n: progress(done + n)), event_filter)
+    return count
+
+def split_segments(input_path: str, ranges: List[Tuple[int, int]], parts: int) -> List[Tuple[int, int]]:
+    """把若干换行对齐的字节范围切成总数约为 parts、大小相近的换行对齐字节段"""
+    total = sum(end - start for start, end in ranges)
+    target = max(1, total // max(1, parts))
+    segments = []
+    with TraceReader(input_path) as reader:
+        for start, end in ranges:
+            pos = start
+            while end - pos > target:
+                cut = reader.line_boundary(pos + target)
+                if cut >= end:
+                    break
+                segments.append((pos, cut))
+                pos = cut
+            segments.append((pos, end))
+    return segments
+
+def _convert_range_worker(args) -> int:
+    """并行 worker：把一个字节段转换到自己的临时分段文件"""
+    input_path, start, end, base_dt, event_filter, segment_path = args
+    with open(segment_path, 'w', encoding='utf-8', buffering=OUTPUT_BUFFER) as fout:
+        return convert_range(input_path, start, end, base_dt, fout, event_filter=event_filter)
+
+def convert_parallel(input_path: str, fout, base_dt: datetime, jobs: int, progress=None,
+                     event_filter: Optional[EventFilter] = None,
+                     ranges: Optional[List[Tuple[int, int]]] = None) -> int:
+    """按换行对齐的字节段多进程转换，再按原顺序拼接各段输出，返回转换的行数
+
+    ranges 为只需读取的字节范围（默认整个文件）。每段写入输出目录下的临时文件；
+    executor.map 按提交顺序返回，某段完成后立即追加到 fout 并删除，
+    因此临时文件不会积压整份输出。
+    """
+    if ranges is None:
+        ranges = split_file_ranges(input_path, jobs * SEGMENTS_PER_JOB)
+    else:
+        ranges = split_segments(input_path, ranges, jobs * SEGMENTS_PER_JOB)
+    out_dir = os.path.dirname(os.path.abspath(fout.name))
+    tmp_dir = tempfile.mkdtemp(prefix='.ftrace_rca_', dir=out_dir)
+    count = 0
+    try:
+        tasks = [(input_path, start, end, base_dt, event_filter, os.path.join(tmp_dir, f"segment_{i:05d}"))
+                 for i, (start, end) in enumerate(ranges)]
+        if not tasks:
+            return 0
+        with ProcessPoolExecutor(max_workers=min(jobs, len(tasks))) as executor:
+            for task, segment_count in zip(tasks, executor.map(_convert_range_worker, tasks)):
+                segment_path = task[-1]
+                fout.flush()
+                with open(segment_path, 'rb') as segment:
+                    shutil.copyfileobj(segment, fout.buffer, OUTPUT_BUFFER)
+                os.remove(segment_path)
+                count += segment_count
+                if progress:
+                    progress(count)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return count
+
+def load_checkpoint(path: str, input_path: str, base_time: str, filter_desc: Optional[str] = None):
+    """读取 --follow 检查点；文件不存在、损坏或与本次的输入/基准时间/过滤条件不匹配时返回 None"""
+    try:
+        with open(path) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if (state.get('version') != CHECKPOINT_VERSION or state.get('input') != os.path.abspath(input_path)
+            or state.get('base_time') != base_time or state.get('filter') != filter_desc):
+        return None
+    return state
+
+def save_checkpoint(path: str, state: dict):
+    """原子地写入检查点（先写临时文件再 rename），中途崩溃不会留下半个检查点"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+def follow(input_path: str, output_path: str, base_dt: datetime, base_time: str,
+           checkpoint: str = None, poll_interval: float = 0.5, idle_exit: float = None,
+           stop: threading.Event = None, event_filter: Optional[EventFilter] = None) -> int:
+    """持续跟踪增长中的 ftrace 日志，把新增的完整行转换后追加到输出，返回本次转换的行数
+
+    已处理的输入字节偏移和对应的输出大小在每批转换后写入检查点
+    （默认 <output>.checkpoint）。重启时输出先截断到检查点记录的大小，
+    再从记录的偏移继续，检查点之后写了一半的批次会被丢弃重做，
+    因此每个事件恰好输出一次。输入被截断或替换（inode 变化）时从头开始。
+    新数据最迟在 poll_interval 秒后被转换并刷新到输出；
+    连续 idle_exit 秒没有新数据或 stop 被设置时返回。
+    给定 event_filter 时只转换满足条件的事件（只做按行过滤，不使用索引）；
+    过滤条件记录在检查点中，条件改变后从头开始。
+    """
+    checkpoint = checkpoint or output_path + '.checkpoint'
+    stop = stop or threading.Event()
+    st = os.stat(input_path)
+    if not stat.S_ISREG(st.st_mode):
+        raise ValueError(f"--follow 需要普通文件 (例如 cat trace_pipe >> trace.log 的输出): {input_path}")
+    # 压缩流无法按字节偏移续读，也无法截断到检查点
+    if compression(input_path) or output_compression(output_path):
+        raise ValueError("--follow 不支持压缩的输入或输出")
+
+    filter_desc = None if event_filter is None or event_filter.is_empty else event_filter.describe()
+    state = load_checkpoint(checkpoint, input_path, base_time, filter_desc)
+    if (state and (state['dev'], state['ino']) == (st.st_dev, st.st_ino) and state['offset'] <= st.st_size
+            and os.path.exists(output_path) and os.path.getsize(output_path) >= state['output_bytes']):
+        os.truncate(output_path, state['output_bytes'])
+        offset = state['offset']
+        print(f"从检查点恢复: 输入偏移 {offset}, 输出 {state['output_bytes']} 字节")
+    else:
+        offset = 0
+        with open(output_path, 'w', encoding='utf-8') as fout:
+            fout.write(window_header(base_dt, base_time))
+    identity = (st.st_dev, st.st_ino)
+
+    count = 0
+    next_report = 100000
+    start_time = time.time()
+    idle_since = time.monotonic()
+    with open(output_path, 'a', encoding='utf-8', buffering=OUTPUT_BUFFER) as fout:
+        while not stop.is_set():
+            st = os.stat(input_path)
+            if (st.st_dev, st.st_ino) != identity or st.st_size < offset:
+                print("输入文件被截断或替换，从头开始跟踪")
+                identity, offset = (st.st_dev, st.st_ino), 0
+            end = offset
+            if st.st_size > offset:
+                with TraceReader(input_path) as reader:
+                    # 只转换完整的行：写入方可能正写到一行的中间
+                    end = reader.complete_end(offset, offset + FOLLOW_BATCH_BYTES)
+                    if end > offset:
+                        count += convert_reader(reader, offset, end, base_dt, fout, event_filter=event_filter)
+            if end > offset:
+                offset = end
+                fout.flush()
+                save_checkpoint(checkpoint, {
+                    'version': CHECKPOINT_VERSION, 'input': os.path.abspath(input_path),
+                    'dev': identity[0], 'ino': identity[1], 'offset': offset,
+                    'output_bytes': os.fstat(fout.fileno()).st_size, 'base_time': base_time,
+                    'filter': filter_desc,
+                })
+                if count >= next_report:
+                    elapsed = time.time() - start_time
+                    print(f"已处理 {count} 条记录... 当前速度: {count / elapsed if elapsed > 0 else 0:.0f} 条/秒")
+                    next_report = (count // 100000 + 1) * 100000
+                idle_since = time.monotonic()
+                # 还有积压时不等待，直接转换下一批
+                continue
+            if idle_exit is not None and time.monotonic() - idle_since >= idle_exit:
+                break
+            stop.wait(poll_interval)
+    return count
+
 def main():
     parser = argparse.ArgumentParser(description="将 ftrace 日志转换为 kernel.log 文本格式 (高性能版)")
-    parser.add_argument("--input", default="/opt/src/LogixAgent/logs/ftrace/trace.log", help="输入的 ftrace 日志路径")
-    parser.add_argument("--output", default="/opt/src/LogixAgent/transform/ftrace_rca.log", help="输出的 RCA Log 路径")
+    parser.add_argument("--input", default="/opt/src/LogixAgent/logs/ftrace/trace.log", help="输入的 ftrace 日志路径 (可以是 .gz/.zst 压缩文件)")
+    parser.add_argument("--output", default="/opt/src/LogixAgent/transform/ftrace_rca.log",
+                        help="输出的 RCA Log 路径 (以 .gz/.zst 结尾时压缩输出)")
     parser.add_argument("--base_time", default="2026-01-09T10:38:15Z", help="基准 ISO 时间戳")
-    
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="并行转换的进程数 (默认 1，即串行；输出与串行逐字节一致)")
+    parser.add_argument("--follow", "-f", action="store_true",
+                        help="持续跟踪增长中的输入，增量追加输出；进度保存在检查点中，重启后断点续转")
+    parser.add_argument("--poll_interval", type=float, default=0.5,
+                        help="--follow 检查新数据的间隔秒数，即输出的最大延迟 (默认 0.5)")
+    parser.add_argument("--checkpoint", help="--follow 检查点文件路径 (默认 <output>.checkpoint)")
+    parser.add_argument("--idle_exit", type=float,
+                        help="--follow 连续这么多秒没有新数据时退出 (默认一直运行)")
+    filters = parser.add_argument_group("事件过滤 (只转换满足全部条件的事件，在正则解析之前下推)")
+    filters.add_argument("--events", type=parse_event_list,
+                         help="只保留这些事件，逗号分隔，支持通配符 (例如 sched_switch,irq_*)")
+    filters.add_argument("--cpus", type=parse_cpu_list, help="只保留这些 CPU (例如 0-3,6)")
+    filters.add_argument("--pids", type=parse_pid_list, help="只保留这些 PID，逗号分隔")
+    filters.add_argument("--comms", type=parse_event_list,
+                         help="只保留这些进程名，逗号分隔，支持通配符 (例如 kworker/*)")
+    filters.add_argument("--window", nargs=2, type=float, metavar=("START", "END"),
+                         help="只保留 ftrace 时间戳 (秒) 在 [START, END] 内的事件")
+
     args = parser.parse_args()
+    start_s, end_s = args.window or (None, None)
+    event_filter = EventFilter(args.events, args.cpus, args.pids, args.comms, start_s, end_s)
+    if event_filter.is_empty:
+        event_filter = None
 
     # 解析基准时间
     base_dt = datetime.fromisoformat(args.base_time.replace('Z', '+00:00'))
@@ -24,53 +456,62 @@ def main():
         print(f"错误: 输入文件不存在: {args.input}")
         return
 
+    if args.follow:
+        if args.jobs > 1:
+            parser.error("--follow 不支持 --jobs")
+        print(f"跟踪转换: {args.input} -> {args.output} (Ctrl-C 停止)")
+        # SIGTERM 与 Ctrl-C 一样中断跟踪；检查点之后未完成的批次会在下次启动时重做
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        start_time = time.time()
+        try:
+            count = follow(args.input, args.output, base_dt, args.base_time, args.checkpoint,
+                           args.poll_interval, args.idle_exit, event_filter=event_filter)
+        except KeyboardInterrupt:
+            print("\n已停止跟踪")
+            return
+        except ValueError as e:
+            print(f"错误: {e}")
+            return
+        print(f"跟踪结束，本次转换 {count} 条记录，耗时 {time.time() - start_time:.2f} 秒")
+        return
+
     file_size = os.path.getsize(args.input)
-    print(f"开始转换: {args.input} ({file_size / 1024 / 1024:.2f} MB) -> {args.output}")
+    codec = compression(args.input)
+    print(f"开始转换: {args.input} ({file_size / 1024 / 1024:.2f} MB{f', {codec}' if codec else ''}) -> {args.output}")
+    if codec and args.jobs > 1:
+        # 压缩流只能顺序读取；后台线程解压已与解析重叠
+        print("压缩的输入按顺序流式解压转换，忽略 --jobs")
+        args.jobs = 1
 
-    count = 0
     start_time = time.time()
-    
-    # 写入第一行 window 信息
-    window_start = args.base_time
-    window_end_dt = base_dt + timedelta(minutes=30)
-    window_end = window_end_dt.strftime("%Y-%m-%dT%H:%M:%SZ")
-
-    # 使用较大的缓冲区 (8MB) 提高 I/O 性能
-    with open(args.input, 'r', encoding='utf-8', buffering=8*1024*1024) as fin, \
-         open(args.output, 'w', encoding='utf-8', buffering=8*1024*1024) as fout:
-        
-        fout.write(f"window={window_start}-{window_end} start_utc={window_start} end_utc={window_end} tag=ftrace_transform\n")
-
-        # 为了极致性能，将循环内的逻辑尽量展平，减少函数调用
-        for line in fin:
-            # 快速过滤非数据行
-            if not line or line[0] == '#' or line[0] == '\n':
-                continue
-            
-            # 过滤掉 buffer started 等干扰行，但不应过滤带空格的正常数据行
-            if 'buffer started' in line:
-                continue
 
-            match = FTRACE_PATTERN.match(line)
-            if not match:
-                continue
+    ranges = None
+    if event_filter is not None:
+        print(f"过滤条件: {event_filter.describe()}")
+        # 时间窗口/CPU/PID 借助索引只读取相关的块（首次使用时建立索引）
+        ranges = event_filter.index_ranges(args.input, args.jobs)
+        if ranges is not None:
+            selected = sum(end - start for start, end in ranges)
+            print(f"索引下推: 读取 {selected / 1024 / 1024:.2f} MB / {file_size / 1024 / 1024:.2f} MB "
+                  f"({len(ranges)} 个字节范围)")
+
+    def progress(count):
+        elapsed = time.time() - start_time
+        speed = count / elapsed if elapsed > 0 else 0
+        print(f"已处理 {count} 条记录... 当前速度: {speed:.0f} 条/秒")
+
+    # 输出文件名以 .gz/.zst 结尾时压缩写出（压缩在后台线程中进行）
+    with open_output(args.output, buffering=OUTPUT_BUFFER) as fout:
+        # 写入第一行 window 信息
+        fout.write(window_header(base_dt, args.base_time))
 
-            data = match.groupdict()
-            
-            # 时间转换优化：避免在循环中重复创建 timedelta 对象（可选，但这里 timestamp_s 是变的）
-            timestamp_s = float(data['timestamp'])
-            event_dt = base_dt + timedelta(seconds=timestamp_s)
-            ts_str = event_dt.strftime("%Y-%m-%dT%H:%M:%SZ")
-            
-            # 组装输出行
-            fout.write(f"{ts_str} ftrace: [CPU {data['cpu']}] {data['task']}-{data['pid']}: {data['message']}\n")
-            
-            count += 1
-            # 每 100,000 行打印一次进度
-            if count % 100000 == 0:
-                elapsed = time.time() - start_time
-                speed = count / elapsed if elapsed > 0 else 0
-                print(f"已处理 {count} 条记录... 当前速度: {speed:.0f} 条/秒")
+        if args.jobs > 1:
+            print(f"使用 {args.jobs} 个进程并行转换...")
+            count = convert_parallel(args.input, fout, base_dt, args.jobs, progress, event_filter, ranges)
+        elif ranges is not None:
+            count = convert_ranges(args.input, ranges, base_dt, fout, progress, event_filter)
+        else:
+            count = convert_range(args.input, 0, None, base_dt, fout, progress, event_filter)
 
     end_time = time.time()
     duration = end_time - start_time